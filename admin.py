@@ -1,8 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, Response, stream_with_context
 from flask_login import login_required, current_user
 from models import User, Donation, db
+from queries import donation_listing
+from querycount import query_budget
+from dbrouting import read_only
+from bulk import EXPORT_FORMATS, export_query
+import stats as platform_stats
+import rollups
+import userstats
+from cache import invalidate
+import events
 from functools import wraps
-from sqlalchemy import func   # 🔹 NEW: for aggregation (counts, top lists)
+from sqlalchemy import case, func   # 🔹 NEW: for aggregation (counts, top lists)
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -21,9 +32,10 @@ def admin_required(f):
 @admin_bp.route('/users')
 @login_required
 @admin_required
+@read_only
 def users():
     page = request.args.get('page', 1, type=int)
-    users = User.query.order_by(User.created_at.desc()).paginate(
+    users = User.query.options(joinedload(User.stats)).order_by(User.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False
     )
     return render_template('admin/users.html', users=users)
@@ -33,11 +45,13 @@ def users():
 @admin_bp.route('/donations')
 @login_required
 @admin_required
+@read_only
+@query_budget(4)
 def donations():
     page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', 'all')
     
-    query = Donation.query
+    query = donation_listing('admin')
     if status_filter != 'all':
         query = query.filter_by(status=status_filter)
     
@@ -52,6 +66,26 @@ def donations():
     )
 
 
+# 📤 Streaming export of all donations (or one status) as CSV or NDJSON
+@admin_bp.route('/donations/export')
+@login_required
+@admin_required
+@read_only
+def export_donations():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    status_filter = request.args.get('status', 'all')
+    
+    writer, mimetype = EXPORT_FORMATS[export_format]
+    query = export_query(None if status_filter == 'all' else status_filter)
+    return Response(
+        stream_with_context(writer(query)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=donations.{export_format}'}
+    )
+
+
 # ✅ Update donation status (already good)
 @admin_bp.route('/donation/<int:id>/update_status', methods=['POST'])
 @login_required
@@ -60,9 +94,16 @@ def update_donation_status(id):
     donation = Donation.query.get_or_404(id)
     new_status = request.form.get('status')
     
-    if new_status in ['active', 'claimed', 'completed', 'removed']:
+    if new_status in platform_stats.DONATION_STATUSES:
+        platform_stats.record_status_change(donation.status, new_status)
+        userstats.record_status_change([donation], donation.status, new_status)
+        if 'expired' in (donation.status, new_status) and donation.status != new_status:
+            # The expired trend counts donations whose status is 'expired'
+            rollups.record('expired', [donation], sign=1 if new_status == 'expired' else -1)
         donation.status = new_status
         db.session.commit()
+        invalidate('donations')
+        events.publish('donation.status', ids=[id], status=new_status)
         flash(f'Donation status updated to {new_status}', 'success')
     else:
         flash('Invalid status', 'danger')
@@ -70,26 +111,59 @@ def update_donation_status(id):
     return redirect(url_for('admin.donations'))
 
 
+RESCUED_STATUSES = ('claimed', 'completed')
+
+
+def _rescued_sums():
+    """Kilograms (and litres) and meals rescued, as aggregate columns over
+    the joined donations' parsed quantities (see quantities.py)"""
+    rescued = Donation.status.in_(RESCUED_STATUSES)
+    return (
+        func.coalesce(func.sum(case(
+            (rescued & Donation.quantity_unit.in_(('kg', 'l')), Donation.quantity_value)
+        )), 0).label('kg_rescued'),
+        func.coalesce(func.sum(case(
+            (rescued & (Donation.quantity_unit == 'meals'), Donation.quantity_value)
+        )), 0).label('meals_rescued'),
+    )
+
+
 # 📊 NEW: Admin stats page – NGOs, restaurants, orders given/taken
 @admin_bp.route('/stats')
 @login_required
 @admin_required
+@query_budget(5)
 def stats():
-    # Overall counts
-    total_users = User.query.count()
-    total_restaurants = User.query.filter_by(role='restaurant').count()
-    total_ngos = User.query.filter_by(role='ngo').count()
+    # Overall counts, precomputed in the stat_counter table
+    counts = platform_stats.get_counts()
 
-    total_donations = Donation.query.count()
-    active_donations = Donation.query.filter_by(status='active').count()
-    claimed_donations = Donation.query.filter_by(status='claimed').count()
-    completed_donations = Donation.query.filter_by(status='completed').count()
+    # Food rescued (claimed or completed donations) per parsed unit; litres
+    # are counted as kilograms. Reads only ix_donation_status_unit_value.
+    rescued = (
+        db.session.query(
+            Donation.quantity_unit,
+            func.count(Donation.id),
+            func.sum(Donation.quantity_value)
+        )
+        .filter(Donation.status.in_(RESCUED_STATUSES))
+        .group_by(Donation.quantity_unit)
+        .all()
+    )
+    rescued_totals = {'kg': 0.0, 'meals': 0.0, 'unparsed': 0}
+    for unit, count, total in rescued:
+        if unit in ('kg', 'l'):
+            rescued_totals['kg'] += total or 0
+        elif unit == 'meals':
+            rescued_totals['meals'] += total or 0
+        else:
+            rescued_totals['unparsed'] += count
 
     # Top 5 restaurants by number of donations given
     top_restaurants = (
         db.session.query(
             User,
-            func.count(Donation.id).label('donations_given')
+            func.count(Donation.id).label('donations_given'),
+            *_rescued_sums()
         )
         .join(Donation, Donation.restaurant_id == User.id)
         .filter(User.role == 'restaurant')
@@ -103,7 +177,8 @@ def stats():
     top_ngos = (
         db.session.query(
             User,
-            func.count(Donation.id).label('donations_taken')
+            func.count(Donation.id).label('donations_taken'),
+            *_rescued_sums()
         )
         .join(Donation, Donation.claimed_by_id == User.id)
         .filter(User.role == 'ngo')
@@ -115,13 +190,71 @@ def stats():
 
     return render_template(
         'admin/stats.html',
-        total_users=total_users,
-        total_restaurants=total_restaurants,
-        total_ngos=total_ngos,
-        total_donations=total_donations,
-        active_donations=active_donations,
-        claimed_donations=claimed_donations,
-        completed_donations=completed_donations,
+        total_users=counts['users_total'],
+        total_restaurants=counts['users_restaurant'],
+        total_ngos=counts['users_ngo'],
+        total_donations=counts['donations_total'],
+        active_donations=counts['donations_active'],
+        claimed_donations=counts['donations_claimed'],
+        completed_donations=counts['donations_completed'],
+        expired_donations=counts['donations_expired'],
         top_restaurants=top_restaurants,
         top_ngos=top_ngos,
+        rescued_totals=rescued_totals,
+    )
+
+
+# Default and largest ranges, in days, per granularity
+TREND_DAYS = {'day': (30, 366), 'hour': (2, 14)}
+
+
+# 📈 Trends: posted / claimed / expired and claim latency over time, read
+# only from the rollup tables (see rollups.py)
+@admin_bp.route('/trends')
+@login_required
+@admin_required
+@read_only
+@query_budget(6)
+def trends():
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in rollups.GRANULARITIES:
+        granularity = 'day'
+    dimension = request.args.get('dimension', 'all')
+    if dimension not in rollups.DIMENSIONS:
+        dimension = 'all'
+    key = request.args.get('key', '') if dimension != 'all' else ''
+    default_days, max_days = TREND_DAYS[granularity]
+    days = max(1, min(request.args.get('days', default_days, type=int), max_days))
+
+    step = rollups.GRANULARITIES[granularity]
+    end = rollups.bucket_start(datetime.utcnow(), granularity) + step
+    start = end - timedelta(days=days)
+
+    # Without a key, chart the whole platform and list the busiest members
+    # of the dimension to pick from
+    if key:
+        points, median = rollups.series(granularity, dimension, key, start, end)
+    else:
+        points, median = rollups.series(granularity, 'all', '', start, end)
+    leaders = rollups.breakdown(granularity, dimension, start, end) if dimension != 'all' else []
+
+    names = {}
+    if dimension in ('restaurant', 'ngo'):
+        ids = [int(k) for k in {key, *(row['key'] for row in leaders)} if k.isdigit()]
+        if ids:
+            names = {str(user_id): name for user_id, name in
+                     db.session.query(User.id, User.name).filter(User.id.in_(ids))}
+
+    return render_template(
+        'admin/trends.html',
+        granularity=granularity,
+        dimension=dimension,
+        key=key,
+        days=days,
+        max_days=max_days,
+        points=points,
+        totals={name: sum(point[name] for point in points) for name in ('posted', 'claimed', 'expired')},
+        median=median,
+        leaders=leaders,
+        names=names,
     )
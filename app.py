@@ -1,9 +1,30 @@
 import os
 from flask import Flask, render_template, redirect, url_for
 from flask_login import LoginManager, login_required, current_user
+from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 
-from models import db, User, Donation
+from models import db, Donation
+from queries import active_listing, donation_listing
+from querycount import init_query_counter, query_budget
+from dbrouting import REPLICA_BIND, engine_options, init_routing, read_only
+from metrics import init_metrics
+from notifications import init_notifications
+from geo import init_geo, nearest_donations
+from stats import get_counts, init_stats
+from cache import cached_response, init_cache
+from usercache import init_user_cache, load_user
+from images import init_images
+from assets import init_assets
+from expiry import init_expiry
+from events import init_events
+from bulk import init_bulk
+from timeleft import countdown, time_left, utc_timestamp
+from matching import init_matching
+from quantities import init_quantities
+from rollups import init_rollups
+from userstats import get_user_stats, init_user_stats
 from auth import auth_bp
 from donations import donations_bp
 from admin import admin_bp
@@ -11,6 +32,8 @@ from admin import admin_bp
 # Load .env for local development (Railway will inject env vars itself)
 load_dotenv()
 
+migrate = Migrate()
+
 
 def create_app():
     app = Flask(__name__)
@@ -20,6 +43,14 @@ def create_app():
         "SECRET_KEY", "dev-secret-key-change-this"
     )
 
+    # Proxies in front of the app (Railway's router is one) whose
+    # X-Forwarded-For/-Proto headers are trusted, so request.remote_addr is
+    # the client's address, e.g. for login rate limits. 0 when clients
+    # connect directly, or they could pick their own address.
+    proxy_hops = int(os.getenv("PROXY_FIX_HOPS", 1))
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops)
+
     # Use DATABASE_URL from environment (Railway sets this for Postgres)
     database_url = os.getenv(
         "DATABASE_URL",
@@ -34,13 +65,154 @@ def create_app():
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
+    # ---------- DATABASE POOL ----------
+    pool = dict(
+        pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 300)),
+        # Postgres only; 0 means no limit
+        statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0)),
+    )
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url, **pool)
+
+    # Optional read replica for @read_only views (see dbrouting.py)
+    replica_url = os.getenv("DATABASE_REPLICA_URL")
+    if replica_url:
+        if replica_url.startswith("postgres://"):
+            replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+        app.config["SQLALCHEMY_BINDS"] = {
+            REPLICA_BIND: {"url": replica_url, **engine_options(replica_url, **pool)},
+        }
+    # Seconds a client reads from the primary after writing something
+    app.config["REPLICA_STICKY_SECONDS"] = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+
+    # Fail (instead of just logging) when a view exceeds its @query_budget;
+    # meant for test runs
+    app.config["QUERY_BUDGET_STRICT"] = os.getenv("QUERY_BUDGET_STRICT") == "1"
+    app.config["QUERY_COUNT_HEADER"] = os.getenv("QUERY_COUNT_HEADER") == "1"
+
+    # ---------- METRICS ----------
+    # Prometheus-format /metrics; see metrics.py
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "1") == "1"
+    # Bearer token scrapers must send; /metrics isn't served without one
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+    # Log requests slower than this many seconds with their SQL (0: off)
+    app.config["SLOW_REQUEST_SECONDS"] = float(os.getenv("SLOW_REQUEST_SECONDS", 0))
+
+    # ---------- PASSWORDS ----------
+    # Any werkzeug method; existing hashes are upgraded at the next login
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    # "thread", "process" or "inline"
+    app.config["PASSWORD_HASH_POOL"] = os.getenv("PASSWORD_HASH_POOL", "thread")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    # Hashes queued beyond this are refused with a "busy" page
+    app.config["PASSWORD_HASH_MAX_PENDING"] = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 16))
+    # "<attempts>/<seconds>"; "0" turns a limit off
+    app.config["LOGIN_RATE_LIMIT_IP"] = os.getenv("LOGIN_RATE_LIMIT_IP", "20/300")
+    app.config["LOGIN_RATE_LIMIT_ACCOUNT"] = os.getenv("LOGIN_RATE_LIMIT_ACCOUNT", "5/300")
+
+    # ---------- NOTIFICATIONS ----------
+    # "console" or "smtp" (see notifications.BACKENDS)
+    app.config["NOTIFICATION_BACKEND"] = os.getenv("NOTIFICATION_BACKEND", "console")
+    # "thread": deliver from background threads in this process
+    # "off": leave it to `flask deliver-notifications`
+    app.config["NOTIFICATION_WORKER"] = os.getenv("NOTIFICATION_WORKER", "thread")
+    app.config["NOTIFICATION_WORKERS"] = int(os.getenv("NOTIFICATION_WORKERS", 2))
+    app.config["NOTIFICATION_BATCH_SIZE"] = int(os.getenv("NOTIFICATION_BATCH_SIZE", 100))
+    for key in ("MAIL_SERVER", "MAIL_PORT", "MAIL_USE_TLS", "MAIL_USERNAME",
+                "MAIL_PASSWORD", "MAIL_DEFAULT_SENDER"):
+        app.config[key] = os.getenv(key)
+
+    # ---------- GEO ----------
+    app.config["GEOCODER"] = os.getenv("GEOCODER", "offline")
+    app.config["NGO_NEARBY_RADIUS_KM"] = float(os.getenv("NGO_NEARBY_RADIUS_KM", 5))
+
+    # ---------- MATCHING ----------
+    # "shortlist": notify only the best-matched NGOs; "all": every NGO
+    app.config["MATCH_NOTIFY"] = os.getenv("MATCH_NOTIFY", "shortlist")
+    app.config["MATCH_SHORTLIST_SIZE"] = int(os.getenv("MATCH_SHORTLIST_SIZE", 10))
+    app.config["MATCH_DISTANCE_KM"] = float(os.getenv("MATCH_DISTANCE_KM", 5))
+    app.config["MATCH_MAX_DISTANCE_KM"] = float(os.getenv("MATCH_MAX_DISTANCE_KM", 50))
+    # Claims this recent count towards an NGO's preferences and load
+    app.config["MATCH_HISTORY_DAYS"] = int(os.getenv("MATCH_HISTORY_DAYS", 90))
+    # Seconds each process reuses its NGO profiles before reloading them
+    app.config["MATCH_PROFILE_TTL"] = int(os.getenv("MATCH_PROFILE_TTL", 300))
+
+    # ---------- RESPONSE CACHE ----------
+    # "memory" (per process), "redis" (shared between processes) or "null"
+    app.config["CACHE_BACKEND"] = os.getenv("CACHE_BACKEND", "memory")
+    app.config["CACHE_DEFAULT_TIMEOUT"] = int(os.getenv("CACHE_DEFAULT_TIMEOUT", 60))
+    app.config["CACHE_MAX_ENTRIES"] = int(os.getenv("CACHE_MAX_ENTRIES", 512))
+    app.config["CACHE_REDIS_URL"] = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+    # ---------- USER CACHE ----------
+    # Snapshots of signed-in users; "memory", "redis" or "null"
+    app.config["USER_CACHE_BACKEND"] = os.getenv("USER_CACHE_BACKEND", "memory")
+    app.config["USER_CACHE_TIMEOUT"] = int(os.getenv("USER_CACHE_TIMEOUT", 300))
+    app.config["USER_CACHE_MAX_ENTRIES"] = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+    app.config["USER_CACHE_REDIS_URL"] = os.getenv("USER_CACHE_REDIS_URL", app.config["CACHE_REDIS_URL"])
+
+    # ---------- EXPIRY ----------
+    # "thread": sweep from a background thread in this process
+    # "off": leave it to `flask expire-donations --loop`
+    app.config["EXPIRY_SWEEPER"] = os.getenv("EXPIRY_SWEEPER", "thread")
+    app.config["EXPIRY_SWEEP_INTERVAL"] = int(os.getenv("EXPIRY_SWEEP_INTERVAL", 60))
+    app.config["EXPIRY_BATCH_SIZE"] = int(os.getenv("EXPIRY_BATCH_SIZE", 1000))
+
+    # ---------- LIVE EVENTS ----------
+    # "memory" (per process) or "redis" (shared between worker processes)
+    app.config["EVENT_BUS"] = os.getenv("EVENT_BUS", "memory")
+    app.config["EVENT_REDIS_URL"] = os.getenv("EVENT_REDIS_URL", app.config["CACHE_REDIS_URL"])
+    app.config["EVENT_STREAM_HEARTBEAT"] = int(os.getenv("EVENT_STREAM_HEARTBEAT", 15))
+    # Streams are closed after this many seconds and the browser reconnects
+    app.config["EVENT_STREAM_MAX_AGE"] = int(os.getenv("EVENT_STREAM_MAX_AGE", 600))
+
+    # ---------- IMAGES ----------
+    app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "static", "uploads")
+    # Untouched originals (with their EXIF data) are kept out of static/
+    app.config["IMAGE_ORIGINALS_FOLDER"] = os.getenv(
+        "IMAGE_ORIGINALS_FOLDER", os.path.join(app.instance_path, "uploads")
+    )
+    # "thread": resize in a background pool; "sync": within the request
+    app.config["IMAGE_PIPELINE"] = os.getenv("IMAGE_PIPELINE", "thread")
+    app.config["IMAGE_WORKERS"] = int(os.getenv("IMAGE_WORKERS", 2))
+
+    # ---------- STATIC ASSETS ----------
+    # Output of `flask assets-build`; see assets.py
+    app.config["ASSETS_FOLDER"] = os.getenv(
+        "ASSETS_FOLDER", os.path.join(app.root_path, "static", "dist")
+    )
+    # "0" links the source files under /static instead, e.g. while editing them
+    app.config["USE_BUILT_ASSETS"] = os.getenv("USE_BUILT_ASSETS", "1") == "1"
+
+    # ---------- BULK IMPORT / EXPORT ----------
+    app.config["BULK_IMPORT_MAX_ROWS"] = int(os.getenv("BULK_IMPORT_MAX_ROWS", 1000))
+    # Rows per executemany INSERT
+    app.config["BULK_IMPORT_CHUNK_SIZE"] = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", 500))
+    # Rows fetched per round trip while streaming an export
+    app.config["BULK_EXPORT_BATCH_SIZE"] = int(os.getenv("BULK_EXPORT_BATCH_SIZE", 1000))
 
     # ---------- EXTENSIONS ----------
     db.init_app(app)
+    migrate.init_app(app, db)
+    init_metrics(app)
+    init_routing(app)
+    init_query_counter(app)
+    init_notifications(app)
+    init_geo(app)
+    init_stats(app)
+    init_cache(app)
+    init_user_cache(app)
+    init_images(app)
+    init_assets(app)
+    init_expiry(app)
+    init_events(app)
+    init_bulk(app)
+    init_matching(app)
+    init_quantities(app)
+    init_rollups(app)
+    init_user_stats(app)
 
     # Flask-Login setup
     login_manager = LoginManager()
@@ -49,9 +221,8 @@ def create_app():
     login_manager.login_message = "Please log in to access this page."
     login_manager.login_message_category = "info"
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    # Read-only snapshots from the user cache (see usercache.py)
+    login_manager.user_loader(load_user)
 
     # ---------- BLUEPRINTS ----------
     app.register_blueprint(auth_bp, url_prefix="/auth")
@@ -59,70 +230,88 @@ def create_app():
     app.register_blueprint(admin_bp, url_prefix="/admin")
 
     # ---------- JINJA FILTERS ----------
+    # One clock reading per request; countdown.js keeps labels current
     @app.template_filter("time_left")
     def time_left_filter(donation):
-        return donation.time_left()
+        return time_left(donation.expiry_time)
+
+    @app.template_filter("countdown")
+    def countdown_filter(donation):
+        return countdown(donation.expiry_time)
+
+    app.add_template_filter(utc_timestamp)
 
     # ---------- ROUTES ----------
     @app.route("/")
+    @read_only
+    @query_budget(2)
+    @cached_response("donations", unless=lambda: current_user.is_authenticated)
     def index():
         if current_user.is_authenticated:
             return redirect(url_for("dashboard"))
 
-        recent_donations = (
-            Donation.query.filter_by(status="active")
-            .order_by(Donation.created_at.desc())
-            .limit(6)
-            .all()
-        )
+        recent_donations = active_listing("index").limit(6).all()
         return render_template("index.html", donations=recent_donations)
 
     @app.route("/dashboard")
     @login_required
+    # NGO: user, counters row, available, claims, plus up to four
+    # nearby-search rings and one fetch
+    @query_budget(10)
     def dashboard():
         if current_user.role == "restaurant":
             donations = (
-                current_user.donations.order_by(Donation.created_at.desc())
+                donation_listing(
+                    "restaurant_dashboard",
+                    Donation.query.filter_by(restaurant_id=current_user.id),
+                )
+                .order_by(Donation.created_at.desc())
                 .limit(10)
                 .all()
             )
             return render_template(
-                "dashboard/restaurant.html", donations=donations
+                "dashboard/restaurant.html",
+                donations=donations,
+                stats=get_user_stats(current_user.id),
             )
 
         elif current_user.role == "ngo":
             available_donations = (
-                Donation.query.filter_by(status="active")
-                .order_by(Donation.created_at.desc())
-                .limit(10)
-                .all()
+                active_listing("ngo_available").limit(10).all()
             )
             claimed_donations = (
-                current_user.claimed_donations.order_by(
-                    Donation.claimed_at.desc()
+                donation_listing(
+                    "ngo_claimed",
+                    Donation.query.filter_by(claimed_by_id=current_user.id),
                 )
+                .order_by(Donation.claimed_at.desc())
                 .limit(10)
                 .all()
             )
+            nearby_donations = []
+            if current_user.latitude is not None:
+                nearby_donations = nearest_donations(
+                    current_user.latitude,
+                    current_user.longitude,
+                    radius_km=app.config["NGO_NEARBY_RADIUS_KM"],
+                    k=6,
+                )
             return render_template(
                 "dashboard/ngo.html",
                 available_donations=available_donations,
                 claimed_donations=claimed_donations,
+                nearby_donations=nearby_donations,
+                stats=get_user_stats(current_user.id),
             )
 
         elif current_user.role == "admin":
-            total_users = User.query.count()
-            total_donations = Donation.query.count()
-            active_donations = Donation.query.filter_by(status="active").count()
-            claimed_donations = (
-                Donation.query.filter_by(status="claimed").count()
-            )
+            counts = get_counts()
             return render_template(
                 "dashboard/admin.html",
-                total_users=total_users,
-                total_donations=total_donations,
-                active_donations=active_donations,
-                claimed_donations=claimed_donations,
+                total_users=counts["users_total"],
+                total_donations=counts["donations_total"],
+                active_donations=counts["donations_active"],
+                claimed_donations=counts["donations_claimed"],
             )
 
         return render_template("dashboard/default.html")
@@ -0,0 +1,269 @@
+"""ASGI entry point.
+
+    uvicorn asgi:app --workers 4
+
+The read-heavy public routes (``index``, ``donations.list_donations``,
+``donations.detail`` and ``donations.api_donations``) are served by native
+coroutines that query the database through SQLAlchemy's asyncio extension,
+so a worker keeps serving other requests while it waits on the database.
+They reuse the Flask app's query builders, templates, sessions, login and
+response cache, and return byte-for-byte the same pages as the WSGI app.
+
+Every other route (forms, claims, admin, the SSE stream, static files) is
+handed to the ordinary Flask app through ``asgiref``'s WSGI adapter, which
+runs it in a thread pool. ``app:app`` under gunicorn remains the default
+deployment; both can run against the same database.
+
+The async driver is derived from ``DATABASE_URL``: ``aiosqlite`` for SQLite
+and ``asyncpg`` for Postgres, or set ``ASYNC_DATABASE_URL`` explicitly.
+"""
+import os
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import abort, g, jsonify, render_template, redirect, request, session, url_for
+from flask_login import current_user
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app
+from cache import cached_response
+from donations import LIST_PER_PAGE, api_query, api_response, list_query
+from models import Donation
+from queries import active_listing, donation_listing
+from usercache import cached_user, remember_user, snapshot_query
+
+# paginate()'s default max_per_page
+MAX_PER_PAGE = 100
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    """``url`` with its driver swapped for an asyncio one"""
+    scheme, sep, rest = url.partition('://')
+    dialect = scheme.split('+')[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver for {scheme} databases; set ASYNC_DATABASE_URL")
+    return ASYNC_DRIVERS[dialect] + sep + rest
+
+
+class AsyncDatabase:
+    """Runs Flask-SQLAlchemy ``Query`` objects on an async engine.
+
+    Each call uses its own short session, so results come back detached:
+    anything a template renders must be eager loaded, which
+    ``queries.donation_listing`` already does for every view.
+    """
+
+    def __init__(self, url, engine_options=None):
+        self.url = url
+        self.engine_options = engine_options or {}
+        self.engine = None
+        self._sessionmaker = None
+
+    @property
+    def sessionmaker(self):
+        # Created on first use, inside the server's event loop
+        if self._sessionmaker is None:
+            self.engine = create_async_engine(self.url, **self.engine_options)
+            self._sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        return self._sessionmaker
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def all(self, query):
+        async with self.sessionmaker() as session:
+            result = await session.scalars(query.statement)
+            return result.unique().all()
+
+    async def first(self, query):
+        rows = await self.all(query.limit(1))
+        return rows[0] if rows else None
+
+    async def first_row(self, statement):
+        async with self.sessionmaker() as session:
+            return (await session.execute(statement)).first()
+
+    async def count(self, query):
+        async with self.sessionmaker() as session:
+            return await session.scalar(
+                select(func.count()).select_from(query.order_by(None).statement.subquery())
+            )
+
+    async def paginate(self, query, page, per_page):
+        """Same as ``query.paginate(page=page, per_page=per_page, error_out=False)``"""
+        # Out-of-range values are clamped, as paginate() does without error_out
+        page = page if page and page > 0 else 1
+        per_page = min(per_page, MAX_PER_PAGE) if per_page and per_page > 0 else 20
+        items = await self.all(query.limit(per_page).offset((page - 1) * per_page))
+        total = await self.count(query)
+        return PrefetchedPagination(page=page, per_page=per_page, error_out=False,
+                                    items=items, total=total)
+
+
+class PrefetchedPagination(Pagination):
+    """A ``Pagination`` over items and a total fetched beforehand"""
+
+    def _query_items(self):
+        return self._query_args['items']
+
+    def _query_count(self):
+        return self._query_args['total']
+
+
+db = AsyncDatabase(
+    os.getenv('ASYNC_DATABASE_URL')
+    or async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+    # Same pool settings as the sync engine; connect_args are driver specific
+    {key: value for key, value in flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'].items()
+     if key != 'connect_args'},
+)
+
+
+# ---------- VIEWS ----------
+# Async twins of the Flask views with the same endpoint names
+
+@cached_response('donations', unless=lambda: current_user.is_authenticated)
+async def index():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+
+    recent_donations = await db.all(active_listing('index').limit(6))
+    return render_template('index.html', donations=recent_donations)
+
+
+async def list_donations():
+    query, page, filters = list_query(request.args)
+    donations = await db.paginate(query, page, LIST_PER_PAGE)
+    return render_template('donations/list.html', donations=donations, **filters)
+
+
+async def detail(id):
+    donation = await db.first(donation_listing('detail').filter(Donation.id == id))
+    if donation is None:
+        abort(404)
+    return render_template('donations/detail.html', donation=donation)
+
+
+@cached_response('donations')
+async def api_donations():
+    donations = await db.all(api_query())
+    return jsonify(api_response(donations))
+
+
+ASYNC_VIEWS = {
+    'index': (index, False),
+    'donations.list_donations': (list_donations, True),
+    'donations.detail': (detail, True),
+    'donations.api_donations': (api_donations, False),
+}
+
+
+# ---------- DISPATCH ----------
+
+async def _prefetch_user():
+    """Load the session's user with an async query on a user cache miss
+    (see usercache.py). Flask-Login then restores it as usual, and its
+    ``load_user`` call finds it in ``g`` without a query. Returns False
+    when only the sync path can restore the user: from a remember-me
+    cookie, or when the session's user no longer exists."""
+    user_id = session.get('_user_id')
+    if user_id is None:
+        cookie_name = flask_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token')
+        return cookie_name not in request.cookies
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return True
+    user = cached_user(user_id)
+    if user is None:
+        row = await db.first_row(snapshot_query(user_id))
+        if row is None:
+            return False
+        user = remember_user(row)
+    g.prefetched_user = user
+    return True
+
+
+async def _dispatch(view, login_required, view_args):
+    """``Flask.full_dispatch_request`` for an async view"""
+    try:
+        rv = flask_app.preprocess_request()
+        if rv is None:
+            if login_required and not current_user.is_authenticated:
+                rv = flask_app.login_manager.unauthorized()
+            else:
+                rv = await view(**view_args)
+    except Exception as e:
+        rv = flask_app.handle_user_exception(e)
+    return flask_app.finalize_request(rv)
+
+
+async def _send(send, response, environ):
+    status, headers = response.status_code, response.get_wsgi_headers(environ)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                    for k, v in headers.to_wsgi_list()],
+    })
+    await send({'type': 'http.response.body', 'body': b''.join(response.get_app_iter(environ))})
+
+
+class AsyncFlask:
+    """Serve ``ASYNC_VIEWS`` natively and everything else through WSGI"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return await self.wsgi(scope, receive, send)
+
+        adapter = WsgiToAsgiInstance(self.flask_app)
+        adapter.scope = scope
+        environ = adapter.build_environ(scope, None)
+        try:
+            endpoint, view_args = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        if endpoint not in ASYNC_VIEWS:
+            return await self.wsgi(scope, receive, send)
+
+        view, login_required = ASYNC_VIEWS[endpoint]
+        ctx = self.flask_app.request_context(environ)
+        ctx.push()
+        try:
+            if await _prefetch_user():
+                try:
+                    response = await _dispatch(view, login_required, view_args)
+                except Exception as e:
+                    response = self.flask_app.handle_exception(e)
+                await _send(send, response, environ)
+                return
+        finally:
+            ctx.pop()
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await db.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncFlask(flask_app)
@@ -0,0 +1,282 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask assets-build`` copies the files under ``static/`` (not uploads)
+into ``ASSETS_FOLDER`` (``static/dist``) under names that include a hash of
+their content, and writes ``manifest.json`` mapping each source path to its
+built file:
+
+    static/css/custom.css       ->  static/dist/css/custom.3f9c0a1b2d4e.css
+                                    (+ .css.gz, and .css.br with ``brotli``)
+    static/images/logo.png      ->  static/dist/images/logo.81d2e7aa90c3.png
+                                    static/dist/images/logo.5c0f4b1e2a77.webp
+
+Text files get gzip and brotli copies, compressed once at build time.
+Images are scaled down to ``IMAGE_MAX_HEIGHT``, stripped of metadata,
+re-encoded with Pillow's optimizer and also written as WebP. The build is
+pure Python and needs no network or Node toolchain; brotli output needs
+``pip install brotli`` and is skipped without it.
+
+Templates link assets with ``asset_url('css/custom.css')`` (or
+``asset_image`` for a picture with its WebP source). ``/assets/<file>``
+serves the built files with the best encoding the browser accepts and a
+one-year immutable ``Cache-Control``: a changed file gets a new name, so
+browsers never need to revalidate. Without a manifest (or with
+``USE_BUILT_ASSETS=0`` while editing static files) the helpers fall back
+to plain ``/static`` URLs.
+
+Files of earlier builds are kept, so pages rendered before a deploy (for
+example from the response cache) still load their assets.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from io import BytesIO
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from PIL import Image, ImageOps
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+
+# Folders under static/ that are not part of the build
+SKIP_FOLDERS = ('uploads', 'dist')
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map', '.ico'}
+# Compressed copies are only kept when at most this share of the original
+MAX_COMPRESSED_RATIO = 0.9
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+OPTIMIZED_IMAGES = {'.png', '.jpg', '.jpeg'}
+# Twice the height templates show them at (navbar 32px, login and
+# register 90px), for high-density screens
+IMAGE_MAX_HEIGHT = {
+    'images/Food_rescue.png': 64,
+    'images/logo.png': 180,
+}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 85
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+# ---------- BUILD ----------
+
+def _fingerprinted(path, data):
+    stem, extension = posixpath.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _compress(data):
+    """{encoding: bytes} for the encodings worth serving"""
+    brotli = _brotli()
+    compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in compressed.items()
+            if len(body) <= len(data) * MAX_COMPRESSED_RATIO}
+
+
+def _optimize_image(path, data):
+    """(image bytes in the source format, WebP bytes): scaled down to
+    ``IMAGE_MAX_HEIGHT`` and without metadata. The source bytes are kept
+    when re-encoding doesn't make them smaller."""
+    with Image.open(BytesIO(data)) as original:
+        image_format = original.format
+        image = ImageOps.exif_transpose(original)
+        max_height = IMAGE_MAX_HEIGHT.get(path)
+        if max_height and image.height > max_height:
+            width = round(image.width * max_height / image.height)
+            image = image.resize((width, max_height), Image.LANCZOS)
+
+        optimized = BytesIO()
+        if image_format == 'JPEG':
+            image.convert('RGB').save(optimized, 'JPEG', quality=JPEG_QUALITY,
+                                      optimize=True, progressive=True)
+        else:
+            image.save(optimized, image_format, optimize=True)
+        webp = BytesIO()
+        image.save(webp, 'WEBP', quality=WEBP_QUALITY, method=6)
+
+    optimized = optimized.getvalue()
+    if len(optimized) >= len(data) and image.size == original.size:
+        optimized = data
+    return optimized, webp.getvalue()
+
+
+def _rewrite_css_urls(path, data, built):
+    """Point ``url(...)`` references in a stylesheet at built files"""
+    folder = posixpath.dirname(path)
+
+    def replace(match):
+        target = match.group(2)
+        if ':' in target or target.startswith(('/', '#')):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(folder, target))
+        if resolved not in built:
+            return match.group(0)
+        return f"url('{posixpath.relpath(built[resolved]['file'], folder)}')"
+
+    return _CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _sources(static_folder):
+    """Source paths under ``static_folder``, relative and with forward
+    slashes. Stylesheets come last so they can refer to built images."""
+    paths = []
+    for root, folders, files in os.walk(static_folder):
+        relative = os.path.relpath(root, static_folder)
+        if relative == '.':
+            folders[:] = [f for f in folders if f not in SKIP_FOLDERS]
+        folders[:] = [f for f in folders if not f.startswith('.')]
+        for name in files:
+            if not name.startswith('.'):
+                paths.append(posixpath.normpath(posixpath.join(relative.replace(os.sep, '/'), name)))
+    return sorted(paths, key=lambda path: (path.endswith('.css'), path))
+
+
+def _write(folder, path, data):
+    target = os.path.join(folder, *path.split('/'))
+    if os.path.exists(target):
+        # Same name, same content
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(target + '.tmp', target)
+
+
+def build(static_folder, output_folder):
+    """Build every asset under ``static_folder`` into ``output_folder`` and
+    write the manifest. Returns the manifest."""
+    built = {}
+
+    def add(path, data):
+        file = _fingerprinted(path, data)
+        _write(output_folder, file, data)
+        encodings = []
+        if posixpath.splitext(path)[1].lower() in COMPRESSIBLE:
+            compressed = _compress(data)
+            for encoding, suffix in ENCODINGS:
+                if encoding in compressed:
+                    _write(output_folder, file + suffix, compressed[encoding])
+                    encodings.append(encoding)
+        built[path] = {'file': file, 'size': len(data), 'encodings': encodings}
+
+    for path in _sources(static_folder):
+        with open(os.path.join(static_folder, *path.split('/')), 'rb') as f:
+            data = f.read()
+        extension = posixpath.splitext(path)[1].lower()
+        if extension in OPTIMIZED_IMAGES:
+            data, webp = _optimize_image(path, data)
+            add(posixpath.splitext(path)[0] + '.webp', webp)
+        elif extension == '.css':
+            data = _rewrite_css_urls(path, data, built)
+        add(path, data)
+
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(built, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return built
+
+
+def load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# ---------- TEMPLATES ----------
+
+def _manifest():
+    if not current_app.config['USE_BUILT_ASSETS']:
+        return {}
+    return current_app.extensions['assets']['manifest']
+
+
+def asset_url(path):
+    """URL of the built ``path`` (relative to static/), or its /static URL
+    when it hasn't been built"""
+    entry = _manifest().get(path)
+    if entry is None:
+        return url_for('static', filename=path)
+    return url_for('assets', filename=entry['file'])
+
+
+def asset_image(path):
+    """URLs for a static image: ``{'src', 'webp'}``, ``webp`` being None
+    when there is no built WebP copy"""
+    webp = _manifest().get(posixpath.splitext(path)[0] + '.webp')
+    return {
+        'src': asset_url(path),
+        'webp': url_for('assets', filename=webp['file']) if webp else None,
+    }
+
+
+# ---------- SERVING ----------
+
+def _encodings_by_file(manifest):
+    return {entry['file']: entry['encodings'] for entry in manifest.values()}
+
+
+def init_assets(app):
+    state = app.extensions['assets'] = {}
+
+    def reload():
+        state['manifest'] = load_manifest(app.config['ASSETS_FOLDER'])
+        state['encodings'] = _encodings_by_file(state['manifest'])
+
+    reload()
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.jinja_env.globals['asset_image'] = asset_image
+
+    @app.route('/assets/<path:filename>')
+    def assets(filename):
+        encoding = suffix = None
+        available = state['encodings'].get(filename, ())
+        for name, name_suffix in ENCODINGS:
+            if name in available and request.accept_encodings[name]:
+                encoding, suffix = name, name_suffix
+                break
+        response = send_from_directory(
+            app.config['ASSETS_FOLDER'], filename + (suffix or ''),
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            max_age=ASSET_MAX_AGE,
+        )
+        if encoding:
+            response.content_encoding = encoding
+        if available:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        return response
+
+    @app.cli.command('assets-build')
+    def assets_build():
+        """Fingerprint, optimize and precompress the files under static/."""
+        built = build(app.static_folder, app.config['ASSETS_FOLDER'])
+        reload()
+        if _brotli() is None:
+            click.echo('brotli is not installed; wrote gzip copies only')
+        for path, entry in sorted(built.items()):
+            encodings = ', '.join(entry['encodings']) or '-'
+            click.echo(f"{path} -> {entry['file']} ({entry['size']:,} bytes; {encodings})")
+        click.echo(f'Built {len(built)} assets into {app.config["ASSETS_FOLDER"]}')
@@ -1,11 +1,38 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_user, logout_user, login_required, current_user
+from math import ceil
 from models import User, db
 from forms import LoginForm, RegisterForm
+from geo import locate_user
+from matching import invalidate_profiles
+from passwords import HashingBusy, hash_password, needs_rehash
+from ratelimit import make_limiter
+import stats
+import userstats
 
 auth_bp = Blueprint('auth', __name__)
 
 
+@auth_bp.record_once
+def setup_limiters(state):
+    # Checked before any password is hashed: per client IP (every login and
+    # registration attempt) and per account (failed logins)
+    state.app.extensions['auth_limiters'] = {
+        'ip': make_limiter(state.app.config.get('LOGIN_RATE_LIMIT_IP')),
+        'account': make_limiter(state.app.config.get('LOGIN_RATE_LIMIT_ACCOUNT')),
+    }
+
+
+def _throttled(template, form, wait):
+    flash(f'Too many attempts. Please try again in {ceil(wait)} seconds.', 'danger')
+    return render_template(template, form=form), 429, {'Retry-After': str(ceil(wait))}
+
+
+def _busy(template, form):
+    flash('The server is busy. Please try again in a moment.', 'warning')
+    return render_template(template, form=form), 503, {'Retry-After': '5'}
+
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -13,13 +40,35 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        limiters = current_app.extensions['auth_limiters']
+        account = form.email.data.strip().lower()
+        wait = max(limiters['ip'].retry_after(request.remote_addr),
+                   limiters['account'].retry_after(account))
+        if wait:
+            return _throttled('auth/login.html', form, wait)
+        limiters['ip'].hit(request.remote_addr)
+
         user = User.query.filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except HashingBusy:
+            return _busy('auth/login.html', form)
+
+        if valid:
+            limiters['account'].reset(account)
+            if needs_rehash(user.password_hash):
+                # Hash parameters changed since this password was set
+                try:
+                    user.password_hash = hash_password(form.password.data)
+                    db.session.commit()
+                except HashingBusy:
+                    pass
             login_user(user)
             next_page = request.args.get('next')
             flash(f'Welcome back, {user.name}!', 'success')
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
         else:
+            limiters['account'].hit(account)
             flash('Invalid email or password', 'danger')
     
     return render_template('auth/login.html', form=form)
@@ -32,6 +81,12 @@ def register():
     
     form = RegisterForm()
     if form.validate_on_submit():
+        limiter = current_app.extensions['auth_limiters']['ip']
+        wait = limiter.retry_after(request.remote_addr)
+        if wait:
+            return _throttled('auth/register.html', form, wait)
+        limiter.hit(request.remote_addr)
+
         # Check if email already exists
         existing_user = User.query.filter_by(email=form.email.data).first()
         if existing_user:
@@ -53,10 +108,19 @@ def register():
         if hasattr(form, 'address'):
             user.address = form.address.data
 
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            return _busy('auth/register.html', form)
+        locate_user(user)
         
         db.session.add(user)
+        stats.record_user_created(user.role)
+        userstats.record_user_created(user)
         db.session.commit()
+        if user.role == 'ngo':
+            # Shortlists only reach NGOs in the profiles
+            invalidate_profiles()
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -0,0 +1 @@
+"""Benchmarks and seeded datasets for measuring how the app scales."""
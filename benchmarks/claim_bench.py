@@ -0,0 +1,212 @@
+"""Stress test donation claiming under contention.
+
+Every worker (a thread, or a process with --processes) is a different NGO
+that tries to claim the same set of donations, all starting at the same
+instant. Afterwards each donation must have exactly one winner, and it must
+be the NGO the database recorded as the claimer.
+
+    python -m benchmarks.claim_bench --workers 32 --donations 200
+    python -m benchmarks.claim_bench --mode batch --processes
+    python -m benchmarks.claim_bench --mode naive    # the old read-check-write claim
+
+The target database is wiped, so never point it at real data.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+BATCH_SIZE = 10
+
+
+def setup(workers, donations):
+    """Fresh database with one restaurant, ``workers`` NGOs and
+    ``donations`` active donations. Returns (ngo_ids, donation_ids)."""
+    from sqlalchemy import insert
+    from models import Donation, User, db
+    from benchmarks.seed import seed
+
+    seed(restaurants=1, ngos=workers, donations=0, echo=None)
+    restaurant_id = db.session.scalar(db.select(User.id).filter_by(role='restaurant'))
+    now = datetime.utcnow()
+    db.session.execute(insert(Donation), [{
+        'restaurant_id': restaurant_id,
+        'title': f'Contended donation {i}',
+        'description': 'Claimed by every benchmark worker at once.',
+        'food_type': 'Prepared Food',
+        'quantity': '10 plates',
+        'address': 'Madhapur',
+        'pickup_time': now,
+        'expiry_time': now + timedelta(days=1),
+        'status': 'active',
+        'created_at': now,
+    } for i in range(donations)])
+    db.session.commit()
+    ngo_ids = db.session.scalars(db.select(User.id).filter_by(role='ngo').order_by(User.id)).all()
+    donation_ids = db.session.scalars(db.select(Donation.id).order_by(Donation.id)).all()
+    return ngo_ids, donation_ids
+
+
+def _naive_claim(donation_id, ngo_id):
+    """The pre-atomic claim: read, check in Python, write"""
+    from models import Donation, db
+
+    donation = db.session.get(Donation, donation_id)
+    if donation.status != 'active' or not donation.is_available():
+        return False
+    donation.status = 'claimed'
+    donation.claimed_by_id = ngo_id
+    donation.claimed_at = datetime.utcnow()
+    return True
+
+
+def _attempt(mode, donation_ids, ngo_id):
+    from claims import claim_donation, claim_donations
+
+    if mode == 'batch':
+        return claim_donations(donation_ids, ngo_id)
+    claim = _naive_claim if mode == 'naive' else claim_donation
+    return [i for i in donation_ids if claim(i, ngo_id)]
+
+
+def run_worker(app, mode, ngo_id, donation_ids, barrier, seed):
+    """Claim every donation in a worker-specific order.
+
+    Returns (won ids, attempts, errors, start, end).
+    """
+    from sqlalchemy.exc import OperationalError
+    from models import db
+
+    order = list(donation_ids)
+    random.Random(seed).shuffle(order)
+    step = BATCH_SIZE if mode == 'batch' else 1
+    won, attempts, errors = [], 0, 0
+
+    with app.app_context():
+        barrier.wait()
+        start = time.time()
+        for i in range(0, len(order), step):
+            chunk = order[i:i + step]
+            attempts += len(chunk)
+            try:
+                claimed = _attempt(mode, chunk, ngo_id)
+                db.session.commit()
+                won.extend(claimed)
+            except OperationalError:
+                # e.g. SQLite "database is locked" under heavy write contention
+                db.session.rollback()
+                errors += len(chunk)
+        end = time.time()
+        db.session.remove()
+    return won, attempts, errors, start, end
+
+
+def _process_main(database_url, mode, ngo_id, donation_ids, barrier, seed, results):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['NOTIFICATION_WORKER'] = 'off'
+    from app import app
+
+    results.put((ngo_id, run_worker(app, mode, ngo_id, donation_ids, barrier, seed)))
+
+
+def run(app, database_url, mode, ngo_ids, donation_ids, processes):
+    """Run one worker per NGO. Returns {ngo_id: run_worker result}."""
+    if processes:
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(len(ngo_ids))
+        queue = context.Queue()
+        workers = [
+            context.Process(target=_process_main, args=(
+                database_url, mode, ngo_id, donation_ids, barrier, n, queue))
+            for n, ngo_id in enumerate(ngo_ids)
+        ]
+        for worker in workers:
+            worker.start()
+        results = dict(queue.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        return results
+
+    barrier = threading.Barrier(len(ngo_ids))
+    results = {}
+
+    def target(n, ngo_id):
+        results[ngo_id] = run_worker(app, mode, ngo_id, donation_ids, barrier, n)
+
+    threads = [threading.Thread(target=target, args=(n, ngo_id)) for n, ngo_id in enumerate(ngo_ids)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def verify(results, donation_ids):
+    """Problems found: donations with no winner, several winners, or a
+    winner that differs from the recorded claimer"""
+    from models import Donation, db
+
+    winners = defaultdict(list)
+    for ngo_id, (won, *_) in results.items():
+        for donation_id in won:
+            winners[donation_id].append(ngo_id)
+    recorded = dict(db.session.execute(
+        db.select(Donation.id, Donation.claimed_by_id).where(Donation.id.in_(donation_ids))
+    ).all())
+
+    problems = Counter()
+    for donation_id in donation_ids:
+        claimed_by = winners.get(donation_id, [])
+        if not claimed_by:
+            problems['no winner'] += 1
+        elif len(claimed_by) > 1:
+            problems['several winners'] += 1
+        elif recorded[donation_id] != claimed_by[0]:
+            problems['winner not recorded'] += 1
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/food_rescue_claim_bench.db')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--donations', type=int, default=100)
+    parser.add_argument('--mode', choices=['single', 'batch', 'naive'], default='single')
+    parser.add_argument('--processes', action='store_true',
+                        help='One process per worker instead of one thread.')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['NOTIFICATION_WORKER'] = 'off'
+    from app import app
+
+    with app.app_context():
+        ngo_ids, donation_ids = setup(args.workers, args.donations)
+
+    kind = 'processes' if args.processes else 'threads'
+    print(f'{args.workers} {kind} claiming {args.donations} donations ({args.mode}) on {args.database_url}')
+    results = run(app, args.database_url, args.mode, ngo_ids, donation_ids, args.processes)
+
+    with app.app_context():
+        problems = verify(results, donation_ids)
+
+    attempts = sum(r[1] for r in results.values())
+    errors = sum(r[2] for r in results.values())
+    elapsed = max(r[4] for r in results.values()) - min(r[3] for r in results.values())
+    print(f'attempts:    {attempts:,} ({errors:,} failed with database errors)')
+    print(f'elapsed:     {elapsed:.3f} s')
+    print(f'throughput:  {attempts / elapsed:,.0f} claim attempts/s')
+    if problems:
+        for problem, count in problems.items():
+            print(f'FAIL: {count} donations with {problem}')
+        sys.exit(1)
+    print(f'OK: each of the {len(donation_ids)} donations has exactly one winner')
+
+
+if __name__ == '__main__':
+    main()
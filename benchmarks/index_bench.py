@@ -0,0 +1,150 @@
+"""Benchmark the hot Donation queries with and without the composite indexes.
+
+Seeds a dataset, then for every hot access path prints the query plan and
+median latency twice: once with the Donation secondary indexes dropped and
+once with them in place.
+
+    python -m benchmarks.index_bench --donations 1000000
+    python -m benchmarks.index_bench --database-url postgresql://localhost/food_bench
+
+The target database is wiped, so never point it at real data.
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime
+
+
+def hot_queries(restaurant_id, ngo_id):
+    """The statements the views run, keyed by a short label"""
+    from sqlalchemy import func, select
+    from models import Donation
+
+    now = datetime.utcnow()
+    active = select(Donation).where(Donation.status == 'active')
+    return {
+        'index: recent active': active.order_by(Donation.created_at.desc()).limit(6),
+        'list_donations: available now': (
+            active.where(Donation.expiry_time > now)
+            .order_by(Donation.created_at.desc()).limit(10)
+        ),
+        'list_donations: count': (
+            select(func.count()).select_from(Donation).where(Donation.status == 'active')
+        ),
+        'api_donations: all active': active.order_by(Donation.created_at.desc()),
+        'expiry sweeper: due batch': (
+            select(Donation.id).where(Donation.status == 'active', Donation.expiry_time <= now)
+            .order_by(Donation.expiry_time).limit(1000)
+        ),
+        'dashboard: restaurant donations': (
+            select(Donation).where(Donation.restaurant_id == restaurant_id)
+            .order_by(Donation.created_at.desc()).limit(10)
+        ),
+        'dashboard: ngo claims': (
+            select(Donation).where(Donation.claimed_by_id == ngo_id)
+            .order_by(Donation.claimed_at.desc()).limit(10)
+        ),
+        'admin.donations: all': select(Donation).order_by(Donation.created_at.desc()).limit(20),
+        'admin.donations: claimed': (
+            select(Donation).where(Donation.status == 'claimed')
+            .order_by(Donation.created_at.desc()).limit(20)
+        ),
+        'admin.stats: completed count': (
+            select(func.count()).select_from(Donation).where(Donation.status == 'completed')
+        ),
+    }
+
+
+def _driver_sql(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    return str(compiled), params
+
+
+def explain(conn, statement):
+    sql, params = _driver_sql(conn, statement)
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = conn.exec_driver_sql(prefix + sql, params).fetchall()
+    if conn.dialect.name == 'sqlite':
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def time_query(conn, statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(statement).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run_suite(conn, queries, repeat, label):
+    print(f'\n==================== {label} ====================')
+    results = {}
+    for name, statement in queries.items():
+        plan = explain(conn, statement)
+        results[name] = time_query(conn, statement, repeat)
+        print(f'\n--- {name}: {results[name]:.2f} ms (median of {repeat})')
+        for line in plan:
+            print(f'    {line}')
+    return results
+
+
+def analyze(conn):
+    conn.exec_driver_sql('ANALYZE')
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/food_rescue_bench.db')
+    parser.add_argument('--donations', type=int, default=1_000_000)
+    parser.add_argument('--restaurants', type=int, default=1000)
+    parser.add_argument('--ngos', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='Reuse the data from a previous run.')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('NOTIFICATION_WORKER', 'off')
+    from app import app
+    from models import Donation, User, db
+    from benchmarks.seed import seed
+
+    with app.app_context():
+        if not args.skip_seed:
+            print(f'Seeding {args.donations:,} donations into {args.database_url} ...')
+            seed(restaurants=args.restaurants, ngos=args.ngos, donations=args.donations)
+
+        restaurant_id = db.session.scalar(db.select(User.id).filter_by(role='restaurant'))
+        ngo_id = db.session.scalar(db.select(User.id).filter_by(role='ngo'))
+        queries = hot_queries(restaurant_id, ngo_id)
+        indexes = list(Donation.__table__.indexes)
+
+        with db.engine.connect() as conn:
+            for index in indexes:
+                index.drop(conn, checkfirst=True)
+            conn.commit()
+            analyze(conn)
+            before = run_suite(conn, queries, args.repeat, 'WITHOUT INDEXES')
+
+            for index in indexes:
+                index.create(conn, checkfirst=True)
+            conn.commit()
+            analyze(conn)
+            after = run_suite(conn, queries, args.repeat, 'WITH INDEXES')
+
+    print(f'\n{"query":<36}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+    for name in queries:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f'{name:<36}{before[name]:>12.2f}{after[name]:>12.2f}{speedup:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""Load test the sync (gunicorn) and async (uvicorn) deployments.
+
+Seeds a dataset, then starts each server in turn on the same database and
+drives the read-heavy routes (index, list, detail, JSON API) with
+--concurrency keep-alive connections for --duration seconds. Reports
+requests/sec and p50/p99 latency per mode and per route.
+
+    python -m benchmarks.load_test --workers 4 --concurrency 64 --duration 20
+    python -m benchmarks.load_test --modes async --skip-seed
+    python -m benchmarks.load_test --database-url postgresql://localhost/bench
+
+The response cache is off by default (--cache memory to measure it), so
+every request reaches the database. The target database is wiped unless
+--skip-seed is given, so never point it at real data.
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'sync': ['gunicorn', '--workers', '{workers}', '--bind', '127.0.0.1:{port}', 'app:app'],
+    'async': ['uvicorn', 'asgi:app', '--workers', '{workers}', '--host', '127.0.0.1',
+              '--port', '{port}', '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def setup(args):
+    """Seed the database. Returns the ids of a few active donations."""
+    from app import app
+    from models import Donation, db
+    from benchmarks.seed import seed
+
+    with app.app_context():
+        if not args.skip_seed:
+            print(f'Seeding {args.donations:,} donations into {args.database_url} ...')
+            seed(restaurants=args.restaurants, ngos=args.ngos, donations=args.donations)
+        return db.session.scalars(
+            db.select(Donation.id).filter_by(status='active').order_by(Donation.id).limit(50)
+        ).all()
+
+
+def routes(detail_ids):
+    """(name, path, needs login) for every request type, in rotation"""
+    result = [
+        ('index', '/', False),
+        ('api', '/donations/api/donations', False),
+        ('list', '/donations/list', True),
+        ('list search', '/donations/list?page=2&q=rice', True),
+    ]
+    result += [('detail', f'/donations/{i}', True) for i in detail_ids[:10]]
+    return result
+
+
+# ---------- HTTP CLIENT ----------
+# A minimal HTTP/1.1 client: keeps the connection alive when the server
+# allows it, so the measurement isn't dominated by connection setup.
+
+class Connection:
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        """Returns (status, headers dict, body)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: 127.0.0.1:{self.port}',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin1') + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        response_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            response_headers.setdefault(name.lower(), []).append(value.strip())
+        response_headers = {k: ', '.join(v) for k, v in response_headers.items()}
+
+        if response_headers.get('transfer-encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                data += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            data = await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def login(port, email, password):
+    """Sign in through the login form. Returns the session cookie header."""
+    conn = Connection(port)
+    try:
+        _, headers, body = await conn.request('GET', '/auth/login')
+        cookie = headers['set-cookie'].split(';')[0]
+        token = re.search(rb'name="csrf_token"[^>]*value="([^"]+)"', body).group(1).decode()
+        form = urllib.parse.urlencode({'csrf_token': token, 'email': email, 'password': password})
+        status, headers, _ = await conn.request('POST', '/auth/login', {
+            'Cookie': cookie,
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }, form.encode())
+        if status != 302:
+            raise RuntimeError(f'Login as {email} failed ({status})')
+        return headers['set-cookie'].split(';')[0]
+    finally:
+        conn.close()
+
+
+async def drive(port, route_list, cookie, concurrency, duration):
+    """Returns {route name: [latency seconds]} and {route name: error count}"""
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    async def client(n):
+        conn = Connection(port)
+        i = n
+        while time.perf_counter() < deadline:
+            name, path, needs_login = route_list[i % len(route_list)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                status, _, _ = await conn.request('GET', path, {'Cookie': cookie} if needs_login else None)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                conn.close()
+                errors[name] += 1
+                continue
+            if status != 200:
+                errors[name] += 1
+            latencies[name].append(time.perf_counter() - start)
+        conn.close()
+
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return latencies, errors
+
+
+# ---------- SERVERS ----------
+
+def start_server(mode, workers, port, env):
+    """Start ``mode``'s server on ``port`` and wait until it answers"""
+    command = [part.format(workers=workers, port=port) for part in SERVERS[mode]]
+    # A file rather than a pipe: a full pipe would stall a chatty server
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f'{command[0]} exited:\n{log.read().decode()}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{command[0]} did not start within 30s')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0
+
+
+def summarize(latencies, errors, duration):
+    """{route: (requests, req/s, p50 ms, p99 ms, errors)} plus an 'all' row"""
+    rows = {}
+    everything = []
+    for name, values in latencies.items():
+        everything += values
+        rows[name] = (len(values), len(values) / duration, statistics.median(values) * 1000,
+                      percentile(values, 99) * 1000, errors.get(name, 0))
+    rows['all'] = (len(everything), len(everything) / duration,
+                   statistics.median(everything) * 1000 if everything else 0,
+                   percentile(everything, 99) * 1000, sum(errors.values()))
+    return rows
+
+
+def run_mode(mode, args, route_list, env):
+    process = start_server(mode, args.workers, args.port, env)
+    try:
+        cookie = asyncio.run(login(args.port, 'ngo0@bench.example.com', 'bench123'))
+        # Warm up connection pools, templates and per-process caches
+        asyncio.run(drive(args.port, route_list, cookie, args.concurrency, 2))
+        latencies, errors = asyncio.run(
+            drive(args.port, route_list, cookie, args.concurrency, args.duration)
+        )
+    finally:
+        stop_server(process)
+    return summarize(latencies, errors, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/food_rescue_load_test.db')
+    parser.add_argument('--donations', type=int, default=20_000)
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--ngos', type=int, default=50)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='Reuse the data from a previous run.')
+    parser.add_argument('--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--workers', type=int, default=4, help='Server processes per mode.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Open client connections.')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds per mode.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache', default='null', help='CACHE_BACKEND for the servers.')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['NOTIFICATION_WORKER'] = 'off'
+    os.environ['EXPIRY_SWEEPER'] = 'off'
+    route_list = routes(setup(args))
+    env = dict(os.environ, CACHE_BACKEND=args.cache)
+
+    results = {}
+    for mode in args.modes:
+        print(f'\n{mode}: {args.workers} workers, {args.concurrency} connections, {args.duration:g}s')
+        results[mode] = run_mode(mode, args, route_list, env)
+        print(f'{"route":<14}{"requests":>10}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for name, (count, rate, p50, p99, failed) in results[mode].items():
+            print(f'{name:<14}{count:>10,}{rate:>10,.0f}{p50:>10.1f}{p99:>10.1f}{failed:>8}')
+
+    if len(results) == 2:
+        sync, async_ = results['sync']['all'], results['async']['all']
+        print(f'\nasync vs sync: {async_[1] / sync[1]:.2f}x requests/sec, '
+              f'p99 {async_[3]:.1f} ms vs {sync[3]:.1f} ms')
+    if any(row['all'][4] for row in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Benchmark suite: seed a dataset, run scenarios, write a JSON report.
+
+    python -m benchmarks.run                                   # test client, all scenarios
+    python -m benchmarks.run --target gunicorn --workers 4 --concurrency 8
+    python -m benchmarks.run --target http://127.0.0.1:8000 --skip-seed
+    python -m benchmarks.run --scenarios list api --compare baseline.json
+
+Every scenario (see benchmarks/scenarios.py) reports throughput plus, per
+route, latency percentiles and SQL queries per request. The report is
+written as JSON (--output); --compare prints the change against an earlier
+report and exits with status 1 when a route got slower, lost throughput or
+runs more queries.
+
+``--target gunicorn`` starts a local gunicorn on the seeded database. For a
+server started by hand, set QUERY_COUNT_HEADER=1 on it to get query counts.
+The target database is wiped unless --skip-seed is given.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.scenarios import SCENARIOS, ClientTarget, HttpTarget, load_context, run_scenario
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        'mean': round(statistics.fmean(ms), 3),
+        'p50': round(percentile(ms, 50), 3),
+        'p90': round(percentile(ms, 90), 3),
+        'p99': round(percentile(ms, 99), 3),
+        'max': round(max(ms), 3),
+    }
+
+
+def summarize(samples, elapsed):
+    """Report entry for one scenario run"""
+    routes = defaultdict(list)
+    for sample in samples:
+        routes[sample.label].append(sample)
+
+    route_reports = {}
+    for label, route_samples in routes.items():
+        queries = [s.queries for s in route_samples if s.queries is not None]
+        route_reports[label] = {
+            'requests': len(route_samples),
+            'errors': sum(1 for s in route_samples if s.status >= 400),
+            'throughput_rps': round(len(route_samples) / elapsed, 2),
+            'latency_ms': latency_summary([s.seconds for s in route_samples]),
+            'queries': {
+                'mean': round(statistics.fmean(queries), 2),
+                'max': max(queries),
+            } if queries else None,
+        }
+    return {
+        'requests': len(samples),
+        'errors': sum(r['errors'] for r in route_reports.values()),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2),
+        'latency_ms': latency_summary([s.seconds for s in samples]),
+        'routes': route_reports,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """Print each route's change against ``baseline``. Returns the list of
+    regressions."""
+    regressions = []
+    print(f'\n{"route":<40}{"req/s":>16}{"p99 ms":>18}{"queries":>14}')
+    for name, scenario in report['scenarios'].items():
+        old_routes = baseline.get('scenarios', {}).get(name, {}).get('routes', {})
+        for label, new in scenario['routes'].items():
+            old = old_routes.get(label)
+            if old is None:
+                continue
+            rate = new['throughput_rps'] / old['throughput_rps'] if old['throughput_rps'] else 1
+            p99 = new['latency_ms']['p99'] / old['latency_ms']['p99'] if old['latency_ms']['p99'] else 1
+            old_queries = (old['queries'] or {}).get('mean')
+            new_queries = (new['queries'] or {}).get('mean')
+            queries = f'{old_queries} -> {new_queries}' if old_queries is not None else '-'
+            print(f'{label:<40}{rate - 1:>+15.0%} {p99 - 1:>+17.0%} {queries:>14}')
+
+            if rate < 1 - tolerance:
+                regressions.append(f'{label}: throughput {rate - 1:+.0%}')
+            if p99 > 1 + tolerance:
+                regressions.append(f'{label}: p99 latency {p99 - 1:+.0%}')
+            # Half a query of slack: one-off lookups (e.g. the first search
+            # in a process) move the mean slightly between runs
+            if old_queries is not None and new_queries is not None and new_queries > old_queries + 0.5:
+                regressions.append(f'{label}: {old_queries} -> {new_queries} queries per request')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/food_rescue_suite.db')
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--ngos', type=int, default=50)
+    parser.add_argument('--donations', type=int, default=20_000)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='Reuse the data from a previous run.')
+    parser.add_argument('--target', default='client',
+                        help="'client' (Flask test client), 'gunicorn' (started locally) "
+                             "or the URL of a running server.")
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn workers for --target gunicorn.')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--cache', default='null',
+                        help='CACHE_BACKEND; off by default so every request does its real work.')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=200, help='Iterations per scenario.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Threads per scenario.')
+    parser.add_argument('--output', help='Report path (default: benchmark-<timestamp>.json).')
+    parser.add_argument('--compare', metavar='REPORT', help='Earlier report to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative change in throughput and p99 before --compare fails.')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['NOTIFICATION_WORKER'] = 'off'
+    os.environ['EXPIRY_SWEEPER'] = 'off'
+    os.environ['QUERY_COUNT_HEADER'] = '1'
+    os.environ['CACHE_BACKEND'] = args.cache
+    # Every scenario signs in from 127.0.0.1
+    os.environ.setdefault('LOGIN_RATE_LIMIT_IP', '0')
+    os.environ.setdefault('LOGIN_RATE_LIMIT_ACCOUNT', '0')
+    from app import app
+    from benchmarks.seed import seed
+
+    with app.app_context():
+        if not args.skip_seed:
+            print(f'Seeding {args.donations:,} donations into {args.database_url} ...')
+            seed(restaurants=args.restaurants, ngos=args.ngos, donations=args.donations)
+        context = load_context()
+
+    server = None
+    if args.target == 'client':
+        make_target = lambda: ClientTarget(app)
+    elif args.target == 'gunicorn':
+        from benchmarks.load_test import start_server
+        server = start_server('sync', args.workers, args.port, dict(os.environ))
+        make_target = lambda: HttpTarget(f'http://127.0.0.1:{args.port}')
+    else:
+        make_target = lambda: HttpTarget(args.target)
+
+    started_at = datetime.now(timezone.utc)
+    results = {}
+    try:
+        for name in args.scenarios:
+            samples, elapsed = run_scenario(name, make_target, context, args.iterations, args.concurrency)
+            results[name] = summarize(samples, elapsed)
+            print(f'\n{name}: {results[name]["throughput_rps"]:,.1f} req/s, {results[name]["errors"]} errors')
+            print(f'  {"route":<38}{"requests":>9}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"queries":>9}')
+            for label, route in results[name]['routes'].items():
+                latency = route['latency_ms']
+                queries = route['queries']['mean'] if route['queries'] else '-'
+                print(f'  {label:<38}{route["requests"]:>9}{latency["p50"]:>10.1f}'
+                      f'{latency["p90"]:>10.1f}{latency["p99"]:>10.1f}{queries:>9}')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'target': args.target,
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+            'dataset': dict(context['dataset'], reseeded=not args.skip_seed),
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'cache': args.cache,
+            'workers': args.workers if args.target == 'gunicorn' else None,
+        },
+        'scenarios': results,
+    }
+    output = args.output or f'benchmark-{started_at:%Y%m%d-%H%M%S}.json'
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nReport written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Benchmark scenarios and the targets they run against.
+
+A target sends requests either through the Flask test client (in process,
+no network) or over HTTP to a running server, and records the latency,
+status and SQL query count (the ``X-Query-Count`` header, see
+querycount.py) of every request under a route label such as
+``GET /donations/list``.
+
+A scenario is a function ``(target, context, i)`` that makes the requests
+of its ``i``-th iteration. ``context`` holds ids looked up after seeding.
+"""
+import http.client
+import re
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.seed import PASSWORD
+
+CSRF_TOKEN = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class Sample:
+    __slots__ = ('label', 'seconds', 'status', 'queries')
+
+    def __init__(self, label, seconds, status, queries):
+        self.label = label
+        self.seconds = seconds
+        self.status = status
+        self.queries = queries
+
+
+class Target:
+    """Base class: subclasses implement ``_send`` and ``reset``"""
+
+    def __init__(self):
+        self.samples = []
+
+    def request(self, label, method, path, form=None, record=True):
+        """Send a request. Returns (status, body)."""
+        start = time.perf_counter()
+        status, headers, body = self._send(method, path, form)
+        if record:
+            queries = headers.get('X-Query-Count')
+            self.samples.append(Sample(label, time.perf_counter() - start, status,
+                                       int(queries) if queries is not None else None))
+        return status, body
+
+    def login(self, email, record=False):
+        """Sign in through the login form, as a new session"""
+        self.reset()
+        _, body = self.request('GET /auth/login', 'GET', '/auth/login', record=record)
+        token = CSRF_TOKEN.search(body).group(1).decode()
+        status, _ = self.request('POST /auth/login', 'POST', '/auth/login', {
+            'csrf_token': token, 'email': email, 'password': PASSWORD,
+        }, record=record)
+        if status != 302:
+            raise RuntimeError(f'Login as {email} failed ({status})')
+
+
+class ClientTarget(Target):
+    """In-process requests through ``app.test_client()``"""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.client = app.test_client()
+
+    def _send(self, method, path, form):
+        response = self.client.open(path, method=method, data=form)
+        return response.status_code, response.headers, response.get_data()
+
+    def reset(self):
+        self.client = self.app.test_client()
+
+
+class HttpTarget(Target):
+    """Requests over one keep-alive HTTP connection to ``base_url``"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = None
+        self.cookies = {}
+
+    def _send(self, method, path, form):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the idle connection; retry once on a new one
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        return response.status, response.headers, data
+
+    def reset(self):
+        self.cookies = {}
+
+
+# ---------- SCENARIOS ----------
+
+def login(target, context, i):
+    target.login(context['ngo_emails'][i % len(context['ngo_emails'])], record=True)
+
+
+def list_donations(target, context, i):
+    target.request('GET /donations/list', 'GET', f'/donations/list?page={i % 5 + 1}')
+    target.request('GET /donations/list?q=', 'GET', '/donations/list?q=rice&location=Madhapur')
+
+
+def claim(target, context, i):
+    # Every iteration claims a different donation; once they run out the
+    # remaining claims are (cheap) rejections
+    ids = context['active_ids']
+    target.request('POST /donations/<id>/claim', 'POST', f'/donations/{ids[i % len(ids)]}/claim')
+
+
+def api(target, context, i):
+    # v2 streams its body, so it has no X-Query-Count header; its budget
+    # is checked when the body has been sent
+    target.request('GET /donations/api/donations', 'GET', '/donations/api/donations')
+    target.request('GET /donations/api/v2/donations', 'GET', '/donations/api/v2/donations?limit=20')
+
+
+def admin_stats(target, context, i):
+    target.request('GET /admin/stats', 'GET', '/admin/stats')
+
+
+# name: (function, role to sign in as first)
+SCENARIOS = {
+    'login': (login, None),
+    'list': (list_donations, 'ngo'),
+    'api': (api, None),
+    'admin_stats': (admin_stats, 'admin'),
+    # Last by default: it changes the data the others read
+    'claim': (claim, 'ngo'),
+}
+
+
+def load_context():
+    """Ids and accounts the scenarios need. Must run inside an app context."""
+    from sqlalchemy import func
+    from models import Donation, User, db
+
+    dataset = dict(db.session.execute(db.select(User.role, func.count()).group_by(User.role)).all())
+    dataset['donations'] = db.session.scalar(db.select(func.count()).select_from(Donation))
+    emails = dict.fromkeys(['ngo', 'admin'])
+    for role in emails:
+        emails[role] = db.session.scalars(
+            db.select(User.email).filter_by(role=role).order_by(User.id).limit(100)
+        ).all()
+    return {
+        'dataset': dataset,
+        'ngo_emails': emails['ngo'],
+        'admin_emails': emails['admin'],
+        'active_ids': db.session.scalars(
+            db.select(Donation.id).filter_by(status='active').order_by(Donation.id)
+        ).all(),
+    }
+
+
+def run_scenario(name, make_target, context, iterations, concurrency):
+    """Run ``iterations`` iterations of scenario ``name`` spread over
+    ``concurrency`` threads, each with its own target. Returns (samples,
+    elapsed seconds)."""
+    function, role = SCENARIOS[name]
+    targets = [make_target() for _ in range(concurrency)]
+    if role is not None:
+        for n, target in enumerate(targets):
+            accounts = context[f'{role}_emails']
+            target.login(accounts[n % len(accounts)])
+            target.samples.clear()
+
+    barrier = threading.Barrier(concurrency + 1)
+    errors = []
+
+    def worker(n, target):
+        barrier.wait()
+        try:
+            for i in range(n, iterations, concurrency):
+                function(target, context, i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n, target)) for n, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return [sample for target in targets for sample in target.samples], elapsed
@@ -0,0 +1,174 @@
+"""Bulk seeder for benchmark datasets.
+
+Rows are inserted with executemany in chunks, not through the ORM unit of
+work, so a million donations take seconds to minutes rather than hours.
+
+    python -m benchmarks.seed --restaurants 100 --ngos 50 --donations 100000
+
+The target database is wiped, so never point it at real data.
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from geo import OfflineGeocoder, encode_geohash
+from models import Donation, User, db
+from passwords import hash_password
+from quantities import classified_fields
+from rollups import backfill as backfill_rollups
+from stats import rebuild_counters
+from userstats import check_user_stats
+
+# Share of donations in each status
+STATUS_WEIGHTS = {
+    'active': 0.2,  # a few of these end up 'expired'
+    'claimed': 0.35,
+    'completed': 0.35,
+    'removed': 0.1,
+}
+FOOD_TYPES = ['Veg', 'Non-veg', 'Snacks', 'Baked Goods', 'Fresh Produce', 'Prepared Food']
+AREAS = ['Madhapur', 'Gachibowli', 'Kondapur', 'Banjara Hills', 'Jubilee Hills',
+         'Ameerpet', 'Kukatpally', 'Secunderabad', 'Begumpet', 'Hitech City']
+PASSWORD = 'bench123'
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _users(role, count, password_hash, geocoder):
+    now = datetime.utcnow()
+    for i in range(count):
+        address = f'{i} Main Road, {AREAS[i % len(AREAS)]}'
+        latitude, longitude = geocoder.geocode(address)
+        yield {
+            'name': f'{role.title()} {i}',
+            'email': f'{role}{i}@bench.example.com',
+            'password_hash': password_hash,
+            'role': role,
+            'organization_name': f'{role.title()} Org {i}',
+            'address': address,
+            'latitude': latitude,
+            'longitude': longitude,
+            'created_at': now - timedelta(days=365),
+        }
+
+
+def _donations(count, restaurant_ids, ngo_ids, rng, days, geocoder):
+    now = datetime.utcnow()
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    for i in range(count):
+        status = rng.choices(statuses, weights)[0]
+        if status == 'active':
+            # Active donations are recent; a few have already expired
+            created_at = now - timedelta(hours=rng.uniform(0, 12))
+            expiry_time = created_at + timedelta(hours=rng.uniform(2, 36))
+        else:
+            created_at = now - timedelta(days=rng.uniform(0, days))
+            expiry_time = created_at + timedelta(hours=rng.uniform(2, 48))
+
+        if status == 'active' and expiry_time <= now:
+            # What the expiry sweeper would have done
+            status = 'expired'
+        claimed = status in ('claimed', 'completed')
+        area = rng.choice(AREAS)
+        address = f'{rng.randint(1, 999)} Market Street, {area}'
+        latitude, longitude = geocoder.geocode(address)
+        food_type = rng.choice(FOOD_TYPES)
+        quantity = f'{rng.randint(1, 50)} {rng.choice(["kg", "plates", "boxes"])}'
+        yield {
+            'restaurant_id': rng.choice(restaurant_ids),
+            'title': f'Surplus food batch {i}',
+            'description': f'Surplus food from today, ready for pickup in {area}.',
+            'food_type': food_type,
+            'quantity': quantity,
+            **classified_fields(quantity, food_type),
+            'address': address,
+            'latitude': latitude,
+            'longitude': longitude,
+            'geohash': encode_geohash(latitude, longitude),
+            'pickup_time': created_at + timedelta(minutes=30),
+            'expiry_time': expiry_time,
+            'status': status,
+            'claimed_by_id': rng.choice(ngo_ids) if claimed else None,
+            'claimed_at': created_at + timedelta(minutes=rng.uniform(5, 120)) if claimed else None,
+            'created_at': created_at,
+        }
+
+
+def seed(restaurants=100, ngos=50, donations=10000, days=365, chunk_size=10000,
+         random_seed=0, echo=print):
+    """Drop and recreate all tables, then bulk insert a dataset.
+
+    Must run inside an app context. Every seeded user's password is
+    ``PASSWORD``.
+    """
+    rng = random.Random(random_seed)
+    geocoder = OfflineGeocoder()
+    db.drop_all()
+    db.create_all()
+
+    # Hashing is deliberately slow, so every seeded user shares one hash
+    password_hash = hash_password(PASSWORD)
+    db.session.execute(insert(User), list(_users('restaurant', restaurants, password_hash, geocoder)))
+    db.session.execute(insert(User), list(_users('ngo', ngos, password_hash, geocoder)))
+    db.session.execute(insert(User), [{
+        'name': 'Bench Admin', 'email': 'admin@bench.example.com',
+        'password_hash': password_hash, 'role': 'admin',
+    }])
+    db.session.commit()
+
+    restaurant_ids = db.session.scalars(db.select(User.id).filter_by(role='restaurant')).all()
+    ngo_ids = db.session.scalars(db.select(User.id).filter_by(role='ngo')).all()
+
+    inserted = 0
+    donation_rows = _donations(donations, restaurant_ids, ngo_ids, rng, days, geocoder)
+    for chunk in _chunks(donation_rows, chunk_size):
+        db.session.execute(insert(Donation), chunk)
+        db.session.commit()
+        inserted += len(chunk)
+        if echo and inserted % (chunk_size * 10) == 0:
+            echo(f'  {inserted:,} donations')
+
+    # The bulk inserts bypassed the counters and rollups the pages read
+    rebuild_counters()
+    backfill_rollups()
+    check_user_stats(repair=True)
+
+    if echo:
+        echo(f'Seeded {restaurants} restaurants, {ngos} NGOs, {inserted:,} donations')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/food_rescue_bench.db')
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--ngos', type=int, default=50)
+    parser.add_argument('--donations', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365,
+                        help='Spread past donations over this many days.')
+    parser.add_argument('--random-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('NOTIFICATION_WORKER', 'off')
+    from app import app
+
+    with app.app_context():
+        seed(restaurants=args.restaurants, ngos=args.ngos, donations=args.donations,
+             days=args.days, random_seed=args.random_seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Bulk donation import and export.
+
+Restaurant chains can post a whole batch of surplus food as one CSV or JSON
+file instead of submitting the form once per item:
+
+- ``POST /donations/api/import`` (restaurants): a CSV body, a JSON list
+  (or ``{"donations": [...]}``) or a multipart ``file`` upload
+- ``flask --app app import-donations FILE --restaurant EMAIL``
+
+Every row is validated with ``DonationForm``, so the rules match the web
+form. If any row is invalid, nothing is imported and the errors are
+reported per row. A valid batch is inserted ``BULK_IMPORT_CHUNK_SIZE`` rows
+per executemany. Each donation is matched to NGOs (see matching.py). The
+NGOs on any of the batch's shortlists get one notification for the whole
+batch, and browsers get one live event, instead of one per donation.
+
+Admins can export donations as CSV or NDJSON from ``/admin/donations/export``
+or with ``flask export-donations``. Rows are streamed from the database
+``BULK_EXPORT_BATCH_SIZE`` at a time, so the table is never loaded into
+memory at once.
+"""
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import insert, select
+from werkzeug.datastructures import MultiDict
+
+from cache import invalidate
+from forms import DonationForm
+from geo import encode_geohash, geocode
+from matching import MATCH_COLUMNS, match_donations, notification_recipients
+from models import Donation, User, db
+from notifications import notify_donations_imported, wake_workers
+from quantities import classified_fields
+import events
+import rollups
+import stats
+import userstats
+
+IMPORT_FIELDS = ('title', 'description', 'food_type', 'quantity', 'address',
+                 'pickup_time', 'expiry_time')
+
+EXPORT_COLUMNS = (
+    Donation.id, Donation.restaurant_id, Donation.title, Donation.description,
+    Donation.food_type, Donation.quantity, Donation.address, Donation.latitude,
+    Donation.longitude, Donation.pickup_time, Donation.expiry_time, Donation.status,
+    Donation.claimed_by_id, Donation.claimed_at, Donation.created_at,
+)
+EXPORT_FIELDS = tuple(column.key for column in EXPORT_COLUMNS)
+
+
+class InvalidImport(Exception):
+    """The file can't be imported; ``rows`` holds per-row form errors"""
+
+    def __init__(self, message, rows=()):
+        super().__init__(message)
+        self.rows = list(rows)
+
+
+# ---------- IMPORT ----------
+
+def read_rows(text, kind):
+    """The rows of a CSV or JSON document, as dicts"""
+    if kind == 'json':
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise InvalidImport(f'Invalid JSON: {e}')
+        if isinstance(data, dict):
+            data = data.get('donations')
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise InvalidImport('Expected a list of donation objects')
+        return data
+
+    reader = csv.DictReader(io.StringIO(text))
+    missing = set(IMPORT_FIELDS) - set(reader.fieldnames or ())
+    if missing:
+        raise InvalidImport(f"CSV is missing columns: {', '.join(sorted(missing))}")
+    return list(reader)
+
+
+def _form_value(value):
+    return '' if value is None else str(value)
+
+
+def validate_rows(rows, max_rows=None):
+    """Check every row with ``DonationForm``. Returns the cleaned fields of
+    each row, or raises ``InvalidImport`` if any row is invalid."""
+    max_rows = max_rows or current_app.config.get('BULK_IMPORT_MAX_ROWS', 1000)
+    if not rows:
+        raise InvalidImport('No donations to import')
+    if len(rows) > max_rows:
+        raise InvalidImport(f'At most {max_rows} donations per import')
+
+    donations, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        formdata = MultiDict({name: _form_value(row.get(name)) for name in IMPORT_FIELDS})
+        form = DonationForm(formdata=formdata, meta={'csrf': False})
+        if form.validate():
+            donations.append({name: form[name].data for name in IMPORT_FIELDS})
+        else:
+            errors.append({'row': number, 'errors': form.errors})
+    if errors:
+        raise InvalidImport(f'{len(errors)} of {len(rows)} rows are invalid', errors)
+    return donations
+
+
+def import_donations(donations, restaurant, chunk_size=None):
+    """Insert validated donations for ``restaurant`` and queue one
+    notification for the batch. Returns the new ids; the caller commits."""
+    chunk_size = chunk_size or current_app.config.get('BULK_IMPORT_CHUNK_SIZE', 500)
+    now = datetime.utcnow()
+    records = []
+    for fields in donations:
+        point = geocode(fields['address'])
+        records.append(dict(
+            fields,
+            restaurant_id=restaurant.id,
+            status='active',
+            created_at=now,
+            latitude=point[0] if point else None,
+            longitude=point[1] if point else None,
+            geohash=encode_geohash(*point) if point else None,
+            **classified_fields(fields['quantity'], fields['food_type']),
+        ))
+
+    donation_ids = []
+    if db.session.get_bind().dialect.insert_executemany_returning:
+        for start in range(0, len(records), chunk_size):
+            # One executemany per chunk; with RETURNING, SQLAlchemy sends it
+            # as multi-row INSERTs and hands back the new ids
+            donation_ids.extend(db.session.scalars(
+                insert(Donation).returning(Donation.id), records[start:start + chunk_size]
+            ).all())
+    else:
+        for record in records:
+            result = db.session.execute(insert(Donation).values(**record))
+            donation_ids.append(result.inserted_primary_key[0])
+
+    # NGOs on any of the batch's shortlists get the one batch message
+    matches = match_donations(db.session.execute(
+        select(*MATCH_COLUMNS).where(Donation.id.in_(donation_ids))
+    ).all())
+    ngo_ids = sorted({ngo_id for shortlist in matches.values() for ngo_id in shortlist})
+    notify_donations_imported(donations, restaurant, donation_ids, notification_recipients(ngo_ids))
+    stats.record_donation_created(count=len(donation_ids))
+    rollups.record_ids('posted', donation_ids)
+    userstats.record_donations_created(restaurant.id, now, count=len(donation_ids))
+    return donation_ids
+
+
+def finish_import(donation_ids, restaurant):
+    """After commit: refresh listings, send notifications, tell browsers"""
+    invalidate('donations')
+    wake_workers()
+    events.donations_imported(donation_ids, restaurant)
+
+
+# ---------- EXPORT ----------
+
+def export_query(status=None):
+    query = select(*EXPORT_COLUMNS).order_by(Donation.id)
+    if status:
+        query = query.where(Donation.status == status)
+    return query
+
+
+def _export_rows(query, batch_size):
+    """Rows of ``query``, fetched ``batch_size`` at a time (a server-side
+    cursor on Postgres)"""
+    batch_size = batch_size or current_app.config.get('BULK_EXPORT_BATCH_SIZE', 1000)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield partition
+
+
+def _export_value(value):
+    # Seconds precision, so exported times can be imported again
+    return value.isoformat(timespec='seconds') if isinstance(value, datetime) else value
+
+
+def export_csv(query, batch_size=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in _export_rows(query, batch_size):
+        writer.writerows([_export_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_ndjson(query, batch_size=None):
+    for rows in _export_rows(query, batch_size):
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_FIELDS, map(_export_value, row)))) + '\n'
+            for row in rows
+        )
+
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
+
+
+def init_bulk(app):
+    @app.cli.command('import-donations')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--restaurant', 'email', required=True, help='Email of the posting restaurant.')
+    @click.option('--chunk-size', default=None, type=int)
+    def import_donations_command(path, email, chunk_size):
+        """Import donations from a CSV or JSON file."""
+        restaurant = User.query.filter_by(email=email, role='restaurant').first()
+        if restaurant is None:
+            raise click.ClickException(f'No restaurant with email {email}')
+        kind = 'json' if path.lower().endswith('.json') else 'csv'
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            text = f.read()
+        try:
+            donations = validate_rows(read_rows(text, kind), max_rows=sys.maxsize)
+        except InvalidImport as e:
+            for row in e.rows:
+                click.echo(f"Row {row['row']}: {row['errors']}", err=True)
+            raise click.ClickException(str(e))
+        donation_ids = import_donations(donations, restaurant, chunk_size)
+        db.session.commit()
+        finish_import(donation_ids, restaurant)
+        click.echo(f'Imported {len(donation_ids)} donations for {restaurant.name}')
+
+    @app.cli.command('export-donations')
+    @click.option('--format', 'export_format', type=click.Choice(sorted(EXPORT_FORMATS)),
+                  default='csv', show_default=True)
+    @click.option('--status', default=None, help='Only donations with this status.')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+                  help='File to write (default: stdout).')
+    @click.option('--batch-size', default=None, type=int)
+    def export_donations_command(export_format, status, output, batch_size):
+        """Export donations as CSV or NDJSON."""
+        writer, _ = EXPORT_FORMATS[export_format]
+        for chunk in writer(export_query(status), batch_size):
+            output.write(chunk)
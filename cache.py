@@ -0,0 +1,234 @@
+"""Server-side response cache for public pages.
+
+Views opt in with ``@cached_response(namespace)``. Rendered responses are
+stored in the configured backend for ``CACHE_DEFAULT_TIMEOUT`` seconds and
+served with an ``ETag`` and ``Last-Modified`` header, so clients that poll
+with ``If-None-Match`` / ``If-Modified-Since`` get an empty 304.
+
+Every namespace has a generation stamp that is part of the cache key.
+``invalidate(namespace)`` replaces the stamp, which orphans all entries
+cached under the old one; views call it after committing a change that
+affects the cached pages. The TTL bounds staleness from changes that don't
+go through a view, such as donations passing their expiry time.
+
+The ``memory`` backend is a per-process LRU. When running several worker
+processes use ``redis`` (any Redis-compatible server) so that every process
+sees the same entries and invalidations.
+"""
+import hashlib
+import inspect
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+
+# ---------- BACKENDS ----------
+
+class NullCache:
+    """Caches nothing; every request renders the view"""
+
+    def __init__(self, config):
+        pass
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, config):
+        self.max_entries = int(config.get('CACHE_MAX_ENTRIES') or 512)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisCache:
+    """Shared cache on a Redis-compatible server (needs ``pip install redis``).
+
+    Connection errors are logged and treated as misses, so an unavailable
+    cache server slows pages down instead of breaking them.
+    """
+
+    def __init__(self, config):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self._errors = redis.RedisError
+        self.client = redis.Redis.from_url(
+            config.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+        )
+        self.prefix = config.get('CACHE_KEY_PREFIX') or 'food_rescue:'
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except self._errors as e:
+            current_app.logger.warning("Cache get failed: %s", e)
+            return None
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        try:
+            self.client.set(self.prefix + key, pickle.dumps(value), ex=timeout or None)
+        except self._errors as e:
+            current_app.logger.warning("Cache set failed: %s", e)
+
+    def delete(self, key):
+        try:
+            self.client.delete(self.prefix + key)
+        except self._errors as e:
+            current_app.logger.warning("Cache delete failed: %s", e)
+
+
+CACHE_BACKENDS = {
+    'null': NullCache,
+    'memory': MemoryCache,
+    'redis': RedisCache,
+}
+
+
+def get_cache():
+    return current_app.extensions['response_cache']
+
+
+# ---------- INVALIDATION ----------
+
+def _generation(cache, namespace):
+    key = f'generation:{namespace}'
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = repr(time.time())
+        cache.set(key, stamp)
+    return stamp
+
+
+def invalidate(namespace):
+    """Drop every response cached under ``namespace``. Call after commit."""
+    get_cache().set(f'generation:{namespace}', repr(time.time()))
+
+
+def generation(namespace):
+    """``namespace``'s current stamp, for per-process state that must be
+    rebuilt after ``invalidate``. None while no stamp is stored (always with
+    the null backend)."""
+    return get_cache().get(f'generation:{namespace}')
+
+
+# ---------- RESPONSES ----------
+
+def _bypass(unless):
+    # A pending flash message would be rendered into the page
+    return (request.method != 'GET' or (unless is not None and unless())
+            or '_flashes' in session)
+
+
+def _lookup(namespace):
+    cache = get_cache()
+    key = f'response:{namespace}:{_generation(cache, namespace)}:{request.full_path}'
+    return cache, key, cache.get(key)
+
+
+def _store(cache, key, rv, timeout):
+    """Cache a freshly rendered view result. Returns (response, entry);
+    entry is None for responses that aren't cacheable."""
+    response = make_response(rv)
+    if response.status_code != 200 or response.direct_passthrough:
+        return response, None
+    body = response.get_data()
+    entry = {
+        'body': body,
+        'content_type': response.content_type,
+        'etag': hashlib.sha1(body).hexdigest(),
+        'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+    }
+    cache.set(key, entry, timeout or current_app.config.get('CACHE_DEFAULT_TIMEOUT', 60))
+    return response, entry
+
+
+def _serve(response, entry, status):
+    if response is None:
+        response = current_app.response_class(entry['body'], content_type=entry['content_type'])
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    # Clients may keep a copy but must revalidate it (cheap 304s)
+    response.cache_control.no_cache = True
+    response.headers['X-Cache'] = status
+    return response.make_conditional(request)
+
+
+def cached_response(namespace, timeout=None, unless=None):
+    """Cache a view's successful GET responses under ``namespace``.
+
+    The key is the full request path including the query string. ``unless``
+    is a callable that returns True for requests that must bypass the cache
+    (e.g. signed-in users who see a different page). Works on both plain
+    and ``async`` views (see asgi.py).
+    """
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                if _bypass(unless):
+                    return await f(*args, **kwargs)
+                cache, key, entry = _lookup(namespace)
+                if entry is not None:
+                    return _serve(None, entry, 'HIT')
+                response, entry = _store(cache, key, await f(*args, **kwargs), timeout)
+                return _serve(response, entry, 'MISS') if entry else response
+            return async_wrapper
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if _bypass(unless):
+                return f(*args, **kwargs)
+            cache, key, entry = _lookup(namespace)
+            if entry is not None:
+                return _serve(None, entry, 'HIT')
+            response, entry = _store(cache, key, f(*args, **kwargs), timeout)
+            return _serve(response, entry, 'MISS') if entry else response
+        return wrapper
+    return decorator
+
+
+def init_cache(app):
+    name = app.config.get('CACHE_BACKEND', 'memory')
+    if name not in CACHE_BACKENDS:
+        raise RuntimeError(f"Unknown CACHE_BACKEND: {name}")
+    app.extensions['response_cache'] = CACHE_BACKENDS[name](app.config)
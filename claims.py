@@ -0,0 +1,61 @@
+"""Race-free donation claiming.
+
+A claim is a single conditional UPDATE: ``status`` becomes ``'claimed'`` only
+where it is still ``'active'`` and the donation hasn't expired. The database
+applies the UPDATE under a row lock and re-checks the condition, so when
+several NGOs claim the same donation at once exactly one statement matches
+the row and every other caller sees zero rows and loses.
+
+Neither function commits. Callers commit along with whatever else belongs to
+the claim (outbox messages, counters); until then the row stays locked.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from models import Donation, db
+
+# Upper bound on donation ids per batch claim
+MAX_BATCH_CLAIM = 100
+
+
+def _claimable(now):
+    return Donation.status == 'active', Donation.expiry_time > now
+
+
+def claim_donation(donation_id, ngo_id):
+    """Claim one donation for ``ngo_id``. Returns True if this caller won."""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Donation)
+        .where(Donation.id == donation_id, *_claimable(now))
+        .values(status='claimed', claimed_by_id=ngo_id, claimed_at=now)
+    )
+    return result.rowcount == 1
+
+
+def claim_donations(donation_ids, ngo_id):
+    """Claim as many of ``donation_ids`` as are still available, in one
+    statement. Returns the ids this caller won."""
+    donation_ids = sorted(set(donation_ids))
+    if not donation_ids:
+        return []
+
+    dialect = db.session.get_bind().dialect
+    if not dialect.update_returning:
+        return [i for i in donation_ids if claim_donation(i, ngo_id)]
+
+    now = datetime.utcnow()
+    claimable = select(Donation.id).where(Donation.id.in_(donation_ids), *_claimable(now))
+    if dialect.name == 'postgresql':
+        # Rows another transaction is claiming right now are skipped rather
+        # than waited for: that claim will most likely win them anyway
+        claimable = claimable.with_for_update(skip_locked=True)
+
+    won = db.session.scalars(
+        update(Donation)
+        .where(Donation.id.in_(claimable), *_claimable(now))
+        .values(status='claimed', claimed_by_id=ngo_id, claimed_at=now)
+        .returning(Donation.id)
+    ).all()
+    return sorted(won)
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 from app import create_app
+from geo import locate_donation, locate_user
+from quantities import classify_donation
+from userstats import check_user_stats
 from models import db, User, Donation
 from datetime import datetime, timedelta
 
@@ -12,17 +15,22 @@ def create_sample_data():
         db.create_all()
         
         # Create admin user
-        admin = User(name='Admin User', email='admin@example.com', role='admin')
+        admin = User(name='Admin User', email='admin@example.com', role='admin',
+                     address='8 Station Road, Begumpet')
         admin.set_password('admin123')
         
         # Create sample restaurant
-        restaurant = User(name='Green Restaurant', email='restaurant@example.com', role='restaurant')
+        restaurant = User(name='Green Restaurant', email='restaurant@example.com', role='restaurant',
+                          address='123 Green Street, Downtown')
         restaurant.set_password('restaurant123')
         
         # Create sample NGO
-        ngo = User(name='Food Help NGO', email='ngo@example.com', role='ngo')
+        ngo = User(name='Food Help NGO', email='ngo@example.com', role='ngo',
+                   address='45 Abids Road, Abids')
         ngo.set_password('ngo123')
         
+        for user in (admin, restaurant, ngo):
+            locate_user(user)
         db.session.add_all([admin, restaurant, ngo])
         db.session.commit()
         
@@ -65,8 +73,13 @@ def create_sample_data():
             status='active'
         )
         
+        for donation in (donation1, donation2, donation3):
+            classify_donation(donation)
+            locate_donation(donation)
         db.session.add_all([donation1, donation2, donation3])
         db.session.commit()
+        # Per-user dashboard counters for the users and donations above
+        check_user_stats(repair=True)
         
         print("Database created successfully!")
         print("\nSample login credentials:")
@@ -0,0 +1,116 @@
+"""Connection pool settings and read-replica routing.
+
+Pool size, overflow, checkout timeout, recycle time and (on Postgres) a
+statement timeout come from the environment; see ``engine_options``.
+
+With ``DATABASE_REPLICA_URL`` set, the replica is registered as the
+``replica`` bind. Requests to views marked ``@read_only`` (GET/HEAD) then
+run their SELECTs on it. Writes, and every query outside such views, use
+the primary. A request that writes anything marks the client's session so
+that its read-only pages use the primary for ``REPLICA_STICKY_SECONDS``.
+That way a user who just created or claimed a donation sees it, even if
+the replica lags behind.
+
+To try it locally with two SQLite files, point ``DATABASE_REPLICA_URL`` at
+a second file and copy the primary over it whenever you want the replica
+to "catch up":
+
+    flask --app app sync-replica
+"""
+import sqlite3
+import time
+
+import click
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = 'replica'
+
+
+def engine_options(url, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=300,
+                   statement_timeout_ms=0):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``url``"""
+    options = {'pool_pre_ping': True, 'pool_recycle': pool_recycle}
+    database = make_url(url).database
+    if url.startswith('sqlite') and database in (None, '', ':memory:'):
+        # In-memory SQLite uses a single-connection pool without sizes
+        return options
+    options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    if statement_timeout_ms and url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    return options
+
+
+def read_only(f):
+    """Let a view's SELECTs run on the read replica"""
+    # Outer decorators (login_required, admin_required) use functools.wraps,
+    # which copies this attribute onto the registered view function
+    f.read_only = True
+    return f
+
+
+class RoutingSession(Session):
+    """Sends SELECTs to the replica while ``g.use_replica`` is set"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context()
+                and g.get('use_replica') and (clause is None or getattr(clause, 'is_select', False))):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _mark_write(*args):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _statement_executed(orm_execute_state):
+    if not orm_execute_state.is_select:
+        _mark_write()
+
+
+def _choose_bind():
+    if request.method not in ('GET', 'HEAD'):
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    g.use_replica = (getattr(view, 'read_only', False)
+                     and session.get('_primary_until', 0) < time.time())
+
+
+def _stick_to_primary(response):
+    if g.get('db_wrote'):
+        session['_primary_until'] = time.time() + current_app.config.get('REPLICA_STICKY_SECONDS', 10)
+    return response
+
+
+def _sqlite_path(url):
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return url.database
+
+
+def init_routing(app):
+    if not event.contains(RoutingSession, 'after_flush', _mark_write):
+        event.listen(RoutingSession, 'after_flush', _mark_write)
+        event.listen(RoutingSession, 'do_orm_execute', _statement_executed)
+
+    if REPLICA_BIND not in app.config.get('SQLALCHEMY_BINDS', {}):
+        return
+    app.before_request(_choose_bind)
+    app.after_request(_stick_to_primary)
+
+    @app.cli.command('sync-replica')
+    def sync_replica():
+        """Copy a SQLite primary over its SQLite replica."""
+        # Engine URLs: Flask-SQLAlchemy resolves relative SQLite paths
+        engines = current_app.extensions['sqlalchemy'].engines
+        primary = _sqlite_path(engines[None].url)
+        replica = _sqlite_path(engines[REPLICA_BIND].url)
+        if primary is None or replica is None:
+            raise click.ClickException('sync-replica only copies SQLite files; '
+                                       'use your database\'s replication otherwise')
+        with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+            source.backup(target)
+        click.echo(f'Copied {primary} to {replica}')
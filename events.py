@@ -0,0 +1,215 @@
+"""Live donation events over Server-Sent Events.
+
+Views publish an event after committing a change; ``/donations/stream``
+relays events to connected browsers. Each open stream is just a queue on the
+bus: it holds no database connection and costs nothing until an event or a
+heartbeat is due. To keep thousands of streams open, serve the app with a
+cooperative worker such as ``gunicorn -k gevent``, where an idle stream is a
+parked greenlet rather than a blocked thread.
+
+Buses:
+
+- ``memory`` (default): delivers within the publishing process.
+- ``redis``: publishes on a Redis-compatible channel; every process relays
+  what it receives to its own streams, so all gunicorn workers see every
+  event.
+
+The last ``EVENT_HISTORY`` events are kept per process, so a browser that
+reconnects with ``Last-Event-ID`` is sent what it missed.
+"""
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+EVENT_HISTORY = 500
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_DELAY_MS = 5000
+
+
+class Subscription:
+    def __init__(self, bus):
+        self.bus = bus
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Set when the client fell too far behind; the stream then ends
+        # and the browser reconnects with Last-Event-ID
+        self.dropped = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class MemoryBus:
+    """In-process fan-out to every open stream"""
+
+    def __init__(self, config):
+        self._subscribers = set()
+        self._history = deque(maxlen=EVENT_HISTORY)
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        self._deliver(event)
+
+    def _deliver(self, event):
+        with self._lock:
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event['id'] > last_event_id:
+                        subscription.queue.put_nowait(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class RedisBus(MemoryBus):
+    """Shares events between processes through Redis pub/sub (needs
+    ``pip install redis``)"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("EVENT_BUS=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(
+            config.get('EVENT_REDIS_URL') or 'redis://localhost:6379/0'
+        )
+        self.channel = (config.get('CACHE_KEY_PREFIX') or 'food_rescue:') + 'events'
+        self._listener = None
+
+    def publish(self, event):
+        # Our own listener delivers it locally, in the same order as
+        # events from other processes
+        self.client.publish(self.channel, json.dumps(event))
+
+    def subscribe(self, last_event_id=None):
+        self._start_listener()
+        return super().subscribe(last_event_id)
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name='event-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self._deliver(json.loads(message['data']))
+            except Exception:
+                # Connection lost: back off, then resubscribe
+                time.sleep(1)
+
+
+EVENT_BUSES = {
+    'memory': MemoryBus,
+    'redis': RedisBus,
+}
+
+_sequence = itertools.count()
+
+
+def _next_id():
+    # Microsecond timestamp plus a per-process sequence: roughly ordered
+    # across processes, unique within one
+    return time.time_ns() // 1000 * 1000 + next(_sequence) % 1000
+
+
+def get_bus():
+    return current_app.extensions['event_bus']
+
+
+def publish(event_type, **data):
+    """Send an event to every open stream. Call after commit."""
+    try:
+        get_bus().publish({'id': _next_id(), 'type': event_type, 'data': data})
+    except Exception:
+        # Live updates are best effort; never fail the request over them
+        current_app.logger.exception("Publishing %s failed", event_type)
+
+
+def donation_created(donation, restaurant):
+    publish(
+        'donation.created',
+        id=donation.id,
+        title=donation.title,
+        food_type=donation.food_type,
+        quantity=donation.quantity,
+        address=donation.address,
+        expiry_time=donation.expiry_time.isoformat(),
+        restaurant_name=restaurant.name,
+        latitude=donation.latitude,
+        longitude=donation.longitude,
+    )
+
+
+def donations_imported(donation_ids, restaurant):
+    """One event for a bulk import rather than one per donation"""
+    publish(
+        'donations.imported',
+        ids=donation_ids,
+        count=len(donation_ids),
+        restaurant_name=restaurant.name,
+    )
+
+
+def subscribe(last_event_id=None):
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    return get_bus().subscribe(last_event_id)
+
+
+def _format(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def sse_stream(subscription, heartbeat, max_age):
+    """Yield ``subscription``'s events in SSE format, with a comment line
+    every ``heartbeat`` seconds so proxies keep the connection open. Ends
+    after ``max_age`` seconds; the browser reconnects on its own."""
+    deadline = time.monotonic() + max_age
+    try:
+        yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+        while time.monotonic() < deadline and not subscription.dropped:
+            event = subscription.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+            yield _format(event) if event else ": keep-alive\n\n"
+    finally:
+        subscription.close()
+
+
+def init_events(app):
+    name = app.config.get('EVENT_BUS', 'memory')
+    if name not in EVENT_BUSES:
+        raise RuntimeError(f"Unknown EVENT_BUS: {name}")
+    app.extensions['event_bus'] = EVENT_BUSES[name](app.config)
@@ -0,0 +1,161 @@
+"""Expiry sweeper.
+
+Moves donations whose ``expiry_time`` has passed from ``'active'`` to
+``'expired'`` in bulk, so the active set only holds donations that can
+still be claimed and listings can filter on ``status = 'active'`` alone.
+
+Each batch is one range scan on ``ix_donation_status_expiry_time`` plus one
+conditional UPDATE, committed together with its side effects: the platform
+and per-user counters, the trend rollups, an outbox message to each
+restaurant, and (after commit) response cache invalidation. Several
+sweepers can run at once; a row is only ever expired, counted and notified
+by the one whose UPDATE changed it.
+
+The sweeper runs as a daemon thread in the web process
+(``EXPIRY_SWEEPER=thread``, the default) or as a separate process:
+
+    flask --app app expire-donations --loop
+"""
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import select, update
+
+from models import Donation, db
+from cache import invalidate
+from notifications import notify_donations_expired, wake_workers
+import events
+import rollups
+import stats
+import userstats
+
+
+def expire_batch(batch_size, now=None):
+    """Expire up to ``batch_size`` overdue donations and commit. Returns
+    the number of donations this call expired."""
+    now = now or datetime.utcnow()
+    due = (Donation.status == 'active', Donation.expiry_time <= now)
+    candidate_ids = db.session.scalars(
+        select(Donation.id).where(*due).order_by(Donation.expiry_time).limit(batch_size)
+    ).all()
+    if not candidate_ids:
+        return 0
+
+    if db.session.get_bind().dialect.update_returning:
+        expired_ids = db.session.scalars(
+            update(Donation)
+            .where(Donation.id.in_(candidate_ids), *due)
+            .values(status='expired')
+            .returning(Donation.id)
+        ).all()
+    else:
+        # Without RETURNING, one UPDATE per row tells us which rows we changed
+        expired_ids = [
+            donation_id for donation_id in candidate_ids
+            if db.session.execute(
+                update(Donation).where(Donation.id == donation_id, *due).values(status='expired')
+            ).rowcount == 1
+        ]
+
+    if expired_ids:
+        notify_donations_expired(expired_ids)
+        stats.record_status_change('active', 'expired', count=len(expired_ids))
+        expired = db.session.execute(
+            select(*rollups.ROLLUP_COLUMNS).where(Donation.id.in_(expired_ids))
+        ).all()
+        rollups.record('expired', expired)
+        userstats.record_status_change(expired, 'active', 'expired')
+    db.session.commit()
+    if expired_ids:
+        events.publish('donation.expired', ids=expired_ids)
+    return len(expired_ids)
+
+
+def expire_due(batch_size=None, now=None):
+    """Expire every overdue donation, one batch per transaction"""
+    batch_size = batch_size or current_app.config.get('EXPIRY_BATCH_SIZE', 1000)
+    now = now or datetime.utcnow()
+    total = 0
+    while True:
+        expired = expire_batch(batch_size, now)
+        total += expired
+        if expired < batch_size:
+            break
+    if total:
+        invalidate('donations')
+        wake_workers()
+    return total
+
+
+class ExpirySweeper:
+    def __init__(self, app, interval=None, batch_size=None):
+        self.app = app
+        self.interval = interval or app.config.get('EXPIRY_SWEEP_INTERVAL', 60)
+        self.batch_size = batch_size or app.config.get('EXPIRY_BATCH_SIZE', 1000)
+
+    def run_forever(self, stop=None):
+        with self.app.app_context():
+            while not (stop and stop.is_set()):
+                try:
+                    expired = expire_due(self.batch_size)
+                    if expired:
+                        current_app.logger.info("Expired %d donations", expired)
+                except Exception:
+                    current_app.logger.exception("Expiry sweeper error")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                if stop:
+                    stop.wait(self.interval)
+                else:
+                    time.sleep(self.interval)
+
+
+_sweeper_thread = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper_thread(app):
+    """Start the in-process sweeper (once per process)"""
+    global _sweeper_thread
+    with _sweeper_lock:
+        if _sweeper_thread is not None:
+            return
+        _sweeper_thread = threading.Thread(
+            target=ExpirySweeper(app).run_forever,
+            name='expiry-sweeper',
+            daemon=True,
+        )
+        _sweeper_thread.start()
+
+
+def init_expiry(app):
+    if app.config.get('EXPIRY_SWEEPER') == 'thread':
+        # Started on the first request rather than at import, so CLI
+        # commands such as `flask db upgrade` never sweep
+        @app.before_request
+        def _start_sweeper():
+            if _sweeper_thread is None:
+                start_sweeper_thread(app)
+
+    @app.cli.command('expire-donations')
+    @click.option('--loop', is_flag=True, help='Keep sweeping every --interval seconds.')
+    @click.option('--interval', default=None, type=int)
+    @click.option('--batch-size', default=None, type=int)
+    def expire_donations(loop, interval, batch_size):
+        """Move donations past their expiry time to 'expired'."""
+        if not loop:
+            click.echo(f"Expired {expire_due(batch_size)} donations")
+            return
+
+        sweeper = ExpirySweeper(app, interval=interval, batch_size=batch_size)
+        click.echo(f"Sweeping every {sweeper.interval}s. Ctrl+C to stop.")
+        stop = threading.Event()
+        try:
+            sweeper.run_forever(stop)
+        except KeyboardInterrupt:
+            stop.set()
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, SelectField, TextAreaField, DateTimeLocalField
-from wtforms.validators import DataRequired, Email, EqualTo, Length
+from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
 from datetime import datetime
 
 
@@ -41,7 +41,8 @@ class DonationForm(FlaskForm):
     image = FileField('Image (optional)', validators=[FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')])
     
     def validate_expiry_time(self, field):
-        if field.data <= self.pickup_time.data:
-            raise ValueError('Expiry time must be after pickup time')
+        # pickup_time reports its own error when it is missing or malformed
+        if self.pickup_time.data and field.data <= self.pickup_time.data:
+            raise ValidationError('Expiry time must be after pickup time')
         if field.data <= datetime.now():
-            raise ValueError('Expiry time must be in the future')
+            raise ValidationError('Expiry time must be in the future')
@@ -0,0 +1,306 @@
+"""Geocoding and nearest-donation lookups.
+
+Donations and users carry ``latitude``/``longitude`` plus a ``geohash`` of
+the donation location. A geohash is a base-32 string where every extra
+character narrows the cell, so all points inside a cell share its prefix
+and a cell is a plain range scan on the ``(status, geohash)`` index.
+
+``nearest_donations`` searches rings of growing radius, each covered by a
+handful of geohash cells, and stops as soon as it has ``k`` donations inside
+the ring. Only the rows in those cells are read, so lookups stay fast no
+matter how many active donations exist elsewhere.
+"""
+import hashlib
+import math
+import re
+
+import click
+from flask import current_app
+from sqlalchemy import select, union_all
+
+from models import Donation, User, db
+from queries import donation_listing
+
+EARTH_RADIUS_KM = 6371.0
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+
+# Search ring radii (km) tried before falling back to the requested radius
+SEARCH_RINGS_KM = (0.25, 0.5, 1, 2, 4, 8, 16, 32)
+MAX_COVERING_CELLS = 24
+
+
+# ---------- GEOCODING ----------
+
+# Known localities for the offline geocoder (Hyderabad by default)
+GAZETTEER = {
+    'madhapur': (17.4483, 78.3915),
+    'gachibowli': (17.4401, 78.3489),
+    'kondapur': (17.4690, 78.3578),
+    'hitech city': (17.4435, 78.3772),
+    'banjara hills': (17.4138, 78.4398),
+    'jubilee hills': (17.4325, 78.4070),
+    'ameerpet': (17.4375, 78.4482),
+    'kukatpally': (17.4849, 78.4138),
+    'secunderabad': (17.4399, 78.4983),
+    'begumpet': (17.4447, 78.4664),
+    'kothaguda': (17.4617, 78.3676),
+    'miyapur': (17.4968, 78.3614),
+    'charminar': (17.3616, 78.4747),
+    'abids': (17.3930, 78.4760),
+    'dilsukhnagar': (17.3688, 78.5247),
+    'lb nagar': (17.3457, 78.5522),
+    'uppal': (17.4058, 78.5591),
+    'mehdipatnam': (17.3959, 78.4311),
+    'downtown': (17.3850, 78.4867),
+}
+DEFAULT_CENTER = (17.3850, 78.4867)
+# Unknown addresses land somewhere within this many km of DEFAULT_CENTER
+FALLBACK_SPREAD_KM = 15.0
+
+_COORDINATES = re.compile(r'(-?\d{1,2}\.\d+)\s*,\s*(-?\d{1,3}\.\d+)')
+
+
+class OfflineGeocoder:
+    """Geocoder stand-in that never touches the network.
+
+    Resolves, in order: literal "lat, lon" coordinates in the address, a
+    known locality name, or a deterministic point derived from a hash of the
+    address, so the same address always maps to the same place.
+    """
+
+    def __init__(self, gazetteer=None, center=DEFAULT_CENTER, spread_km=FALLBACK_SPREAD_KM):
+        self.gazetteer = gazetteer or GAZETTEER
+        self.center = center
+        self.spread_km = spread_km
+
+    def geocode(self, address):
+        if not address:
+            return None
+
+        match = _COORDINATES.search(address)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return lat, lon
+
+        # Prefer the longest locality name found in the address
+        lowered = address.lower()
+        for name in sorted(self.gazetteer, key=len, reverse=True):
+            if name in lowered:
+                return self._jitter(self.gazetteer[name], address, 0.8)
+
+        return self._jitter(self.center, address, self.spread_km)
+
+    def _jitter(self, point, address, spread_km):
+        """Deterministic offset of up to ``spread_km`` from ``point``"""
+        digest = hashlib.sha1(address.strip().lower().encode()).digest()
+        distance = spread_km * int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF
+        bearing = 2 * math.pi * int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF
+        lat = point[0] + (distance / 111.32) * math.cos(bearing)
+        lon = point[1] + (distance / (111.32 * math.cos(math.radians(point[0])))) * math.sin(bearing)
+        return round(lat, 6), round(lon, 6)
+
+
+GEOCODERS = {
+    'offline': OfflineGeocoder,
+}
+
+
+def get_geocoder():
+    name = current_app.config.get('GEOCODER', 'offline')
+    if name not in GEOCODERS:
+        raise RuntimeError(f"Unknown GEOCODER: {name}")
+    return GEOCODERS[name]()
+
+
+def geocode(address):
+    return get_geocoder().geocode(address)
+
+
+def locate_donation(donation):
+    """Fill in a donation's coordinates and geohash from its address"""
+    point = geocode(donation.address)
+    if point:
+        donation.latitude, donation.longitude = point
+        donation.geohash = encode_geohash(*point)
+
+
+def locate_user(user):
+    point = geocode(user.address)
+    if point:
+        user.latitude, user.longitude = point
+
+
+# ---------- GEOHASH ----------
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, interval = (lon, lon_range) if even else (lat, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def _cell_size(precision):
+    """(height, width) of a geohash cell in degrees"""
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = math.floor(5 * precision / 2)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _bounding_box(lat, lon, radius_km):
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 1e-6)))
+    return (max(lat - dlat, -90.0), max(lon - dlon, -180.0),
+            min(lat + dlat, 90.0), min(lon + dlon, 180.0))
+
+
+def _cells_for_box(box, precision):
+    min_lat, min_lon, max_lat, max_lon = box
+    height, width = _cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(encode_geohash(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + width, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + height, max_lat)
+    return cells
+
+
+def covering_cells(lat, lon, radius_km):
+    """The finest set of geohash cells (at most MAX_COVERING_CELLS) that
+    covers the circle around (lat, lon)"""
+    box = _bounding_box(lat, lon, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _cell_size(precision)
+        rows = (box[2] - box[0]) / height + 2
+        columns = (box[3] - box[1]) / width + 2
+        if rows * columns <= MAX_COVERING_CELLS:
+            return _cells_for_box(box, precision)
+    return {''}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+# ---------- NEAREST DONATIONS ----------
+
+def _active_in_cells(cells):
+    """Active donations inside ``cells``: one (status, geohash) index range
+    scan per cell, combined with UNION ALL.
+
+    A single OR of the ranges reads the same rows, but SQLite only splits an
+    OR into separate index scans once ANALYZE has gathered statistics.
+    """
+    # Core columns: building these per request is much cheaper than via the ORM
+    table = Donation.__table__
+    columns = (table.c.id, table.c.latitude, table.c.longitude, table.c.expiry_time)
+    return union_all(*[
+        select(*columns).where(
+            table.c.status == 'active',
+            table.c.geohash >= cell,
+            table.c.geohash < cell + '~',
+        )
+        for cell in sorted(cells)
+    ]).subquery()
+
+
+def _nearest_in_ring(lat, lon, radius_km, k):
+    """Up to ``k`` nearest active donations within ``radius_km``.
+
+    The database sorts the ring's candidates by an equirectangular distance
+    (exact enough for ordering at city scale) so only a few rows come back
+    to be measured precisely. Expired donations are already out of the
+    active set (see expiry.py).
+    """
+    candidates = _active_in_cells(covering_cells(lat, lon, radius_km))
+    lon_scale = math.cos(math.radians(lat)) ** 2
+    dlat = candidates.c.latitude - lat
+    dlon = candidates.c.longitude - lon
+    query = select(candidates).order_by(dlat * dlat + dlon * dlon * lon_scale)
+
+    # Twice k as slack for the approximate ordering near the ring's edge
+    found = []
+    for row in db.session.execute(query.limit(k * 2)):
+        distance = haversine_km(lat, lon, row.latitude, row.longitude)
+        if distance <= radius_km:
+            found.append((distance, row.expiry_time, row.id))
+    return found
+
+
+def nearest_donations(lat, lon, radius_km=5.0, k=20):
+    """The ``k`` nearest active donations within ``radius_km``.
+
+    Returns ``(donation, distance_km)`` pairs, nearest first and soonest
+    to expire among equally near ones.
+    """
+    rings = [r for r in SEARCH_RINGS_KM if r < radius_km] + [radius_km]
+    found = []
+    for ring in rings:
+        found = _nearest_in_ring(lat, lon, ring, k)
+        # Everything within `ring` has been considered, so these are final
+        if len(found) >= k:
+            break
+
+    found.sort(key=lambda item: (item[0], item[1]))
+    found = found[:k]
+    if not found:
+        return []
+
+    donations = {
+        d.id: d
+        for d in donation_listing('list').filter(Donation.id.in_([item[2] for item in found]))
+    }
+    return [(donations[donation_id], distance) for distance, _, donation_id in found]
+
+
+def init_geo(app):
+    @app.cli.command('geocode-backfill')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def geocode_backfill(batch_size):
+        """Geocode users and donations that have no coordinates yet."""
+        for model, locate in ((User, locate_user), (Donation, locate_donation)):
+            total, last_id = 0, 0
+            while True:
+                batch = (
+                    model.query.filter(model.latitude.is_(None), model.id > last_id)
+                    .order_by(model.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not batch:
+                    break
+                for row in batch:
+                    locate(row)
+                    if row.latitude is not None:
+                        total += 1
+                db.session.commit()
+                last_id = batch[-1].id
+            click.echo(f"Geocoded {total} {model.__tablename__} rows")
+        # Imported here: matching imports this module
+        from matching import invalidate_profiles
+        invalidate_profiles()
@@ -0,0 +1,250 @@
+"""Donation image upload pipeline.
+
+The request only stores the upload: it hashes the bytes, keeps the original
+under the instance folder (it may carry EXIF such as GPS coordinates, so it
+is never served) and records ``image_hash`` with ``image_status='pending'``.
+
+A thread pool then builds the variants in ``IMAGE_VARIANTS``, each as JPEG
+and WebP, with the orientation applied and all metadata stripped:
+
+    static/uploads/<sha256>-thumb.jpg   static/uploads/<sha256>-thumb.webp
+    static/uploads/<sha256>-large.jpg   static/uploads/<sha256>-large.webp
+
+Filenames are content hashes, so the same photo uploaded twice is processed
+once, and ``/media/<file>`` can serve them with a one-year immutable cache
+lifetime.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import click
+from flask import current_app, send_from_directory, url_for
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import update
+
+from models import Donation, db
+from cache import invalidate
+
+# Bounding boxes (px): cards show "thumb", the detail page "large"
+IMAGE_VARIANTS = {
+    'thumb': (640, 640),
+    'large': (1600, 1600),
+}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+ALLOWED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png'}
+
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def upload_folder():
+    return current_app.config['UPLOAD_FOLDER']
+
+
+def originals_folder():
+    return current_app.config['IMAGE_ORIGINALS_FOLDER']
+
+
+def _variant_name(image_hash, size, extension):
+    return f'{image_hash}-{size}.{extension}'
+
+
+def _variants_exist(image_hash):
+    folder = upload_folder()
+    return all(
+        os.path.exists(os.path.join(folder, _variant_name(image_hash, size, ext)))
+        for size in IMAGE_VARIANTS for ext in ('jpg', 'webp')
+    )
+
+
+# ---------- UPLOAD ----------
+
+def store_upload(file_storage):
+    """Validate and keep an uploaded file. Returns ``(image_hash, ready)``;
+    ``ready`` is True when the same image has already been processed."""
+    data = file_storage.read()
+    try:
+        with Image.open(BytesIO(data)) as image:
+            # Only parses the header; decoding happens in the worker
+            image_format = image.format
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise InvalidImage('The uploaded file is not a readable image')
+    if image_format not in ALLOWED_FORMATS:
+        raise InvalidImage('Only JPEG and PNG images are supported')
+
+    image_hash = hashlib.sha256(data).hexdigest()
+    if _variants_exist(image_hash):
+        return image_hash, True
+
+    os.makedirs(originals_folder(), exist_ok=True)
+    path = os.path.join(originals_folder(), image_hash)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return image_hash, False
+
+
+def _write_atomic(path, data):
+    # Readers never see a half-written file, and concurrent writers of the
+    # same hash produce identical bytes anyway
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# ---------- PROCESSING ----------
+
+def _encode(image, extension):
+    buffer = BytesIO()
+    if extension == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        if image.mode != 'RGB':
+            # JPEG has no alpha channel: flatten onto white
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+            image = background
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_variants(image_hash):
+    """Write every variant of the stored original ``image_hash``"""
+    os.makedirs(upload_folder(), exist_ok=True)
+    with Image.open(os.path.join(originals_folder(), image_hash)) as original:
+        # Bake the EXIF orientation into the pixels before the metadata goes
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        for size, box in IMAGE_VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail(box, Image.LANCZOS)
+            for extension in ('jpg', 'webp'):
+                # A fresh encode carries no EXIF, ICC or XMP data
+                _write_atomic(
+                    os.path.join(upload_folder(), _variant_name(image_hash, size, extension)),
+                    _encode(variant, extension),
+                )
+
+
+def process_image(image_hash):
+    """Build the variants and mark every donation using the image"""
+    try:
+        build_variants(image_hash)
+        status = 'ready'
+    except Exception:
+        current_app.logger.exception("Processing image %s failed", image_hash)
+        status = 'failed'
+
+    db.session.execute(
+        update(Donation)
+        .where(Donation.image_hash == image_hash, Donation.image_status != 'ready')
+        .values(image_status=status)
+    )
+    db.session.commit()
+    if status == 'ready':
+        invalidate('donations')
+    return status
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('IMAGE_WORKERS', 2),
+                thread_name_prefix='image-worker',
+            )
+        return _executor
+
+
+def _run_job(app, image_hash):
+    with app.app_context():
+        try:
+            process_image(image_hash)
+        finally:
+            db.session.remove()
+
+
+def submit(image_hash):
+    """Process ``image_hash`` in the worker pool. Call after committing the
+    donation that references it."""
+    app = current_app._get_current_object()
+    if app.config.get('IMAGE_PIPELINE') == 'sync':
+        return process_image(image_hash)
+    _get_executor(app).submit(_run_job, app, image_hash)
+
+
+# ---------- TEMPLATES ----------
+
+def donation_image(donation, size='thumb'):
+    """URLs for ``donation``'s picture at ``size``: ``{'src', 'webp'}``, or
+    None while there is nothing to show"""
+    if donation.image_hash and donation.image_status == 'ready':
+        return {
+            'src': url_for('media', filename=_variant_name(donation.image_hash, size, 'jpg')),
+            'webp': url_for('media', filename=_variant_name(donation.image_hash, size, 'webp')),
+        }
+    if donation.image_path:
+        # Uploaded before the pipeline existed; run `flask process-images --legacy`
+        return {
+            'src': url_for('static', filename='uploads/' + donation.image_path),
+            'webp': None,
+        }
+    return None
+
+
+def init_images(app):
+    app.jinja_env.globals['donation_image'] = donation_image
+
+    @app.route('/media/<path:filename>')
+    def media(filename):
+        response = send_from_directory(
+            app.config['UPLOAD_FOLDER'], filename, max_age=MEDIA_MAX_AGE
+        )
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        return response
+
+    @app.cli.command('process-images')
+    @click.option('--legacy', is_flag=True,
+                  help='Also convert uploads made before the pipeline existed.')
+    def process_images(legacy):
+        """Process pending or failed donation images."""
+        if legacy:
+            converted = 0
+            for donation in Donation.query.filter(
+                Donation.image_path.isnot(None), Donation.image_hash.is_(None)
+            ):
+                path = os.path.join(app.config['UPLOAD_FOLDER'], donation.image_path)
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                donation.image_hash = hashlib.sha256(data).hexdigest()
+                donation.image_status = 'pending'
+                os.makedirs(originals_folder(), exist_ok=True)
+                _write_atomic(os.path.join(originals_folder(), donation.image_hash), data)
+                converted += 1
+            db.session.commit()
+            click.echo(f"Queued {converted} legacy uploads")
+
+        hashes = [
+            row[0] for row in db.session.query(Donation.image_hash).filter(
+                Donation.image_hash.isnot(None), Donation.image_status != 'ready'
+            ).distinct()
+        ]
+        for image_hash in hashes:
+            click.echo(f"{image_hash}: {process_image(image_hash)}")
+        click.echo(f"Processed {len(hashes)} images")
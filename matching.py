@@ -0,0 +1,319 @@
+"""Donation-to-NGO matching.
+
+When a donation is posted, every NGO is scored against it. The best
+``MATCH_SHORTLIST_SIZE`` are stored in ``donation_match`` (rank 1 is the
+best) and, with ``MATCH_NOTIFY=shortlist`` (the default), are the only NGOs
+notified. ``MATCH_NOTIFY=all`` notifies every NGO as before. Claiming stays
+first come, first served; the shortlist only decides who hears about a
+donation first.
+
+A score is a weighted sum (``MATCH_WEIGHTS``) of terms between 0 and 1:
+
+- ``distance``: exp(-km / scale). The scale shrinks as expiry nears, so
+  food about to expire goes to NGOs close enough to fetch it in time.
+  NGOs beyond ``MATCH_MAX_DISTANCE_KM`` are never shortlisted.
+- ``food``: how often the NGO claimed this food category recently
+  (smoothed; 0.5 without history)
+- ``size``: how close the quantity, in approximate kg, is to what the NGO
+  usually claims
+- ``load``: fewer claims still waiting for pickup is better
+- ``activity``: NGOs that claim regularly are likelier to collect
+- ``urgency``: sooner expiry ranks higher in an NGO's list of matches
+
+NGO profiles (location, claims over the last ``MATCH_HISTORY_DAYS``) are
+read with two queries into NumPy arrays and reused for
+``MATCH_PROFILE_TTL`` seconds per process. Registering an NGO or changing
+NGO coordinates calls ``invalidate_profiles``, which rebuilds them at once
+in this process, and in every process with a shared cache backend.
+
+Scoring is one broadcast over donations x NGOs, so ``flask
+match-donations`` re-ranks thousands of active donations against
+thousands of NGOs in a few matrix operations.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from flask import current_app
+from sqlalchemy import delete, insert, select
+
+from cache import generation, invalidate
+from geo import EARTH_RADIUS_KM
+from models import Donation, DonationMatch, User, db
+from quantities import approximate_kg, food_category
+
+DEFAULT_WEIGHTS = {
+    'distance': 0.4,
+    'food': 0.2,
+    'size': 0.1,
+    'load': 0.1,
+    'activity': 0.1,
+    'urgency': 0.1,
+}
+# Below this many hours left the distance scale starts shrinking
+URGENT_HOURS = 6.0
+# Floor for that shrinking, as a fraction of MATCH_DISTANCE_KM
+MIN_DISTANCE_SCALE = 0.25
+# Distance term when the donation or the NGO has no coordinates
+UNLOCATED_DISTANCE_SCORE = 0.1
+# Claims in the history window at which the activity term is ~0.63
+ACTIVE_CLAIMS = 5.0
+# Donations scored per matrix, to bound memory with many NGOs
+SCORE_CHUNK = 256
+# Cache namespace whose generation stamp tells processes to rebuild profiles
+PROFILES_NAMESPACE = 'ngo_profiles'
+
+def _log_size(row):
+    """log of a donation's approximate weight in kg (see quantities.py),
+    or NaN when it has none"""
+    kg = approximate_kg(row.quantity_value, row.quantity_unit)
+    return np.log(kg) if kg else np.nan
+
+
+def _food_key(row):
+    # Rows classified before the backfill ran fall back to their food type
+    return row.food_category or food_category(row.food_type)
+
+
+# ---------- PROFILES ----------
+
+class NgoProfiles:
+    """Every NGO as parallel arrays, one entry per NGO"""
+
+    def __init__(self, ngos, claims):
+        self.ids = np.array([row.id for row in ngos], dtype=np.int64)
+        n = len(self.ids)
+        self.lat = np.radians(np.array([row.latitude if row.latitude is not None else np.nan
+                                        for row in ngos], dtype=np.float32))
+        self.lon = np.radians(np.array([row.longitude if row.longitude is not None else np.nan
+                                        for row in ngos], dtype=np.float32))
+
+        self.food_categories = {}
+        ngo_index, food_index, log_sizes, waiting = [], [], [], []
+        position = {ngo_id: i for i, ngo_id in enumerate(self.ids.tolist())}
+        for row in claims:
+            index = position.get(row.claimed_by_id)
+            if index is None:
+                continue
+            ngo_index.append(index)
+            food_index.append(self.food_categories.setdefault(_food_key(row), len(self.food_categories)))
+            log_sizes.append(_log_size(row))
+            waiting.append(row.status == 'claimed')
+        ngo_index = np.array(ngo_index, dtype=np.int64)
+        food_index = np.array(food_index, dtype=np.int64)
+        log_sizes = np.array(log_sizes, dtype=np.float64)
+
+        self.claims = np.bincount(ngo_index, minlength=n).astype(np.float32)
+        self.waiting = np.bincount(ngo_index, weights=np.array(waiting, dtype=np.float64),
+                                   minlength=n).astype(np.float32)
+        # Claims per (NGO, food category)
+        self.food_claims = np.zeros((n, max(len(self.food_categories), 1)), dtype=np.float32)
+        np.add.at(self.food_claims, (ngo_index, food_index), 1)
+        # Geometric mean of the quantities each NGO claimed
+        sized = ~np.isnan(log_sizes)
+        sized_claims = np.bincount(ngo_index[sized], minlength=n)
+        log_total = np.bincount(ngo_index[sized], weights=log_sizes[sized], minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.log_size = np.where(sized_claims > 0, log_total / sized_claims, np.nan).astype(np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def build_profiles(now=None):
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=current_app.config.get('MATCH_HISTORY_DAYS', 90))
+    ngos = db.session.execute(
+        select(User.id, User.latitude, User.longitude).where(User.role == 'ngo').order_by(User.id)
+    ).all()
+    claims = db.session.execute(
+        select(Donation.claimed_by_id, Donation.food_type, Donation.food_category,
+               Donation.quantity_value, Donation.quantity_unit, Donation.status)
+        .where(Donation.claimed_by_id.is_not(None), Donation.claimed_at >= since)
+    ).all()
+    return NgoProfiles(ngos, claims)
+
+
+_profiles = None
+_profiles_built = 0.0
+_profiles_generation = None
+_profiles_lock = threading.Lock()
+
+
+def get_profiles():
+    """NGO profiles, rebuilt at most every ``MATCH_PROFILE_TTL`` seconds,
+    or after ``invalidate_profiles``"""
+    global _profiles, _profiles_built, _profiles_generation
+    ttl = current_app.config.get('MATCH_PROFILE_TTL', 300)
+    current = generation(PROFILES_NAMESPACE)
+    with _profiles_lock:
+        if (_profiles is None or time.monotonic() - _profiles_built > ttl
+                or current != _profiles_generation):
+            _profiles = build_profiles()
+            _profiles_built = time.monotonic()
+            _profiles_generation = current
+        return _profiles
+
+
+def reset_profiles():
+    global _profiles
+    with _profiles_lock:
+        _profiles = None
+
+
+def invalidate_profiles():
+    """Rebuild NGO profiles on next use, here and in processes sharing the
+    cache backend. Call after committing a new NGO or NGO coordinates."""
+    reset_profiles()
+    invalidate(PROFILES_NAMESPACE)
+
+
+# ---------- SCORING ----------
+
+def score(donations, profiles, now=None):
+    """A (donations x NGOs) score matrix. ``donations`` are rows or objects
+    with the ``MATCH_COLUMNS`` (latitude, longitude, expiry_time, parsed
+    quantity, food type and category). Pairs
+    that must not be matched score -inf."""
+    config = current_app.config
+    weights = {**DEFAULT_WEIGHTS, **config.get('MATCH_WEIGHTS', {})}
+    now = now or datetime.utcnow()
+
+    def column(values):
+        return np.array(values, dtype=np.float32)[:, None]
+
+    lat = np.radians(column([d.latitude if d.latitude is not None else np.nan for d in donations]))
+    lon = np.radians(column([d.longitude if d.longitude is not None else np.nan for d in donations]))
+    hours_left = column([(d.expiry_time - now).total_seconds() / 3600 for d in donations])
+    log_size = column([_log_size(d) for d in donations])
+    food = np.array([profiles.food_categories.get(_food_key(d), -1) for d in donations])
+
+    # Equirectangular distance: within MATCH_MAX_DISTANCE_KM it is as good
+    # as haversine, at a fraction of the cost per pair
+    dx = (profiles.lon - lon) * np.cos(lat)
+    dy = profiles.lat - lat
+    km = np.sqrt(dx * dx + dy * dy) * np.float32(EARTH_RADIUS_KM)
+    located = ~np.isnan(km)
+    scale = config.get('MATCH_DISTANCE_KM', 5.0) * np.clip(
+        hours_left / URGENT_HOURS, MIN_DISTANCE_SCALE, 1.0)
+    total = np.exp(-km / scale)
+    total[~located] = UNLOCATED_DISTANCE_SCORE
+    total *= weights['distance']
+
+    # Share of each NGO's claims in the donation's food type, smoothed
+    # towards 0.5; unseen food types count as zero claims
+    same_food = profiles.food_claims[:, np.maximum(food, 0)].T
+    same_food[food < 0] = 0
+    total += weights['food'] * (same_food + 1) / (profiles.claims + 2)
+
+    size = np.exp(np.abs(log_size - profiles.log_size) / -2)
+    size[np.isnan(size)] = 0.5
+    total += weights['size'] * size
+
+    # Terms that depend only on the NGO or only on the donation
+    load = 1 / (1 + profiles.waiting)
+    activity = 1 - np.exp(-profiles.claims / ACTIVE_CLAIMS)
+    urgency = np.clip(1 - hours_left / 24, 0, 1)
+    total += (weights['load'] * load + weights['activity'] * activity) + weights['urgency'] * urgency
+
+    total[located & (km > config.get('MATCH_MAX_DISTANCE_KM', 50.0))] = -np.inf
+    total[(hours_left <= 0).ravel()] = -np.inf
+    return total
+
+
+def shortlist(scores, size):
+    """For each row of ``scores``, the (column, score) pairs of the best
+    ``size`` columns, best first"""
+    size = min(size, scores.shape[1])
+    if size == 0:
+        return [[] for _ in range(scores.shape[0])]
+    best = np.argpartition(-scores, size - 1, axis=1)[:, :size]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return [
+        [(column, value) for column, value in zip(columns.tolist(), values.tolist()) if value > -np.inf]
+        for columns, values in zip(best, best_scores)
+    ]
+
+
+# ---------- MATCHES ----------
+
+def match_donations(donations, profiles=None, now=None):
+    """Score ``donations`` (which need ids) against every NGO and store
+    their shortlists. Returns {donation_id: [ngo_id, ...]}, best first.
+    The caller commits."""
+    if not donations:
+        return {}
+    profiles = profiles or get_profiles()
+    if not len(profiles):
+        return {d.id: [] for d in donations}
+    now = now or datetime.utcnow()
+    size = current_app.config.get('MATCH_SHORTLIST_SIZE', 10)
+
+    picks = []
+    for start in range(0, len(donations), SCORE_CHUNK):
+        chunk = donations[start:start + SCORE_CHUNK]
+        picks.extend(shortlist(score(chunk, profiles, now), size))
+
+    matches, records = {}, []
+    for donation, shortlisted in zip(donations, picks):
+        matches[donation.id] = [int(profiles.ids[column]) for column, _ in shortlisted]
+        records.extend(
+            {'donation_id': donation.id, 'ngo_id': int(profiles.ids[column]),
+             'rank': rank, 'score': round(value, 6), 'created_at': now}
+            for rank, (column, value) in enumerate(shortlisted, start=1)
+        )
+    db.session.execute(delete(DonationMatch).where(DonationMatch.donation_id.in_(list(matches))))
+    if records:
+        db.session.execute(insert(DonationMatch), records)
+    return matches
+
+
+def notification_recipients(ngo_ids):
+    """Who hears about a new donation: its shortlist, or None for every
+    NGO (``MATCH_NOTIFY=all``)"""
+    if current_app.config.get('MATCH_NOTIFY', 'shortlist') == 'all':
+        return None
+    return ngo_ids
+
+
+MATCH_COLUMNS = (Donation.id, Donation.latitude, Donation.longitude, Donation.expiry_time,
+                 Donation.quantity_value, Donation.quantity_unit, Donation.food_type,
+                 Donation.food_category)
+
+
+def rematch_active(batch_size=1000):
+    """Recompute the shortlist of every active donation. Returns the
+    number of donations matched."""
+    reset_profiles()
+    profiles = get_profiles()
+    now = datetime.utcnow()
+    total, last_id = 0, 0
+    while True:
+        batch = db.session.execute(
+            select(*MATCH_COLUMNS)
+            .where(Donation.status == 'active', Donation.expiry_time > now, Donation.id > last_id)
+            .order_by(Donation.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        match_donations(batch, profiles, now)
+        db.session.commit()
+        total += len(batch)
+        last_id = batch[-1].id
+    return total
+
+
+def init_matching(app):
+    @app.cli.command('match-donations')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def match_donations_command(batch_size):
+        """Re-rank every active donation against every NGO."""
+        started = time.perf_counter()
+        total = rematch_active(batch_size)
+        click.echo(f'Matched {total} donations in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,313 @@
+"""Request instrumentation and a Prometheus ``/metrics`` endpoint.
+
+Recorded per process, with no dependencies:
+
+- request count and latency per endpoint, method and status
+- SQL statements and SQL time per request (engine events), and the
+  duration of every statement
+- template render time per template
+- connection pool checkout wait and timeouts, and pool usage and
+  saturation read at scrape time
+
+Each recording is a dict lookup and a few additions under a lock, cheap
+enough to leave on in production. Under gunicorn every worker keeps its own
+numbers and ``/metrics`` reports the worker that answers; scrape the
+workers individually (or run one worker per container) to see them all.
+
+``/metrics`` is only served to scrapers that send ``METRICS_TOKEN`` as a
+bearer token; without a token configured it answers 404, so route names,
+traffic and pool internals aren't public.
+
+With ``SLOW_REQUEST_SECONDS`` set, requests slower than that are logged
+together with the SQL statements they ran.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+
+from models import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+# Statements kept per request for the slow request log
+SLOW_LOG_STATEMENTS = 50
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name + _labels(self.label_names, labels), value
+
+
+class Gauge:
+    """Values read at scrape time: ``collect()`` yields (labels, value)"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, collect):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name + _labels(self.label_names, labels), value
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(counts), total, count))
+                     for labels, (counts, total, count) in self._values.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                le = 'le="' + (bound if bound == '+Inf' else _number(bound)) + '"'
+                yield self.name + '_bucket' + _labels(self.label_names, labels, le), cumulative
+            yield self.name + '_sum' + _labels(self.label_names, labels), total
+            yield self.name + '_count' + _labels(self.label_names, labels), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {_number(value)}' for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.add(Counter(
+    'http_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status')))
+REQUEST_SECONDS = registry.add(Histogram(
+    'http_request_duration_seconds', 'Time to handle a request, excluding streamed bodies.',
+    ('endpoint',)))
+REQUEST_QUERIES = registry.add(Histogram(
+    'http_request_sql_queries', 'SQL statements run per request.', ('endpoint',),
+    buckets=QUERY_COUNT_BUCKETS))
+REQUEST_SQL_SECONDS = registry.add(Histogram(
+    'http_request_sql_duration_seconds', 'Time spent in SQL per request.', ('endpoint',)))
+SQL_SECONDS = registry.add(Histogram(
+    'sql_statement_duration_seconds', 'Duration of each SQL statement, in and out of requests.'))
+TEMPLATE_SECONDS = registry.add(Histogram(
+    'template_render_duration_seconds', 'Time to render a template.', ('template',)))
+POOL_WAIT_SECONDS = registry.add(Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled database connection.',
+    ('bind',)))
+POOL_TIMEOUTS = registry.add(Counter(
+    'db_pool_timeouts_total', 'Checkouts that gave up waiting for a pooled connection.', ('bind',)))
+
+
+# ---------- SQL ----------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    SQL_SECONDS.observe(elapsed)
+    if has_request_context():
+        g.metrics_sql_seconds = g.get('metrics_sql_seconds', 0.0) + elapsed
+        statements = g.get('metrics_statements')
+        if statements is not None and len(statements) < SLOW_LOG_STATEMENTS:
+            statements.append((elapsed, statement))
+
+
+def _instrument_pool(name, engine):
+    """Time ``engine``'s pool checkouts. There is no pool event before a
+    checkout starts waiting, so the pool's ``connect`` is wrapped."""
+    pool = engine.pool
+    if getattr(pool, 'metrics_instrumented', False):
+        return
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(name)
+            raise
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start, name)
+
+    pool.connect = timed_connect
+    pool.metrics_instrumented = True
+
+
+POOL_GAUGES = {
+    'checked_out': 'Pooled connections in use.',
+    'idle': 'Pooled connections open and idle.',
+    'overflow': 'Connections open beyond the pool size.',
+    'size': 'Configured pool size.',
+    'saturation': 'Share of the pool size plus overflow in use (1 means checkouts wait).',
+}
+
+
+def pool_status():
+    """{bind: {gauge: value}} for every engine with a sized pool"""
+    status = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        if hasattr(pool, 'checkedout') and hasattr(pool, 'size'):
+            checked_out = pool.checkedout()
+            # max_overflow of -1 means unlimited, which never saturates
+            capacity = pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+            status[key or 'default'] = {
+                'checked_out': checked_out,
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'size': pool.size(),
+                'saturation': checked_out / capacity if capacity else 0.0,
+            }
+    return status
+
+
+def _pool_gauge(name):
+    def collect():
+        return [((bind,), values[name]) for bind, values in pool_status().items()]
+    return Gauge(f'db_pool_{name}', POOL_GAUGES[name], ('bind',), collect)
+
+
+for _name in POOL_GAUGES:
+    registry.add(_pool_gauge(_name))
+
+
+# ---------- REQUESTS ----------
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+    if current_app.config.get('SLOW_REQUEST_SECONDS'):
+        g.metrics_statements = []
+
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    # Unmatched URLs share one label so scanners can't create new series
+    endpoint = request.endpoint or 'unmatched'
+    REQUESTS.inc(endpoint, request.method, response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    REQUEST_QUERIES.observe(g.get('sql_query_count', 0), endpoint)
+    REQUEST_SQL_SECONDS.observe(g.get('metrics_sql_seconds', 0.0), endpoint)
+
+    threshold = current_app.config.get('SLOW_REQUEST_SECONDS')
+    if threshold and elapsed >= threshold:
+        statements = g.get('metrics_statements') or []
+        current_app.logger.warning(
+            "Slow request: %s %s took %.3fs (%d SQL statements, %.3fs in SQL)%s",
+            request.method, request.full_path.rstrip('?'), elapsed,
+            g.get('sql_query_count', 0), g.get('metrics_sql_seconds', 0.0),
+            ''.join(f'\n  [{seconds * 1000:.1f} ms] {statement}' for seconds, statement in statements),
+        )
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context():
+        g.metrics_template_started = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    if has_request_context():
+        started = g.pop('metrics_template_started', None)
+        if started is not None:
+            TEMPLATE_SECONDS.observe(time.perf_counter() - started, template.name)
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            _instrument_pool(key or 'default', engine)
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+    app.before_request(_start_timer)
+    # after_request hooks run in reverse order of registration, so this one
+    # (registered first) also times the others
+    app.after_request(_record_request)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config.get('METRICS_TOKEN')
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(404)
+        return Response(registry.exposition(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,45 @@
+"""add donation access path indexes
+
+Revision ID: 1194cac38097
+Revises: 93f690b3007f
+Create Date: 2026-10-17 13:07:32.231487
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1194cac38097'
+down_revision = '93f690b3007f'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_donation_claimed_by_claimed_at', ['claimed_by_id', 'claimed_at']),
+    ('ix_donation_created_at', ['created_at']),
+    ('ix_donation_restaurant_created_at', ['restaurant_id', 'created_at']),
+    ('ix_donation_status_created_at', ['status', 'created_at']),
+    ('ix_donation_status_expiry_time', ['status', 'expiry_time']),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # Build without taking a write lock on a large, live donation table
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.create_index(name, 'donation', columns, unique=False,
+                                postgresql_concurrently=True)
+        return
+
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        for name, columns in INDEXES:
+            batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        for name, _ in reversed(INDEXES):
+            batch_op.drop_index(name)
@@ -0,0 +1,31 @@
+"""add expired donations counter
+
+Revision ID: 21f343224f13
+Revises: 8bbf5d6eaa07
+Create Date: 2026-10-17 16:42:11.508913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '21f343224f13'
+down_revision = '8bbf5d6eaa07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # stat_counter was seeded before donations could expire, so the expiry
+    # sweeper's increments had no row to update
+    op.execute(
+        "INSERT INTO stat_counter (name, value, updated_at) "
+        "SELECT 'donations_expired', COUNT(*), CURRENT_TIMESTAMP FROM donation "
+        "WHERE status = 'expired' "
+        "AND NOT EXISTS (SELECT 1 FROM stat_counter WHERE name = 'donations_expired')"
+    )
+
+
+def downgrade():
+    op.execute("DELETE FROM stat_counter WHERE name = 'donations_expired'")
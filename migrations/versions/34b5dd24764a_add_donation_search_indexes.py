@@ -0,0 +1,81 @@
+"""add donation search indexes
+
+Revision ID: 34b5dd24764a
+Revises: 1194cac38097
+Create Date: 2026-10-17 13:09:45.478053
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '34b5dd24764a'
+down_revision = '1194cac38097'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_DOCUMENT_SQL = (
+    "coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || "
+    "coalesce(food_type, '') || ' ' || coalesce(address, '')"
+)
+
+SQLITE_UPGRADE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS donation_fts USING fts5(
+        title, description, food_type, address,
+        content='donation', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS donation_fts_ai AFTER INSERT ON donation BEGIN
+        INSERT INTO donation_fts(rowid, title, description, food_type, address)
+        VALUES (new.id, new.title, new.description, new.food_type, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS donation_fts_ad AFTER DELETE ON donation BEGIN
+        INSERT INTO donation_fts(donation_fts, rowid, title, description, food_type, address)
+        VALUES ('delete', old.id, old.title, old.description, old.food_type, old.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS donation_fts_au
+    AFTER UPDATE OF title, description, food_type, address ON donation BEGIN
+        INSERT INTO donation_fts(donation_fts, rowid, title, description, food_type, address)
+        VALUES ('delete', old.id, old.title, old.description, old.food_type, old.address);
+        INSERT INTO donation_fts(rowid, title, description, food_type, address)
+        VALUES (new.id, new.title, new.description, new.food_type, new.address);
+    END""",
+    # Index the rows that already exist
+    "INSERT INTO donation_fts(donation_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS donation_fts_au",
+    "DROP TRIGGER IF EXISTS donation_fts_ad",
+    "DROP TRIGGER IF EXISTS donation_fts_ai",
+    "DROP TABLE IF EXISTS donation_fts",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_donation_search_document "
+                f"ON donation USING gin (to_tsvector('simple', {SEARCH_DOCUMENT_SQL}))"
+            )
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_donation_address_trgm "
+                "ON donation USING gin (address gin_trgm_ops)"
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_donation_address_trgm")
+        op.execute("DROP INDEX IF EXISTS ix_donation_search_document")
@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, verify_password
+from dbrouting import RoutingSession
+from timeleft import time_left
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(UserMixin, db.Model):
@@ -22,6 +24,10 @@ class User(UserMixin, db.Model):
     phone = db.Column(db.String(20))
     address = db.Column(db.String(300))
 
+    # Geocoded from address (see geo.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
@@ -41,12 +47,15 @@ class User(UserMixin, db.Model):
         lazy='dynamic'
     )
 
-    # Password helpers
+    # Denormalized donation counters (see userstats.py)
+    stats = db.relationship('UserStats', uselist=False, backref='user')
+
+    # Password helpers (see passwords.py; both may raise HashingBusy)
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     # --- Stats helpers for your project ---
 
@@ -55,20 +64,49 @@ class User(UserMixin, db.Model):
         """How many donations this user (restaurant) has created."""
         if self.role != 'restaurant':
             return 0
-        return self.donations.count()
+        return self.stats.given if self.stats else self.donations.count()
 
     @property
     def total_donations_taken(self):
         """How many donations this user (NGO) has claimed."""
         if self.role != 'ngo':
             return 0
-        return self.claimed_donations.count()
+        return self.stats.taken if self.stats else self.claimed_donations.count()
 
     def __repr__(self):
         return f'<User {self.email} ({self.role})>'
 
 
 class Donation(db.Model):
+    __table_args__ = (
+        # Active listings (index, list, APIs) and admin status filters:
+        # WHERE status = ? ORDER BY created_at DESC, plus per-status counts
+        db.Index('ix_donation_status_created_at', 'status', 'created_at'),
+        # Expiry sweeper: WHERE status = 'active' AND expiry_time <= now
+        db.Index('ix_donation_status_expiry_time', 'status', 'expiry_time'),
+        # Restaurant dashboard: a restaurant's donations, newest first
+        db.Index('ix_donation_restaurant_created_at', 'restaurant_id', 'created_at'),
+        # NGO dashboard: an NGO's claims, newest first
+        db.Index('ix_donation_claimed_by_claimed_at', 'claimed_by_id', 'claimed_at'),
+        # Unfiltered admin listing ordered by created_at
+        db.Index('ix_donation_created_at', 'created_at'),
+        # Nearby search: active donations inside geohash cells. Covers the
+        # columns geo.nearest_donations reads, so the scan never touches
+        # the table
+        db.Index('ix_donation_status_geohash', 'status', 'geohash',
+                 'latitude', 'longitude', 'expiry_time'),
+        # Listings filtered by category: WHERE status = ? AND food_category = ?
+        # ORDER BY created_at DESC
+        db.Index('ix_donation_status_category_created_at', 'status', 'food_category', 'created_at'),
+        # Admin stats: food rescued in total, per restaurant and per NGO,
+        # summed per unit. Covering, so the aggregates are index-only scans
+        db.Index('ix_donation_status_unit_value', 'status', 'quantity_unit', 'quantity_value'),
+        db.Index('ix_donation_restaurant_rescued', 'restaurant_id', 'status',
+                 'quantity_unit', 'quantity_value'),
+        db.Index('ix_donation_claimed_by_rescued', 'claimed_by_id', 'status',
+                 'quantity_unit', 'quantity_value'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     # Which restaurant created this donation
@@ -80,14 +118,31 @@ class Donation(db.Model):
     food_type = db.Column(db.String(100), nullable=False)  # e.g. "Veg", "Non-veg", "Snacks"
     quantity = db.Column(db.String(100), nullable=False)   # e.g. "20 plates", "10 boxes"
 
+    # Parsed from quantity and food_type (see quantities.py)
+    quantity_value = db.Column(db.Float, nullable=True)        # e.g. 20.0
+    quantity_unit = db.Column(db.String(10), nullable=True)    # 'kg', 'l', 'meals', 'items'
+    food_category = db.Column(db.String(30), nullable=True)    # a FOOD_CATEGORIES key
+
     address = db.Column(db.String(300), nullable=False)
 
+    # Geocoded from address (see geo.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)
+
     pickup_time = db.Column(db.DateTime, nullable=False)
     expiry_time = db.Column(db.DateTime, nullable=False)
 
+    # Uploads made before the image pipeline: the original file in static/uploads
     image_path = db.Column(db.String(300), nullable=True)
 
-    # 'active', 'claimed', 'completed', 'removed'
+    # SHA-256 of the uploaded file; resized variants are named after it (see images.py)
+    image_hash = db.Column(db.String(64), nullable=True, index=True)
+    # 'pending', 'ready' or 'failed'
+    image_status = db.Column(db.String(20), nullable=True)
+
+    # 'active', 'claimed', 'completed', 'expired', 'removed'
+    # (the expiry sweeper moves active donations past expiry_time to 'expired')
     status = db.Column(db.String(20), default='active')
 
     # Which NGO claimed this donation (if any)
@@ -99,22 +154,144 @@ class Donation(db.Model):
     def is_available(self):
         return self.status == 'active' and datetime.utcnow() < self.expiry_time
 
-    def time_left(self):
-        if datetime.utcnow() > self.expiry_time:
-            return "Expired"
-        
-        delta = self.expiry_time - datetime.utcnow()
-        total_seconds = delta.total_seconds()
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        
-        if hours > 24:
-            days = hours // 24
-            return f"{int(days)} days left"
-        elif hours >= 1:
-            return f"{int(hours)} hours left"
-        else:
-            return f"{int(minutes)} minutes left"
+    def time_left(self, now=None):
+        return time_left(self.expiry_time, now)
 
     def __repr__(self):
         return f'<Donation {self.title}>'
+
+
+
+class OutboxMessage(db.Model):
+    """A notification waiting to be delivered by the outbox worker."""
+    __tablename__ = 'outbox_message'
+    __table_args__ = (
+        # Per-recipient deduplication: one message per event per recipient
+        db.UniqueConstraint('dedup_key', 'recipient', name='uq_outbox_dedup_recipient'),
+        db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    # e.g. "donation-created:42"
+    dedup_key = db.Column(db.String(100), nullable=False)
+
+    # 'pending', 'sending', 'sent', 'failed'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # Set while a worker holds the message
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.dedup_key} -> {self.recipient} ({self.status})>'
+
+
+
+class StatCounter(db.Model):
+    """Precomputed platform-wide count, e.g. 'donations_active'.
+
+    Kept up to date incrementally by stats.py so admin pages don't have to
+    scan the user and donation tables.
+    """
+    __tablename__ = 'stat_counter'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StatCounter {self.name}={self.value}>'
+
+
+class DonationMatch(db.Model):
+    """An NGO shortlisted for a donation by the matching engine (see
+    matching.py). Rank 1 is the best match."""
+    __tablename__ = 'donation_match'
+    __table_args__ = (
+        # An NGO's matches, best first
+        db.Index('ix_donation_match_ngo_score', 'ngo_id', 'score'),
+    )
+
+    donation_id = db.Column(db.Integer, db.ForeignKey('donation.id'), primary_key=True)
+    ngo_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rank = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DonationMatch {self.donation_id} -> {self.ngo_id} #{self.rank}>'
+
+
+class DonationRollup(db.Model):
+    """Donations posted, claimed and expired in one hour or day, overall or
+    for one restaurant, NGO or area. Maintained by rollups.py."""
+    __tablename__ = 'donation_rollup'
+
+    # 'hour' or 'day'
+    granularity = db.Column(db.String(5), primary_key=True)
+    # 'all', 'restaurant', 'ngo' or 'area'
+    dimension = db.Column(db.String(10), primary_key=True)
+    # User id or geohash cell; '' for 'all'
+    dimension_key = db.Column(db.String(20), primary_key=True)
+    # UTC start of the hour or day
+    bucket = db.Column(db.DateTime, primary_key=True)
+
+    posted = db.Column(db.Integer, nullable=False, default=0)
+    claimed = db.Column(db.Integer, nullable=False, default=0)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DonationRollup {self.granularity} {self.dimension}:{self.dimension_key} {self.bucket}>'
+
+
+class ClaimLatencyRollup(db.Model):
+    """Histogram of created_at -> claimed_at times for the claims in one
+    rollup bucket; ``bin`` indexes rollups.LATENCY_BINS"""
+    __tablename__ = 'claim_latency_rollup'
+
+    granularity = db.Column(db.String(5), primary_key=True)
+    dimension = db.Column(db.String(10), primary_key=True)
+    dimension_key = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    bin = db.Column(db.Integer, primary_key=True)
+
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ClaimLatencyRollup {self.granularity} {self.dimension}:{self.dimension_key} {self.bucket} #{self.bin}>'
+
+
+class UserStats(db.Model):
+    """Donation counters for one user, kept up to date by userstats.py so
+    dashboards read one row instead of counting donations.
+
+    For a restaurant the status counts are over its donations; for an NGO,
+    over the donations it claimed.
+    """
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+    given = db.Column(db.Integer, nullable=False, default=0)      # donations posted
+    taken = db.Column(db.Integer, nullable=False, default=0)      # donations claimed
+    # Donations currently in each status
+    claimed = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+
+    # Last donation posted (restaurants) or claimed (NGOs)
+    last_activity_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<UserStats {self.user_id} given={self.given} taken={self.taken}>'
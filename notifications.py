@@ -0,0 +1,386 @@
+"""Notification outbox.
+
+Views never send email themselves. They write ``OutboxMessage`` rows in the
+same transaction as the change that triggered them and return; a worker
+delivers pending messages in batches, retrying failures with exponential
+backoff.
+
+Workers run either as daemon threads inside the web process
+(``NOTIFICATION_WORKER=thread``, the default) or as a separate process:
+
+    flask --app app deliver-notifications
+"""
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import current_app
+from sqlalchemy import String, cast, insert, literal, or_, select, update
+
+from models import Donation, OutboxMessage, User, db
+
+
+# ---------- BACKENDS ----------
+
+class ConsoleBackend:
+    """Prints messages to the console"""
+
+    def __init__(self, config):
+        pass
+
+    def deliver(self, messages):
+        for message in messages:
+            print(f"\n=== EMAIL NOTIFICATION ===")
+            print(f"To: {message.recipient}")
+            print(f"Subject: {message.subject}")
+            print(f"Message: {message.body}")
+            print(f"==========================\n")
+        return {}
+
+
+class SMTPBackend:
+    """Sends a whole batch over one SMTP connection.
+
+    Defaults to localhost:1025 so a local stand-in such as
+    ``python -m aiosmtpd -n -l localhost:1025`` can be used in development.
+    """
+
+    def __init__(self, config):
+        self.host = config.get('MAIL_SERVER') or 'localhost'
+        self.port = int(config.get('MAIL_PORT') or 1025)
+        self.use_tls = str(config.get('MAIL_USE_TLS', '')).lower() == 'true'
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self.sender = config.get('MAIL_DEFAULT_SENDER') or 'no-reply@foodrescue.local'
+
+    def deliver(self, messages):
+        errors = {}
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message.recipient
+                email['Subject'] = message.subject
+                email.set_content(message.body)
+                try:
+                    smtp.send_message(email)
+                except smtplib.SMTPException as e:
+                    errors[message.id] = str(e)
+        return errors
+
+
+BACKENDS = {
+    'console': ConsoleBackend,
+    'smtp': SMTPBackend,
+}
+
+
+def register_backend(name, backend_class):
+    """Make a custom backend selectable with NOTIFICATION_BACKEND=name"""
+    BACKENDS[name] = backend_class
+
+
+def get_backend(app):
+    name = app.config.get('NOTIFICATION_BACKEND', 'console')
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown NOTIFICATION_BACKEND: {name}")
+    return BACKENDS[name](app.config)
+
+
+# ---------- ENQUEUEING ----------
+
+def enqueue(recipient, subject, body, dedup_key):
+    """Add one message to the session; it is sent once the caller commits"""
+    db.session.add(OutboxMessage(
+        recipient=recipient,
+        subject=subject,
+        body=body,
+        dedup_key=dedup_key,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+        created_at=datetime.utcnow(),
+    ))
+
+
+def enqueue_for_role(role, subject, body, dedup_key, user_ids=None):
+    """Fan a message out to every user with ``role`` (or only those in
+    ``user_ids``) in a single INSERT ... SELECT, without loading the users
+    into Python."""
+    now = datetime.utcnow()
+    recipients = select(
+        User.email,
+        literal(subject),
+        literal(body),
+        literal(dedup_key),
+        literal('pending'),
+        literal(0),
+        literal(now),
+        literal(now),
+    ).where(User.role == role)
+    if user_ids is not None:
+        recipients = recipients.where(User.id.in_(user_ids))
+
+    db.session.execute(
+        insert(OutboxMessage).from_select(
+            ['recipient', 'subject', 'body', 'dedup_key', 'status',
+             'attempts', 'next_attempt_at', 'created_at'],
+            recipients,
+        )
+    )
+
+
+def notify_donation_created(donation, restaurant, ngo_ids=None):
+    """Tell the NGOs in ``ngo_ids`` (default: all) about a new donation"""
+    enqueue_for_role(
+        'ngo',
+        f"New Food Donation Available: {donation.title}",
+        f"A new food donation is available from {restaurant.name}.\n\n"
+        f"Details:\n"
+        f"- Food Type: {donation.food_type}\n"
+        f"- Quantity: {donation.quantity}\n"
+        f"- Pickup Address: {donation.address}\n"
+        f"- Available Until: {donation.expiry_time}\n\n"
+        f"Visit the platform to claim this donation.",
+        f"donation-created:{donation.id}",
+        ngo_ids,
+    )
+
+
+# Donations listed one by one in a batch notification; the rest are counted
+BATCH_NOTIFICATION_ITEMS = 20
+
+
+def notify_donations_imported(donations, restaurant, donation_ids, ngo_ids=None):
+    """One message per NGO (in ``ngo_ids``, default: all) for a whole bulk
+    import, instead of one per donation"""
+    lines = [
+        f"- {donation['title']}: {donation['quantity']} {donation['food_type']}, "
+        f"available until {donation['expiry_time']}"
+        for donation in donations[:BATCH_NOTIFICATION_ITEMS]
+    ]
+    if len(donations) > BATCH_NOTIFICATION_ITEMS:
+        lines.append(f"- and {len(donations) - BATCH_NOTIFICATION_ITEMS} more")
+    enqueue_for_role(
+        'ngo',
+        f"{len(donations)} New Food Donations Available from {restaurant.name}",
+        f"{restaurant.name} has posted {len(donations)} food donations.\n\n"
+        + "\n".join(lines)
+        + "\n\nVisit the platform to claim them.",
+        f"donations-imported:{min(donation_ids)}:{len(donation_ids)}",
+        ngo_ids,
+    )
+
+
+def notify_donation_claimed(donation, ngo):
+    enqueue(
+        donation.restaurant.email,
+        f"Your Donation Has Been Claimed: {donation.title}",
+        f"Your food donation has been claimed by {ngo.name}.\n\n"
+        f"NGO Contact: {ngo.email}\n"
+        f"Claimed at: {donation.claimed_at}\n\n"
+        f"Please coordinate the pickup with the NGO.",
+        f"donation-claimed:{donation.id}",
+    )
+
+
+def notify_donations_expired(donation_ids):
+    """Tell each restaurant that its donation expired unclaimed, for a whole
+    batch of donations in one INSERT ... SELECT."""
+    now = datetime.utcnow()
+    messages = select(
+        User.email,
+        literal("Your Donation Expired: ") + Donation.title,
+        literal("Your food donation \"") + Donation.title
+        + literal("\" reached its expiry time without being claimed "
+                  "and is no longer listed."),
+        literal("donation-expired:") + cast(Donation.id, String),
+        literal('pending'),
+        literal(0),
+        literal(now),
+        literal(now),
+    ).join(User, Donation.restaurant_id == User.id).where(Donation.id.in_(donation_ids))
+
+    db.session.execute(
+        insert(OutboxMessage).from_select(
+            ['recipient', 'subject', 'body', 'dedup_key', 'status',
+             'attempts', 'next_attempt_at', 'created_at'],
+            messages,
+        )
+    )
+
+
+# ---------- DELIVERY ----------
+
+class OutboxWorker:
+    """Claims due messages in batches and hands them to the backend."""
+
+    def __init__(self, app, batch_size=None):
+        self.app = app
+        self.batch_size = batch_size or app.config.get('NOTIFICATION_BATCH_SIZE', 100)
+        self.max_attempts = app.config.get('NOTIFICATION_MAX_ATTEMPTS', 5)
+        self.retry_base = app.config.get('NOTIFICATION_RETRY_BASE', 30)
+        self.lock_timeout = timedelta(seconds=app.config.get('NOTIFICATION_LOCK_TIMEOUT', 300))
+        self.backend = get_backend(app)
+        self.worker_id = uuid.uuid4().hex
+
+    def _claim_batch(self):
+        """Mark a batch as ours with a conditional UPDATE so that several
+        workers (threads or processes) never deliver the same message."""
+        now = datetime.utcnow()
+        due = or_(
+            (OutboxMessage.status == 'pending') & (OutboxMessage.next_attempt_at <= now),
+            # Messages held by a worker that died mid-batch
+            (OutboxMessage.status == 'sending') & (OutboxMessage.locked_at < now - self.lock_timeout),
+        )
+        candidate_ids = db.session.scalars(
+            select(OutboxMessage.id)
+            .where(due)
+            .order_by(OutboxMessage.next_attempt_at)
+            .limit(self.batch_size)
+        ).all()
+        if not candidate_ids:
+            return []
+
+        db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(candidate_ids), due)
+            .values(status='sending', locked_by=self.worker_id, locked_at=now)
+        )
+        db.session.commit()
+
+        return OutboxMessage.query.filter_by(
+            status='sending', locked_by=self.worker_id
+        ).all()
+
+    def _backoff(self, attempts):
+        return timedelta(seconds=min(self.retry_base * 2 ** (attempts - 1), 3600))
+
+    def run_once(self):
+        """Deliver one batch. Returns the number of messages processed."""
+        messages = self._claim_batch()
+        if not messages:
+            return 0
+
+        try:
+            errors = self.backend.deliver(messages)
+        except Exception as e:  # connection-level failure: whole batch failed
+            current_app.logger.warning("Notification batch failed: %s", e)
+            errors = {message.id: str(e) for message in messages}
+
+        now = datetime.utcnow()
+        for message in messages:
+            message.attempts += 1
+            message.locked_by = None
+            message.locked_at = None
+            error = errors.get(message.id)
+            if error is None:
+                message.status = 'sent'
+                message.sent_at = now
+                message.last_error = None
+            elif message.attempts >= self.max_attempts:
+                message.status = 'failed'
+                message.last_error = error
+            else:
+                message.status = 'pending'
+                message.next_attempt_at = now + self._backoff(message.attempts)
+                message.last_error = error
+        db.session.commit()
+        return len(messages)
+
+    def run_forever(self, wakeup=None, stop=None, poll_interval=None):
+        poll_interval = poll_interval or self.app.config.get('NOTIFICATION_POLL_INTERVAL', 5)
+        with self.app.app_context():
+            while not (stop and stop.is_set()):
+                try:
+                    processed = self.run_once()
+                except Exception:
+                    current_app.logger.exception("Notification worker error")
+                    db.session.rollback()
+                    processed = 0
+                finally:
+                    db.session.remove()
+
+                if processed:
+                    continue
+                if wakeup:
+                    wakeup.wait(poll_interval)
+                    wakeup.clear()
+                else:
+                    time.sleep(poll_interval)
+
+
+_wakeup = threading.Event()
+_threads = []
+_threads_lock = threading.Lock()
+
+
+def start_worker_threads(app, count=None):
+    """Start in-process delivery threads (once per process)"""
+    with _threads_lock:
+        if _threads:
+            return
+        count = count or app.config.get('NOTIFICATION_WORKERS', 2)
+        for i in range(count):
+            worker = OutboxWorker(app)
+            thread = threading.Thread(
+                target=worker.run_forever,
+                kwargs={'wakeup': _wakeup},
+                name=f'outbox-worker-{i}',
+                daemon=True,
+            )
+            thread.start()
+            _threads.append(thread)
+
+
+def wake_workers():
+    """Call after committing outbox rows so they go out right away"""
+    app = current_app._get_current_object()
+    if app.config.get('NOTIFICATION_WORKER') == 'thread':
+        start_worker_threads(app)
+        _wakeup.set()
+
+
+def init_notifications(app):
+    @app.cli.command('deliver-notifications')
+    @click.option('--once', is_flag=True, help='Deliver pending messages and exit.')
+    @click.option('--workers', default=1, show_default=True, help='Delivery threads.')
+    @click.option('--batch-size', default=None, type=int)
+    def deliver_notifications(once, workers, batch_size):
+        """Run the notification outbox worker."""
+        if once:
+            worker = OutboxWorker(app, batch_size=batch_size)
+            total = 0
+            while True:
+                processed = worker.run_once()
+                if not processed:
+                    break
+                total += processed
+            click.echo(f"Processed {total} notifications")
+            return
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(
+                target=OutboxWorker(app, batch_size=batch_size).run_forever,
+                kwargs={'stop': stop},
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        click.echo(f"Delivering notifications with {workers} worker(s). Ctrl+C to stop.")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop.set()
@@ -0,0 +1,81 @@
+"""Password hashing.
+
+The hash method and its cost come from ``PASSWORD_HASH_METHOD`` (any
+werkzeug method string, e.g. ``pbkdf2:sha256:600000`` or
+``scrypt:32768:8:1``). Hashes made with other parameters keep working and
+are replaced with the current method at the user's next login
+(``needs_rehash``).
+
+Hashing is deliberately expensive, so it runs on a small bounded pool
+(``PASSWORD_HASH_POOL``: ``thread``, ``process`` or ``inline``) of
+``PASSWORD_HASH_WORKERS`` workers. At most ``PASSWORD_HASH_MAX_PENDING``
+hashes may be queued or running per process. Beyond that ``HashingBusy`` is
+raised instead of letting a burst of logins tie up every request worker.
+Both hashlib's pbkdf2 and scrypt release the GIL, so the thread pool uses
+several cores.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are already queued"""
+
+
+def _config(key, default):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+
+def hash_method():
+    return _config('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+
+@lru_cache(maxsize=8)
+def _method_prefix(method):
+    # werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"), so
+    # compare against what it actually writes into a hash
+    return generate_password_hash('', method, salt_length=1).split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _method_prefix(hash_method())
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = None
+
+
+def _run(function, *args):
+    """Run ``function`` on the hashing pool and wait for its result"""
+    global _executor, _pending
+    kind = _config('PASSWORD_HASH_POOL', 'inline')
+    if kind == 'inline':
+        return function(*args)
+
+    with _executor_lock:
+        if _executor is None:
+            workers = _config('PASSWORD_HASH_WORKERS', 2)
+            pool = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+            _executor = pool(max_workers=workers)
+            _pending = threading.BoundedSemaphore(_config('PASSWORD_HASH_MAX_PENDING', 16))
+    if not _pending.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return _executor.submit(function, *args).result()
+    finally:
+        _pending.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, hash_method())
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
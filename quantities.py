@@ -0,0 +1,156 @@
+"""Structured quantities and food categories.
+
+``Donation.quantity`` and ``Donation.food_type`` are free text typed by
+restaurants ("10-15 kg", "20 plates", "Veg"). Each donation also stores a
+parsed form in indexed columns, so reports can add up food and listings
+can filter by category without scanning strings:
+
+- ``quantity_value`` and ``quantity_unit``: "10-15 kg" -> 12.5 ``kg``. The
+  units are ``kg``, ``l``, ``meals`` and ``items``. Grams, pounds and
+  millilitres are converted, and ranges become their midpoint.
+  ``quantity_unit`` is NULL when no unit is recognised.
+- ``food_category``: one of ``FOOD_CATEGORIES``, looked up from the food
+  type's words (``other`` when nothing matches)
+
+New donations are classified when they are created. Older rows are filled
+in by a streaming backfill that can be re-run at any time:
+
+    flask --app app quantities-backfill
+"""
+import re
+
+import click
+from sqlalchemy import select, update
+
+from models import Donation, db
+
+# Unit words -> (unit, factor to that unit)
+UNITS = {
+    'kg': ('kg', 1.0), 'kgs': ('kg', 1.0), 'kilo': ('kg', 1.0), 'kilos': ('kg', 1.0),
+    'kilogram': ('kg', 1.0), 'kilograms': ('kg', 1.0),
+    'g': ('kg', 0.001), 'gm': ('kg', 0.001), 'gms': ('kg', 0.001),
+    'gram': ('kg', 0.001), 'grams': ('kg', 0.001),
+    'lb': ('kg', 0.4536), 'lbs': ('kg', 0.4536), 'pound': ('kg', 0.4536), 'pounds': ('kg', 0.4536),
+    'l': ('l', 1.0), 'ltr': ('l', 1.0), 'ltrs': ('l', 1.0), 'litre': ('l', 1.0),
+    'litres': ('l', 1.0), 'liter': ('l', 1.0), 'liters': ('l', 1.0),
+    'ml': ('l', 0.001),
+    'meal': ('meals', 1.0), 'meals': ('meals', 1.0), 'plate': ('meals', 1.0),
+    'plates': ('meals', 1.0), 'serving': ('meals', 1.0), 'servings': ('meals', 1.0),
+    'portion': ('meals', 1.0), 'portions': ('meals', 1.0), 'thali': ('meals', 1.0),
+    'thalis': ('meals', 1.0), 'packet': ('meals', 1.0), 'packets': ('meals', 1.0),
+    'people': ('meals', 1.0), 'persons': ('meals', 1.0), 'pax': ('meals', 1.0),
+    'box': ('items', 1.0), 'boxes': ('items', 1.0), 'pack': ('items', 1.0),
+    'packs': ('items', 1.0), 'piece': ('items', 1.0), 'pieces': ('items', 1.0),
+    'pcs': ('items', 1.0), 'tray': ('items', 1.0), 'trays': ('items', 1.0),
+    'bag': ('items', 1.0), 'bags': ('items', 1.0), 'crate': ('items', 1.0),
+    'crates': ('items', 1.0), 'loaf': ('items', 1.0), 'loaves': ('items', 1.0),
+    'bottle': ('items', 1.0), 'bottles': ('items', 1.0), 'dozen': ('items', 12.0),
+    'item': ('items', 1.0), 'items': ('items', 1.0), 'unit': ('items', 1.0), 'units': ('items', 1.0),
+    'sandwich': ('items', 1.0), 'sandwiches': ('items', 1.0),
+}
+
+# Category -> words in a food type that put it there. Categories are
+# tried in this order, so "packaged food" is packaged rather than cooked.
+FOOD_CATEGORIES = {
+    'bakery': ('bakery', 'bread', 'breads', 'bun', 'buns', 'cake', 'cakes', 'pastry',
+               'pastries', 'baked', 'cookies', 'biscuits'),
+    'produce': ('produce', 'vegetables', 'vegetable', 'fruit', 'fruits', 'fresh', 'salad', 'greens'),
+    'dairy': ('dairy', 'milk', 'curd', 'yogurt', 'yoghurt', 'paneer', 'cheese', 'butter'),
+    'snacks': ('snacks', 'snack', 'samosa', 'chips', 'namkeen', 'sandwich', 'sandwiches'),
+    'packaged': ('packaged', 'canned', 'tinned', 'dry', 'grains', 'groceries', 'grocery', 'ration'),
+    'beverages': ('beverages', 'beverage', 'drinks', 'juice', 'tea', 'coffee', 'water'),
+    'cooked': ('cooked', 'meal', 'meals', 'veg', 'non-veg', 'nonveg', 'vegetarian', 'biryani',
+               'rice', 'curry', 'dal', 'thali', 'meat', 'chicken', 'fish', 'prepared', 'food'),
+    'other': (),
+}
+_CATEGORY_OF_WORD = {word: category for category, words in FOOD_CATEGORIES.items() for word in words}
+
+# Rough weight of a meal, for the matching engine's size comparison
+MEAL_KG = 0.4
+
+_AMOUNT = re.compile(
+    r'(\d[\d,]*(?:\.\d+)?)(?:\s*(?:-|to|–)\s*(\d[\d,]*(?:\.\d+)?))?\s*([a-z]+)?', re.IGNORECASE)
+_WORD = re.compile(r'[a-z]+(?:-[a-z]+)?')
+
+
+def parse_quantity(text):
+    """(value, unit) from a free-text quantity: "10-15 kg" -> (12.5, 'kg').
+    The unit is None when none is recognised; both are None without a
+    number."""
+    match = _AMOUNT.search(text or '')
+    if not match:
+        return None, None
+    low = float(match.group(1).replace(',', ''))
+    high = float(match.group(2).replace(',', '')) if match.group(2) else low
+    value = (low + high) / 2
+    unit, factor = UNITS.get((match.group(3) or '').lower(), (None, 1.0))
+    if unit is None:
+        # "20 food packets", "5 large trays": look at the following words
+        for word in _WORD.findall(text[match.end():].lower())[:2]:
+            if word in UNITS:
+                unit, factor = UNITS[word]
+                break
+    return round(value * factor, 3), unit
+
+
+def food_category(food_type):
+    """The ``FOOD_CATEGORIES`` key for a free-text food type"""
+    words = _WORD.findall((food_type or '').lower())
+    categories = {_CATEGORY_OF_WORD[word] for word in words if word in _CATEGORY_OF_WORD}
+    for category in FOOD_CATEGORIES:
+        if category in categories:
+            return category
+    return 'other'
+
+
+def approximate_kg(value, unit):
+    """``value`` in kilograms, or None for units without a weight"""
+    if value is None:
+        return None
+    if unit in ('kg', 'l'):
+        return value
+    if unit == 'meals':
+        return value * MEAL_KG
+    return None
+
+
+def classified_fields(quantity, food_type):
+    """The parsed columns for a donation's quantity and food type"""
+    value, unit = parse_quantity(quantity)
+    return {'quantity_value': value, 'quantity_unit': unit, 'food_category': food_category(food_type)}
+
+
+def classify_donation(donation):
+    """Fill in a donation's parsed quantity and food category"""
+    for name, value in classified_fields(donation.quantity, donation.food_type).items():
+        setattr(donation, name, value)
+
+
+def backfill(batch_size=1000, everything=False):
+    """Classify donations in id order, one batch per transaction. Only rows
+    without a category unless ``everything``. Returns the number updated."""
+    total, last_id = 0, 0
+    while True:
+        query = select(Donation.id, Donation.quantity, Donation.food_type).where(Donation.id > last_id)
+        if not everything:
+            query = query.where(Donation.food_category.is_(None))
+        batch = db.session.execute(query.order_by(Donation.id).limit(batch_size)).all()
+        if not batch:
+            return total
+        # One executemany UPDATE per batch, by primary key
+        db.session.execute(update(Donation), [
+            {'id': row.id, **classified_fields(row.quantity, row.food_type)} for row in batch
+        ])
+        db.session.commit()
+        total += len(batch)
+        last_id = batch[-1].id
+
+
+def init_quantities(app):
+    @app.cli.command('quantities-backfill')
+    @click.option('--batch-size', default=1000, show_default=True)
+    @click.option('--all', 'everything', is_flag=True,
+                  help='Re-classify every donation, e.g. after changing the lookup tables.')
+    def quantities_backfill(batch_size, everything):
+        """Parse quantities and food categories of existing donations."""
+        click.echo(f'Classified {backfill(batch_size, everything)} donations')
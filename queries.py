@@ -0,0 +1,52 @@
+"""Reusable Donation listing queries.
+
+Templates render ``donation.restaurant`` and ``donation.claimed_by_ngo``,
+which are lazy backrefs on ``User``. Every view builds its listing through
+``donation_listing`` so the relationships it renders are loaded in the same
+SELECT instead of one extra query per row.
+"""
+from sqlalchemy.orm import joinedload
+from models import Donation
+
+# Relationships each view renders, keyed by view name
+VIEW_RELATIONSHIPS = {
+    'index': (),
+    'list': ('restaurant',),
+    'detail': ('restaurant', 'claimed_by_ngo'),
+    'api': ('restaurant',),
+    'admin': ('restaurant', 'claimed_by_ngo'),
+    'restaurant_dashboard': ('claimed_by_ngo',),
+    'ngo_available': (),
+    'ngo_claimed': ('restaurant',),
+    'matches': ('restaurant',),
+}
+
+
+def _loader(relationship):
+    if relationship == 'restaurant':
+        # restaurant_id is NOT NULL, so an inner join is safe and cheaper
+        return joinedload(Donation.restaurant, innerjoin=True)
+    return joinedload(getattr(Donation, relationship))
+
+
+def with_relationships(query, view):
+    """Apply the eager loading ``view`` needs to an existing Donation query"""
+    options = [_loader(name) for name in VIEW_RELATIONSHIPS[view]]
+    return query.options(*options) if options else query
+
+
+def donation_listing(view, query=None):
+    """Donation query for ``view``, optionally starting from ``query``
+    (e.g. a user's ``donations`` relationship)."""
+    if query is None:
+        query = Donation.query
+    return with_relationships(query, view)
+
+
+def active_listing(view):
+    """Newest-first active donations, eager-loaded for ``view``"""
+    return (
+        donation_listing(view)
+        .filter(Donation.status == 'active')
+        .order_by(Donation.created_at.desc())
+    )
@@ -0,0 +1,76 @@
+"""Per-request SQL query counting and query budgets.
+
+Every statement executed while handling a request is counted. Views can
+declare how many queries they are allowed with ``@query_budget(n)``. When
+``QUERY_BUDGET_STRICT`` is set (test mode) going over budget raises
+``QueryBudgetExceeded``; otherwise it is logged as a warning.
+
+Streamed responses run part of their work (and maybe queries) while the
+body is being sent, after the response hooks. Their budget is checked
+once the body has been sent, and they get no ``X-Query-Count`` header,
+because headers go out before the body.
+"""
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+
+
+def get_query_count():
+    """Number of SQL statements run so far in the current request"""
+    return g.get('sql_query_count', 0)
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of SQL queries a view may run"""
+    def decorator(f):
+        # Outer decorators (login_required, admin_required) use functools.wraps,
+        # which copies this attribute onto the registered view function
+        f.query_budget = max_queries
+        return f
+    return decorator
+
+
+def _enforce(app, endpoint, budget, count):
+    if count > budget:
+        message = f"{endpoint} ran {count} SQL queries (budget {budget})"
+        if app.config.get('QUERY_BUDGET_STRICT'):
+            raise QueryBudgetExceeded(message)
+        app.logger.warning(message)
+
+
+def _check_budget(response):
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+
+    if response.is_streamed:
+        if budget is not None:
+            # The body runs in this request's context (stream_with_context),
+            # so its queries are counted on the same g
+            app, request_g = current_app._get_current_object(), g._get_current_object()
+            endpoint = request.endpoint
+            response.call_on_close(lambda: _enforce(
+                app, endpoint, budget, request_g.get('sql_query_count', 0)))
+        return response
+
+    count = get_query_count()
+    if current_app.config.get('QUERY_COUNT_HEADER'):
+        response.headers['X-Query-Count'] = str(count)
+    if budget is not None:
+        _enforce(current_app, request.endpoint, budget, count)
+    return response
+
+
+def init_query_counter(app):
+    # Listening on the Engine class covers every engine/bind the app creates
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+    app.after_request(_check_budget)
@@ -0,0 +1,75 @@
+"""Fixed-window rate limiting with an in-process store.
+
+Limits are written ``"<count>/<seconds>"`` (e.g. ``"20/300"``). An empty
+value or ``"0"`` turns a limit off. Each process counts on its own, so with
+N workers a client can make up to N times the limit in the worst case.
+That still caps the work per worker, which is the point.
+"""
+import threading
+import time
+
+# Expired windows are swept once the store grows past this many keys
+PRUNE_THRESHOLD = 10000
+
+
+def parse_limit(value):
+    """``"20/300"`` -> (20, 300.0); None when the limit is off"""
+    if not value or value == '0':
+        return None
+    count, _, period = str(value).partition('/')
+    return int(count), float(period or 60)
+
+
+class RateLimiter:
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _window(self, key, now):
+        window = self._windows.get(key)
+        if window is None or window[0] + self.period <= now:
+            window = self._windows[key] = [now, 0]
+        return window
+
+    def retry_after(self, key):
+        """Seconds until ``key`` may try again; 0 if it may now"""
+        now = time.monotonic()
+        with self._lock:
+            start, count = self._window(key, now)
+            return max(start + self.period - now, 0) if count >= self.limit else 0
+
+    def hit(self, key):
+        """Count an attempt by ``key``"""
+        now = time.monotonic()
+        with self._lock:
+            self._window(key, now)[1] += 1
+            if len(self._windows) > PRUNE_THRESHOLD:
+                self._prune(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def _prune(self, now):
+        for key in [k for k, (start, _) in self._windows.items() if start + self.period <= now]:
+            del self._windows[key]
+
+
+class NullLimiter:
+    """Stands in for a limit that is turned off"""
+
+    def retry_after(self, key):
+        return 0
+
+    def hit(self, key):
+        pass
+
+    def reset(self, key):
+        pass
+
+
+def make_limiter(value):
+    limit = parse_limit(value)
+    return RateLimiter(*limit) if limit else NullLimiter()
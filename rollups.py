@@ -0,0 +1,284 @@
+"""Time-series rollups for the admin trends page.
+
+Every hour and every day gets a row in ``donation_rollup`` with the number
+of donations posted, claimed and expired. There is one row for the whole
+platform (dimension ``all``), and one each per restaurant, per NGO and per
+area. An area is a geohash cell of ``AREA_PRECISION`` characters, about
+5 x 5 km. Each event is counted in the bucket of its own time:
+
+- posted: ``created_at``
+- claimed: ``claimed_at``, for every donation that was claimed, including
+  ones completed or removed since
+- expired: ``expiry_time``, for donations whose status is ``'expired'``
+
+Median claim latency (``created_at`` -> ``claimed_at``) can't be summed
+across buckets. Each bucket therefore keeps a histogram of latencies in
+``claim_latency_rollup`` (bins: ``LATENCY_BINS``). Histograms add up, so the
+median of any range of buckets is read from their merged histogram.
+
+Views call ``record`` in the transaction that creates, claims or expires
+donations. Each call is one upsert per touched bucket row, which adds to
+the counts atomically. ``/admin/trends`` reads only these tables.
+``flask rollups-backfill`` rebuilds them from the donation table, all of it
+or from ``--since`` on. It runs in one transaction, and events recorded in
+the rebuilt range while it runs can be counted twice, so run it when the
+site is quiet.
+"""
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+import click
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import ClaimLatencyRollup, Donation, DonationRollup, db
+from timeleft import utc_timestamp
+
+GRANULARITIES = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+DIMENSIONS = ('all', 'restaurant', 'ngo', 'area')
+
+# Geohash characters that make up an area; 5 is a cell of about 5 x 5 km
+AREA_PRECISION = 5
+
+# Upper edges, in minutes, of the claim latency histogram bins. The last
+# bin holds everything slower than two days.
+LATENCY_BINS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 360, 480, 720, 1080, 1440, 2880)
+
+# Columns ``record`` needs from each donation
+ROLLUP_COLUMNS = (Donation.restaurant_id, Donation.claimed_by_id, Donation.geohash,
+                  Donation.created_at, Donation.claimed_at, Donation.expiry_time)
+
+# Event -> the column that dates it
+EVENTS = {
+    'posted': Donation.created_at,
+    'claimed': Donation.claimed_at,
+    'expired': Donation.expiry_time,
+}
+
+_KEY = ('granularity', 'dimension', 'dimension_key', 'bucket')
+
+
+def bucket_start(when, granularity):
+    """Start of the hour or day ``when`` falls in"""
+    if granularity == 'day':
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def area_of(geohash):
+    return geohash[:AREA_PRECISION] if geohash else None
+
+
+def _dimension_keys(row, event):
+    yield 'all', ''
+    yield 'restaurant', str(row.restaurant_id)
+    if event == 'claimed':
+        yield 'ngo', str(row.claimed_by_id)
+    if row.geohash:
+        yield 'area', area_of(row.geohash)
+
+
+def _latency_bin(row):
+    minutes = (row.claimed_at - row.created_at).total_seconds() / 60
+    return bisect_right(LATENCY_BINS, minutes)
+
+
+def _tally(rows, event, sign=1):
+    """Count ``rows`` into (bucket key -> n) for the event, plus latency
+    bins for claims"""
+    counts, latency = Counter(), Counter()
+    column = EVENTS[event].key
+    for row in rows:
+        when = getattr(row, column)
+        if when is None:
+            continue
+        latency_bin = _latency_bin(row) if event == 'claimed' else None
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(when, granularity)
+            for dimension, key in _dimension_keys(row, event):
+                counts[granularity, dimension, key, bucket] += sign
+                if latency_bin is not None:
+                    latency[granularity, dimension, key, bucket, latency_bin] += sign
+    return counts, latency
+
+
+def _upsert_add(model, rows, column):
+    """Insert ``rows``, adding ``column`` to the rows that already exist"""
+    if not rows:
+        return
+    table = model.__table__
+    primary_key = [c.name for c in table.primary_key]
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_={column: table.c[column] + statement.excluded[column]},
+        )
+        db.session.execute(statement, rows)
+        return
+
+    # Without ON CONFLICT: add to the existing row, or insert it
+    for row in rows:
+        match = [table.c[name] == row[name] for name in primary_key]
+        added = update(table).where(*match).values({column: table.c[column] + row[column]})
+        if db.session.execute(added).rowcount == 0:
+            db.session.execute(insert(table).values(row))
+
+
+def _apply(event, counts, latency):
+    # Sorted, so concurrent transactions lock bucket rows in the same order
+    _upsert_add(DonationRollup, [
+        {**dict(zip(_KEY, key)), event: n} for key, n in sorted(counts.items()) if n
+    ], event)
+    _upsert_add(ClaimLatencyRollup, [
+        {**dict(zip(_KEY + ('bin',), key)), 'count': n} for key, n in sorted(latency.items()) if n
+    ], 'count')
+
+
+def record(event, rows, sign=1):
+    """Count ``rows`` (donations, or rows with the ``ROLLUP_COLUMNS``) as
+    ``event`` in the current transaction. ``sign=-1`` takes them back out."""
+    _apply(event, *_tally(rows, event, sign))
+
+
+def record_ids(event, donation_ids, sign=1):
+    """``record`` for donations known only by id"""
+    if donation_ids:
+        rows = db.session.execute(select(*ROLLUP_COLUMNS).where(Donation.id.in_(donation_ids))).all()
+        record(event, rows, sign)
+
+
+def backfill(since=None, batch_size=5000):
+    """Rebuild the rollups from the donation table, from the start of the
+    day ``since`` falls in (everything without it) and commit. Donations
+    are streamed ``batch_size`` at a time. Returns the number of events."""
+    if since is not None:
+        since = bucket_start(since, 'day')
+    for model in (DonationRollup, ClaimLatencyRollup):
+        stale = delete(model)
+        if since is not None:
+            stale = stale.where(model.bucket >= since)
+        db.session.execute(stale)
+
+    total = 0
+    for event, column in EVENTS.items():
+        query = select(*ROLLUP_COLUMNS).where(column.is_not(None)).order_by(column)
+        if event == 'expired':
+            query = query.where(Donation.status == 'expired')
+        if since is not None:
+            query = query.where(column >= since)
+        # Sorted by event time, so each batch touches few buckets
+        result = db.session.execute(query.execution_options(yield_per=batch_size))
+        for rows in result.partitions():
+            _apply(event, *_tally(rows, event))
+            total += len(rows)
+    db.session.commit()
+    return total
+
+
+# ---------- READING ----------
+
+def median_latency(histogram):
+    """Median claim latency in minutes from a {bin: count} histogram,
+    interpolated within its bin. None without claims."""
+    total = sum(histogram.values())
+    if total <= 0:
+        return None
+    half, seen = total / 2, 0
+    for latency_bin in sorted(histogram):
+        count = histogram[latency_bin]
+        if count <= 0:
+            continue
+        if seen + count >= half:
+            low = LATENCY_BINS[latency_bin - 1] if latency_bin else 0
+            high = LATENCY_BINS[latency_bin] if latency_bin < len(LATENCY_BINS) else low * 2
+            return round(low + (high - low) * (half - seen) / count, 1)
+        seen += count
+    return None
+
+
+def _where(model, granularity, dimension, start, end):
+    return (model.granularity == granularity, model.dimension == dimension,
+            model.bucket >= start, model.bucket < end)
+
+
+def series(granularity, dimension, key, start, end):
+    """One point per bucket in [start, end), zeros where nothing happened,
+    and the median latency over the whole range. Two primary-key range
+    scans."""
+    where = (*_where(DonationRollup, granularity, dimension, start, end),
+             DonationRollup.dimension_key == key)
+    rows = {row.bucket: row for row in db.session.execute(
+        select(DonationRollup.bucket, DonationRollup.posted, DonationRollup.claimed,
+               DonationRollup.expired).where(*where)
+    )}
+    histograms, overall = defaultdict(Counter), Counter()
+    for bucket, latency_bin, count in db.session.execute(
+        select(ClaimLatencyRollup.bucket, ClaimLatencyRollup.bin, ClaimLatencyRollup.count)
+        .where(*_where(ClaimLatencyRollup, granularity, dimension, start, end),
+               ClaimLatencyRollup.dimension_key == key)
+    ):
+        histograms[bucket][latency_bin] += count
+        overall[latency_bin] += count
+
+    points = []
+    bucket, step = bucket_start(start, granularity), GRANULARITIES[granularity]
+    while bucket < end:
+        row = rows.get(bucket)
+        points.append({
+            'bucket': utc_timestamp(bucket),
+            'posted': row.posted if row else 0,
+            'claimed': row.claimed if row else 0,
+            'expired': row.expired if row else 0,
+            'median_claim_minutes': median_latency(histograms.get(bucket, {})),
+        })
+        bucket += step
+    return points, median_latency(overall)
+
+
+def breakdown(granularity, dimension, start, end, limit=10):
+    """The busiest ``limit`` restaurants, NGOs or areas over [start, end),
+    with their totals and median claim latency"""
+    ranked_by = DonationRollup.claimed if dimension == 'ngo' else DonationRollup.posted
+    rows = db.session.execute(
+        select(DonationRollup.dimension_key,
+               func.sum(DonationRollup.posted).label('posted'),
+               func.sum(DonationRollup.claimed).label('claimed'),
+               func.sum(DonationRollup.expired).label('expired'))
+        .where(*_where(DonationRollup, granularity, dimension, start, end))
+        .group_by(DonationRollup.dimension_key)
+        .order_by(func.sum(ranked_by).desc())
+        .limit(limit)
+    ).all()
+    if not rows:
+        return []
+
+    histograms = defaultdict(Counter)
+    for key, latency_bin, count in db.session.execute(
+        select(ClaimLatencyRollup.dimension_key, ClaimLatencyRollup.bin,
+               func.sum(ClaimLatencyRollup.count))
+        .where(*_where(ClaimLatencyRollup, granularity, dimension, start, end),
+               ClaimLatencyRollup.dimension_key.in_([row.dimension_key for row in rows]))
+        .group_by(ClaimLatencyRollup.dimension_key, ClaimLatencyRollup.bin)
+    ):
+        histograms[key][latency_bin] += count
+    return [{
+        'key': row.dimension_key,
+        'posted': int(row.posted),
+        'claimed': int(row.claimed),
+        'expired': int(row.expired),
+        'median_claim_minutes': median_latency(histograms[row.dimension_key]),
+    } for row in rows]
+
+
+def init_rollups(app):
+    @app.cli.command('rollups-backfill')
+    @click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Only rebuild days from this UTC date on (default: everything).')
+    @click.option('--batch-size', default=5000, show_default=True)
+    def rollups_backfill(since, batch_size):
+        """Rebuild the trend rollups from the donation table."""
+        click.echo(f'Rolled up {backfill(since, batch_size)} events')
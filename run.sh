@@ -21,6 +21,10 @@ pip install -r requirements.txt
 # Create uploads directory
 mkdir -p static/uploads
 
+# Fingerprint and compress static assets
+echo "Building static assets..."
+flask --app app assets-build
+
 # Initialize database with sample data
 echo "Initializing database..."
 python create_db.py
@@ -0,0 +1,194 @@
+"""Ranked full-text and location search over donations.
+
+Two backends, picked from the database dialect:
+
+- PostgreSQL: a GIN index on a ``tsvector`` of title, description, food type
+  and address for text search, plus a ``pg_trgm`` GIN index on ``address`` so
+  substring location matches use an index instead of a table scan.
+- SQLite: an FTS5 table (``donation_fts``) using the trigram tokenizer, kept
+  in sync with ``donation`` by triggers. Trigrams make substring matches
+  ("adhapur" finds "Madhapur") index-backed as well.
+
+Anything else, or a SQLite database that hasn't been migrated yet, falls
+back to ``LIKE '%term%'``.
+"""
+import re
+
+from sqlalchemy import DDL, event, func, inspect, literal_column, select, text
+
+from models import Donation, db
+
+# Trigram indexes can't help with terms shorter than one trigram
+MIN_TRIGRAM_LENGTH = 3
+
+# bm25() column weights for title, description, food_type, address
+FTS_WEIGHTS = (10.0, 1.0, 5.0, 2.0)
+
+TSVECTOR_CONFIG = 'simple'
+
+# NUL ends an FTS5 query string early ("unterminated string") and Postgres
+# rejects it in text, so control characters are dropped from search input
+_CONTROL_CHARACTERS = re.compile(r'[\x00-\x1f\x7f]')
+
+# Must stay identical to the expression indexed in the migration, or
+# Postgres won't use the index
+SEARCH_DOCUMENT_SQL = (
+    "coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || "
+    "coalesce(food_type, '') || ' ' || coalesce(address, '')"
+)
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS donation_fts USING fts5(
+        title, description, food_type, address,
+        content='donation', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS donation_fts_ai AFTER INSERT ON donation BEGIN
+        INSERT INTO donation_fts(rowid, title, description, food_type, address)
+        VALUES (new.id, new.title, new.description, new.food_type, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS donation_fts_ad AFTER DELETE ON donation BEGIN
+        INSERT INTO donation_fts(donation_fts, rowid, title, description, food_type, address)
+        VALUES ('delete', old.id, old.title, old.description, old.food_type, old.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS donation_fts_au
+    AFTER UPDATE OF title, description, food_type, address ON donation BEGIN
+        INSERT INTO donation_fts(donation_fts, rowid, title, description, food_type, address)
+        VALUES ('delete', old.id, old.title, old.description, old.food_type, old.address);
+        INSERT INTO donation_fts(rowid, title, description, food_type, address)
+        VALUES (new.id, new.title, new.description, new.food_type, new.address);
+    END""",
+]
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""CREATE INDEX IF NOT EXISTS ix_donation_search_document ON donation
+        USING gin (to_tsvector('{TSVECTOR_CONFIG}', {SEARCH_DOCUMENT_SQL}))""",
+    """CREATE INDEX IF NOT EXISTS ix_donation_address_trgm ON donation
+        USING gin (address gin_trgm_ops)""",
+]
+
+# Databases built with db.create_all() get the same search structures as
+# migrated ones
+for statement in SQLITE_DDL:
+    event.listen(Donation.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(Donation.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+_fts_tables = {}
+
+
+def _has_fts_table(bind):
+    url = str(bind.engine.url)
+    if url not in _fts_tables:
+        _fts_tables[url] = inspect(bind).has_table('donation_fts')
+    return _fts_tables[url]
+
+
+def backend_name():
+    bind = db.session.get_bind()
+    if bind.dialect.name == 'postgresql':
+        return 'postgresql'
+    if bind.dialect.name == 'sqlite' and _has_fts_table(bind):
+        return 'sqlite'
+    return 'like'
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _search_sqlite(query, text_query, location):
+    clauses = []
+    if text_query:
+        terms = text_query.split()
+        long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+        short_terms = [t for t in terms if len(t) < MIN_TRIGRAM_LENGTH]
+        if long_terms:
+            columns = '{title description food_type address}'
+            clauses.append(columns + ' : (' + ' '.join(_fts_phrase(t) for t in long_terms) + ')')
+        if short_terms:
+            # Too short for the trigram index; matched with LIKE among the
+            # rows the index found (or among all rows without long terms)
+            query = _search_like(query, ' '.join(short_terms), None)
+    if location:
+        if len(location) >= MIN_TRIGRAM_LENGTH:
+            clauses.append('address : ' + _fts_phrase(location))
+        else:
+            query = _search_like(query, None, location)
+    if not clauses:
+        return query
+
+    fts = literal_column('donation_fts')
+    # MATERIALIZED runs the MATCH once. As a plain subquery SQLite may loop
+    # over donations first and run the MATCH once per row, which also
+    # happens inside paginate()'s count(*).
+    matches = (
+        select(
+            literal_column('rowid').label('donation_id'),
+            func.bm25(fts, *FTS_WEIGHTS).label('rank'),
+        )
+        .select_from(text('donation_fts'))
+        .where(fts.op('MATCH')(' AND '.join(clauses)))
+        .cte('donation_fts_matches')
+        .prefix_with('MATERIALIZED')
+    )
+    # bm25() is lower for better matches
+    return (
+        query.join(matches, Donation.id == matches.c.donation_id)
+        .order_by(None)
+        .order_by(matches.c.rank, Donation.created_at.desc())
+    )
+
+
+def _search_postgres(query, text_query, location):
+    ranks = []
+    if text_query:
+        document = func.to_tsvector(TSVECTOR_CONFIG, literal_column(SEARCH_DOCUMENT_SQL))
+        tsquery = func.websearch_to_tsquery(TSVECTOR_CONFIG, text_query)
+        query = query.filter(document.op('@@')(tsquery))
+        ranks.append(func.ts_rank(document, tsquery))
+    if location:
+        # ILIKE '%x%' is served by the gin_trgm_ops index
+        query = query.filter(Donation.address.ilike(f'%{_escape_like(location)}%', escape='\\'))
+        ranks.append(func.similarity(Donation.address, location))
+    if not ranks:
+        return query
+
+    rank = ranks[0] if len(ranks) == 1 else ranks[0] + ranks[1]
+    return query.order_by(None).order_by(rank.desc(), Donation.created_at.desc())
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _search_like(query, text_query, location):
+    if text_query:
+        for term in text_query.split():
+            pattern = f'%{_escape_like(term)}%'
+            query = query.filter(
+                Donation.title.ilike(pattern, escape='\\')
+                | Donation.description.ilike(pattern, escape='\\')
+                | Donation.food_type.ilike(pattern, escape='\\')
+                | Donation.address.ilike(pattern, escape='\\')
+            )
+    if location:
+        query = query.filter(Donation.address.ilike(f'%{_escape_like(location)}%', escape='\\'))
+    return query
+
+
+def search_donations(query, text_query=None, location=None):
+    """Restrict a Donation query to matches for ``text_query`` (title,
+    description, food type, address) and/or ``location`` (address), ordered
+    best match first. The result is still a query, so it can be paginated."""
+    text_query = _CONTROL_CHARACTERS.sub(' ', text_query or '').strip()
+    location = _CONTROL_CHARACTERS.sub(' ', location or '').strip()
+    if not text_query and not location:
+        return query
+
+    backend = backend_name()
+    if backend == 'postgresql':
+        return _search_postgres(query, text_query, location)
+    if backend == 'sqlite':
+        return _search_sqlite(query, text_query, location)
+    return _search_like(query, text_query, location)
@@ -0,0 +1,37 @@
+// Keeps "time left" labels current without reloading the page.
+//
+// Expiry times are rendered as
+//   <time datetime="2024-05-01T18:30:00Z" data-countdown>3 hours left</time>
+// and relabelled from the timestamp on load and every 30 seconds, so pages
+// served from the response cache still show the right time left. Keep
+// formatTimeLeft in step with format_time_left in timeleft.py.
+(function () {
+  var INTERVAL_MS = 30000;
+
+  function formatTimeLeft(seconds) {
+    if (seconds < 0) {
+      return "Expired";
+    }
+    var hours = Math.floor(seconds / 3600);
+    if (hours > 24) {
+      return Math.floor(hours / 24) + " days left";
+    }
+    if (hours >= 1) {
+      return hours + " hours left";
+    }
+    return Math.floor((seconds % 3600) / 60) + " minutes left";
+  }
+
+  function update() {
+    var now = Date.now();
+    document.querySelectorAll("time[data-countdown]").forEach(function (el) {
+      var expires = Date.parse(el.getAttribute("datetime"));
+      if (!isNaN(expires)) {
+        el.textContent = formatTimeLeft((expires - now) / 1000);
+      }
+    });
+  }
+
+  update();
+  setInterval(update, INTERVAL_MS);
+})();
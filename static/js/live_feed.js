@@ -0,0 +1,99 @@
+// Live donation updates from /donations/stream (Server-Sent Events).
+//
+// Pages opt in with an element like
+//   <div id="live-feed" data-stream-url="/donations/stream"></div>
+// New donations are announced inside it, and cards marked with
+// data-donation-id are greyed out once their donation is claimed or expires.
+(function () {
+  var feed = document.getElementById("live-feed");
+  if (!feed || !window.EventSource) {
+    return;
+  }
+
+  var source = new EventSource(feed.dataset.streamUrl);
+
+  function announce(donation) {
+    var alert = document.createElement("div");
+    alert.className = "alert alert-success alert-dismissible fade show";
+
+    var text = document.createElement("span");
+    text.textContent =
+      "New donation: " + donation.title + " (" + donation.quantity + ", " +
+      donation.food_type + ") from " + donation.restaurant_name + " at " +
+      donation.address + " ";
+
+    var link = document.createElement("a");
+    link.href = "/donations/" + donation.id;
+    link.className = "alert-link";
+    link.textContent = "View & Claim";
+
+    var close = document.createElement("button");
+    close.type = "button";
+    close.className = "btn-close";
+    close.setAttribute("data-bs-dismiss", "alert");
+
+    alert.append(text, link, close);
+    feed.prepend(alert);
+  }
+
+  function announceBatch(batch) {
+    var alert = document.createElement("div");
+    alert.className = "alert alert-success alert-dismissible fade show";
+
+    var text = document.createElement("span");
+    text.textContent =
+      batch.count + " new donations from " + batch.restaurant_name + " ";
+
+    var link = document.createElement("a");
+    link.href = "/donations/list";
+    link.className = "alert-link";
+    link.textContent = "View & Claim";
+
+    var close = document.createElement("button");
+    close.type = "button";
+    close.className = "btn-close";
+    close.setAttribute("data-bs-dismiss", "alert");
+
+    alert.append(text, link, close);
+    feed.prepend(alert);
+  }
+
+  function markUnavailable(ids, label) {
+    ids.forEach(function (id) {
+      document
+        .querySelectorAll('[data-donation-id="' + id + '"]')
+        .forEach(function (card) {
+          if (card.classList.contains("opacity-50")) {
+            return;
+          }
+          card.classList.add("opacity-50");
+          var badge = document.createElement("span");
+          badge.className = "badge bg-secondary m-2";
+          badge.textContent = label;
+          card.prepend(badge);
+          card.querySelectorAll("a.btn").forEach(function (button) {
+            button.classList.add("disabled");
+          });
+        });
+    });
+  }
+
+  source.addEventListener("donation.created", function (e) {
+    announce(JSON.parse(e.data));
+  });
+  source.addEventListener("donations.imported", function (e) {
+    announceBatch(JSON.parse(e.data));
+  });
+  source.addEventListener("donation.claimed", function (e) {
+    markUnavailable(JSON.parse(e.data).ids, "Just claimed");
+  });
+  source.addEventListener("donation.expired", function (e) {
+    markUnavailable(JSON.parse(e.data).ids, "Expired");
+  });
+  source.addEventListener("donation.status", function (e) {
+    var data = JSON.parse(e.data);
+    if (data.status !== "active") {
+      markUnavailable(data.ids, "No longer available");
+    }
+  });
+})();
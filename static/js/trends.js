@@ -0,0 +1,115 @@
+// Line charts for the admin trends page.
+//
+// The page embeds one point per bucket as JSON in #trend-data, e.g.
+//   {"bucket": "2024-05-01T00:00:00Z", "posted": 4, "claimed": 3,
+//    "expired": 1, "median_claim_minutes": 42.5}
+// and marks each chart with the fields it plots:
+//   <div data-trend-chart="posted,claimed,expired"></div>
+// Null values (no claims in a bucket) leave a gap in the line.
+(function () {
+  var WIDTH = 900;
+  var HEIGHT = 240;
+  var PAD = { top: 10, right: 10, bottom: 30, left: 45 };
+  var COLORS = {
+    posted: "#0d6efd",
+    claimed: "#198754",
+    expired: "#dc3545",
+    median_claim_minutes: "#6f42c1",
+  };
+  var SVG = "http://www.w3.org/2000/svg";
+
+  function el(name, attrs, text) {
+    var node = document.createElementNS(SVG, name);
+    Object.keys(attrs).forEach(function (key) {
+      node.setAttribute(key, attrs[key]);
+    });
+    if (text !== undefined) {
+      node.textContent = text;
+    }
+    return node;
+  }
+
+  function label(bucket) {
+    // "2024-05-01T13:00:00Z" -> "05-01" or "05-01 13h"
+    var hour = bucket.slice(11, 13);
+    return bucket.slice(5, 10) + (hour === "00" ? "" : " " + hour + "h");
+  }
+
+  function draw(container, points, fields) {
+    var max = 0;
+    points.forEach(function (point) {
+      fields.forEach(function (field) {
+        if (point[field] !== null && point[field] > max) {
+          max = point[field];
+        }
+      });
+    });
+    max = max || 1;
+
+    var plotWidth = WIDTH - PAD.left - PAD.right;
+    var plotHeight = HEIGHT - PAD.top - PAD.bottom;
+    var x = function (i) {
+      return PAD.left + (points.length > 1 ? (i * plotWidth) / (points.length - 1) : plotWidth / 2);
+    };
+    var y = function (value) {
+      return PAD.top + plotHeight - (value * plotHeight) / max;
+    };
+
+    var svg = el("svg", { viewBox: "0 0 " + WIDTH + " " + HEIGHT, width: "100%", role: "img" });
+    [0, 0.5, 1].forEach(function (share) {
+      var value = max * share;
+      svg.appendChild(el("line", {
+        x1: PAD.left, x2: WIDTH - PAD.right, y1: y(value), y2: y(value),
+        stroke: "#dee2e6",
+      }));
+      svg.appendChild(el("text", {
+        x: PAD.left - 5, y: y(value) + 4, "text-anchor": "end", "font-size": 11,
+      }, Math.round(value)));
+    });
+    var every = Math.max(1, Math.ceil(points.length / 10));
+    points.forEach(function (point, i) {
+      if (i % every === 0) {
+        svg.appendChild(el("text", {
+          x: x(i), y: HEIGHT - 8, "text-anchor": "middle", "font-size": 11,
+        }, label(point.bucket)));
+      }
+    });
+
+    fields.forEach(function (field) {
+      var path = "";
+      var drawing = false;
+      points.forEach(function (point, i) {
+        if (point[field] === null) {
+          drawing = false;
+          return;
+        }
+        path += (drawing ? "L" : "M") + x(i).toFixed(1) + " " + y(point[field]).toFixed(1);
+        drawing = true;
+      });
+      svg.appendChild(el("path", {
+        d: path, fill: "none", stroke: COLORS[field] || "#333", "stroke-width": 2,
+      }));
+    });
+    container.appendChild(svg);
+
+    var legend = document.createElement("div");
+    legend.className = "small mt-2";
+    fields.forEach(function (field) {
+      var item = document.createElement("span");
+      item.className = "me-3";
+      item.style.color = COLORS[field] || "#333";
+      item.textContent = "■ " + field.replace(/_/g, " ");
+      legend.appendChild(item);
+    });
+    container.appendChild(legend);
+  }
+
+  var data = document.getElementById("trend-data");
+  if (!data) {
+    return;
+  }
+  var points = JSON.parse(data.textContent);
+  document.querySelectorAll("[data-trend-chart]").forEach(function (container) {
+    draw(container, points, container.getAttribute("data-trend-chart").split(","));
+  });
+})();
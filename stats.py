@@ -0,0 +1,109 @@
+"""Platform statistics for the admin pages.
+
+``compute_counts`` gets every user-role and donation-status count in a
+single conditional-aggregation query. ``get_counts`` serves the same numbers
+from the ``stat_counter`` table, which views keep current by calling the
+``record_*`` helpers inside the transaction that changes the data.
+"""
+import click
+from sqlalchemy import case, func, select, true, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Donation, StatCounter, User, db
+
+USER_ROLES = ('restaurant', 'ngo', 'admin')
+DONATION_STATUSES = ('active', 'claimed', 'completed', 'expired', 'removed')
+
+COUNTER_NAMES = (
+    ['users_total'] + [f'users_{role}' for role in USER_ROLES]
+    + ['donations_total'] + [f'donations_{status}' for status in DONATION_STATUSES]
+)
+
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def compute_counts():
+    """Every counter, computed from the base tables in one round trip"""
+    users = select(
+        func.count().label('users_total'),
+        *[_count_where(User.role == role).label(f'users_{role}') for role in USER_ROLES],
+    ).subquery()
+    donations = select(
+        func.count().label('donations_total'),
+        *[_count_where(Donation.status == status).label(f'donations_{status}')
+          for status in DONATION_STATUSES],
+    ).subquery()
+
+    # Both sides are single-row aggregates, so the join is one row too
+    row = db.session.execute(
+        select(users, donations).select_from(users.join(donations, true()))
+    ).one()
+    return {name: int(getattr(row, name)) for name in COUNTER_NAMES}
+
+
+def rebuild_counters():
+    """Recompute the stat_counter table from scratch. Meant for ``flask
+    stats-rebuild`` and seeding, not for running alongside live writes."""
+    counts = compute_counts()
+    existing = {c.name: c for c in StatCounter.query.all()}
+    for name, value in counts.items():
+        if name in existing:
+            existing[name].value = value
+        else:
+            db.session.add(StatCounter(name=name, value=value))
+    db.session.commit()
+    return counts
+
+
+def get_counts():
+    """Counters from the stat_counter table (one indexed read). Counters
+    missing from the table are computed and inserted first; existing rows
+    are left alone, since overwriting them with a snapshot would drop
+    increments committed in the meantime."""
+    counts = dict(db.session.query(StatCounter.name, StatCounter.value).all())
+    missing = [name for name in COUNTER_NAMES if name not in counts]
+    if missing:
+        computed = compute_counts()
+        db.session.add_all([StatCounter(name=name, value=computed[name]) for name in missing])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request inserted them first
+            db.session.rollback()
+        counts = dict(db.session.query(StatCounter.name, StatCounter.value).all())
+    return {name: int(counts[name]) for name in COUNTER_NAMES}
+
+
+def _adjust(**deltas):
+    """Atomically add to counters in the current transaction"""
+    for name, delta in deltas.items():
+        if delta:
+            db.session.execute(
+                update(StatCounter)
+                .where(StatCounter.name == name)
+                .values(value=StatCounter.value + delta)
+            )
+
+
+def record_donation_created(status='active', count=1):
+    _adjust(donations_total=count, **{f'donations_{status}': count})
+
+
+def record_status_change(old_status, new_status, count=1):
+    if old_status == new_status:
+        return
+    _adjust(**{f'donations_{old_status}': -count, f'donations_{new_status}': count})
+
+
+def record_user_created(role):
+    _adjust(users_total=1, **{f'users_{role}': 1})
+
+
+def init_stats(app):
+    @app.cli.command('stats-rebuild')
+    def stats_rebuild():
+        """Recompute the precomputed platform counters."""
+        for name, value in rebuild_counters().items():
+            click.echo(f"{name}: {value}")
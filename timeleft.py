@@ -0,0 +1,53 @@
+"""Time-left labels for donation expiry.
+
+Pages render each expiry as
+``<time datetime="2024-05-01T18:30:00Z" data-countdown>3 hours left</time>``.
+``static/js/countdown.js`` recomputes the label from the timestamp when the
+page loads and then every 30 seconds, so a page served from the response
+cache still shows the right time left. The server-side label is only what
+browsers without JavaScript see. It is computed from one clock reading per
+request, shared by every row on the page. The JSON APIs expose the same
+UTC timestamp as ``expires_at``.
+
+Keep ``format_time_left`` and ``countdown.js`` in step.
+"""
+from datetime import datetime
+
+from flask import g, has_request_context
+from markupsafe import Markup
+
+
+def utc_timestamp(value):
+    """RFC 3339 form of a naive UTC datetime, e.g. 2024-05-01T18:30:00Z"""
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ') if value is not None else None
+
+
+def format_time_left(seconds):
+    if seconds < 0:
+        return "Expired"
+    hours = seconds // 3600
+    if hours > 24:
+        return f"{int(hours // 24)} days left"
+    if hours >= 1:
+        return f"{int(hours)} hours left"
+    return f"{int((seconds % 3600) // 60)} minutes left"
+
+
+def render_now():
+    """The current UTC time, read once per request"""
+    if not has_request_context():
+        return datetime.utcnow()
+    if 'render_now' not in g:
+        g.render_now = datetime.utcnow()
+    return g.render_now
+
+
+def time_left(expiry_time, now=None):
+    return format_time_left((expiry_time - (now or render_now())).total_seconds())
+
+
+def countdown(expiry_time):
+    """A ``<time>`` element that countdown.js keeps up to date"""
+    return Markup('<time datetime="{}" data-countdown>{}</time>').format(
+        utc_timestamp(expiry_time), time_left(expiry_time))
+
@@ -0,0 +1,129 @@
+"""Cached user loading for Flask-Login.
+
+Every authenticated request used to start with a primary-key SELECT on
+``user``. ``load_user`` now returns a ``CachedUser``: a small read-only
+snapshot (id, role, name, email and the geocoded location) kept in a
+response-cache style backend for ``USER_CACHE_TIMEOUT`` seconds.
+
+Snapshots are dropped after any commit that updates or deletes the user
+through the ORM. The ``memory`` backend only drops them in the committing
+process; other processes see the change within ``USER_CACHE_TIMEOUT``, so
+use ``USER_CACHE_BACKEND=redis`` when that matters. Bulk ``UPDATE``
+statements bypass the ORM and must call ``invalidate_user``.
+
+A snapshot has no relationships and cannot be modified. Views that change
+the signed-in user load the ORM row with ``current_user.load()``.
+"""
+from flask import current_app, g, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from cache import CACHE_BACKENDS
+from models import User, db
+
+SNAPSHOT_FIELDS = ('id', 'role', 'name', 'email', 'latitude', 'longitude')
+
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for ``User`` as ``current_user``"""
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, **fields):
+        for name in SNAPSHOT_FIELDS:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CachedUser is read-only; use current_user.load() to change {name}")
+
+    def __repr__(self):
+        return f'<CachedUser {self.id} {self.role}>'
+
+    def load(self):
+        """The session-bound ``User`` row, for views that modify it"""
+        return db.session.get(User, self.id)
+
+
+def get_user_cache():
+    return current_app.extensions['user_cache']
+
+
+def _key(user_id):
+    return f'user:{user_id}'
+
+
+def cached_user(user_id):
+    """The cached snapshot of ``user_id``, or None on a miss"""
+    fields = get_user_cache().get(_key(user_id))
+    return CachedUser(**fields) if fields is not None else None
+
+
+def snapshot_query(user_id):
+    return select(*(getattr(User, name) for name in SNAPSHOT_FIELDS)).where(User.id == user_id)
+
+
+def remember_user(row):
+    """Cache a ``snapshot_query`` row and return its snapshot"""
+    fields = row._asdict()
+    get_user_cache().set(_key(fields['id']), fields, current_app.config.get('USER_CACHE_TIMEOUT', 300))
+    return CachedUser(**fields)
+
+
+def load_user(user_id):
+    """Flask-Login ``user_loader``: a ``CachedUser``, or None"""
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    # Loaded ahead of time by the ASGI entry point (see asgi.py)
+    prefetched = g.get('prefetched_user')
+    if prefetched is not None and prefetched.id == user_id:
+        return prefetched
+    user = cached_user(user_id)
+    if user is None:
+        row = db.session.execute(snapshot_query(user_id)).first()
+        user = remember_user(row) if row is not None else None
+    return user
+
+
+def invalidate_user(user_id):
+    get_user_cache().delete(_key(user_id))
+
+
+# ---------- INVALIDATION ----------
+# Changed users are collected at flush time and dropped from the cache only
+# once the transaction commits
+
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+def _after_commit(session):
+    user_ids = session.info.pop('changed_user_ids', None)
+    if user_ids and has_app_context() and 'user_cache' in current_app.extensions:
+        for user_id in user_ids:
+            invalidate_user(user_id)
+
+
+def _after_rollback(session):
+    session.info.pop('changed_user_ids', None)
+
+
+def init_user_cache(app):
+    name = app.config.get('USER_CACHE_BACKEND', 'memory')
+    if name not in CACHE_BACKENDS:
+        raise RuntimeError(f"Unknown USER_CACHE_BACKEND: {name}")
+    app.extensions['user_cache'] = CACHE_BACKENDS[name](dict(
+        app.config,
+        CACHE_MAX_ENTRIES=app.config.get('USER_CACHE_MAX_ENTRIES', 10000),
+        CACHE_REDIS_URL=app.config.get('USER_CACHE_REDIS_URL') or app.config.get('CACHE_REDIS_URL'),
+    ))
+
+    if not event.contains(User, 'after_update', _user_changed):
+        event.listen(User, 'after_update', _user_changed)
+        event.listen(User, 'after_delete', _user_changed)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
@@ -0,0 +1,191 @@
+"""Per-user donation counters.
+
+Each user has one ``user_stats`` row: donations given (restaurants) or
+taken (NGOs), how many of those are currently claimed, completed or
+expired, and when the user last posted or claimed. The dashboards read
+that one row instead of counting donations on every request.
+
+The ``record_*`` helpers update the rows of every user a change touches
+(the restaurant, and the NGO if the donation has one) with atomic
+``UPDATE ... SET n = n + ?`` statements, in the transaction that makes the
+change. Users without a row yet (for example, created before the table
+existed) get it computed from the donation table on first read.
+
+To find and fix counters that drifted, e.g. after editing donations
+directly in the database:
+
+    flask --app app user-stats-check [--repair]
+"""
+from collections import Counter, defaultdict
+
+import click
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Donation, User, UserStats, db
+
+# Statuses with their own counter
+STATUS_COUNTERS = ('claimed', 'completed', 'expired')
+COUNTERS = ('given', 'taken') + STATUS_COUNTERS
+
+
+# ---------- COMPUTING ----------
+
+def _status_counts():
+    return [func.coalesce(func.sum(case((Donation.status == status, 1), else_=0)), 0).label(status)
+            for status in STATUS_COUNTERS]
+
+
+def compute_user_stats(user_ids=None):
+    """{user_id: counters} computed from the donation table, for every user
+    or only ``user_ids``. Three grouped queries."""
+    users = select(User.id, User.role)
+    given = select(Donation.restaurant_id.label('user_id'), func.count().label('total'),
+                   *_status_counts(), func.max(Donation.created_at).label('last_activity_at'))
+    taken = select(Donation.claimed_by_id.label('user_id'), func.count().label('total'),
+                   *_status_counts(), func.max(Donation.claimed_at).label('last_activity_at'))
+    if user_ids is not None:
+        users = users.where(User.id.in_(user_ids))
+        given = given.where(Donation.restaurant_id.in_(user_ids))
+        taken = taken.where(Donation.claimed_by_id.in_(user_ids))
+    by_restaurant = {row.user_id: row for row in db.session.execute(given.group_by(Donation.restaurant_id))}
+    by_ngo = {row.user_id: row for row in db.session.execute(
+        taken.where(Donation.claimed_by_id.is_not(None)).group_by(Donation.claimed_by_id))}
+
+    computed = {}
+    for user_id, role in db.session.execute(users):
+        counters = dict.fromkeys(COUNTERS, 0)
+        counters['last_activity_at'] = None
+        row, total = None, None
+        if role == 'restaurant':
+            row, total = by_restaurant.get(user_id), 'given'
+        elif role == 'ngo':
+            row, total = by_ngo.get(user_id), 'taken'
+        if row is not None:
+            counters[total] = row.total
+            counters.update({status: int(getattr(row, status)) for status in STATUS_COUNTERS})
+            counters['last_activity_at'] = row.last_activity_at
+        computed[user_id] = counters
+    return computed
+
+
+def get_user_stats(user_id):
+    """The user's counters (one primary-key read). Computes and stores the
+    row first if the user doesn't have one yet."""
+    user_stats = db.session.get(UserStats, user_id)
+    if user_stats is not None:
+        return user_stats
+    user_stats = UserStats(user_id=user_id, **compute_user_stats([user_id]).get(user_id, {}))
+    db.session.add(user_stats)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request stored it first
+        db.session.rollback()
+        user_stats = db.session.get(UserStats, user_id)
+    return user_stats
+
+
+def check_user_stats(repair=False):
+    """Compare every user's row with the donation table. Returns
+    ``(checked, [(user_id, {counter: (stored, expected)} or None)])``, None
+    meaning the row is missing. With ``repair``, rewrites the rows that
+    differ and adds the missing ones."""
+    expected = compute_user_stats()
+    stored = {row.user_id: row for row in UserStats.query}
+    mismatches = []
+    for user_id, counters in sorted(expected.items()):
+        row = stored.get(user_id)
+        if row is None:
+            mismatches.append((user_id, None))
+            if repair:
+                db.session.add(UserStats(user_id=user_id, **counters))
+            continue
+        diff = {name: (getattr(row, name), value) for name, value in counters.items()
+                if getattr(row, name) != value}
+        if diff:
+            mismatches.append((user_id, diff))
+            if repair:
+                for name, value in diff.items():
+                    setattr(row, name, value[1])
+    if repair:
+        db.session.commit()
+    return len(expected), mismatches
+
+
+# ---------- RECORDING ----------
+
+def _latest(column, when):
+    return case((column.is_(None) | (column < when), when), else_=column)
+
+
+def _adjust(deltas, activity=None):
+    """Add ``deltas`` ({user_id: {counter: n}}) and move ``activity``
+    ({user_id: datetime}) forward, in the current transaction. Users
+    without a row are skipped; their row is computed when first read."""
+    activity = activity or {}
+    # Sorted, so concurrent transactions lock user rows in the same order
+    for user_id in sorted(set(deltas) | set(activity)):
+        values = {name: getattr(UserStats, name) + n
+                  for name, n in deltas.get(user_id, {}).items() if n}
+        if user_id in activity:
+            values['last_activity_at'] = _latest(UserStats.last_activity_at, activity[user_id])
+        if values:
+            db.session.execute(update(UserStats).where(UserStats.user_id == user_id).values(values))
+
+
+def _status_deltas(rows, old_status, new_status, deltas):
+    for row in rows:
+        for user_id in (row.restaurant_id, row.claimed_by_id):
+            if user_id is None:
+                continue
+            if old_status in STATUS_COUNTERS:
+                deltas[user_id][old_status] -= 1
+            if new_status in STATUS_COUNTERS:
+                deltas[user_id][new_status] += 1
+    return deltas
+
+
+def record_user_created(user):
+    """A zeroed row for a new user, inserted with it"""
+    user.stats = UserStats(**dict.fromkeys(COUNTERS, 0))
+
+
+def record_donations_created(restaurant_id, created_at, count=1):
+    _adjust({restaurant_id: {'given': count}}, {restaurant_id: created_at})
+
+
+def record_claims(rows):
+    """Donations that were just claimed; ``rows`` have restaurant_id,
+    claimed_by_id and claimed_at"""
+    deltas = _status_deltas(rows, 'active', 'claimed', defaultdict(Counter))
+    activity = {}
+    for row in rows:
+        deltas[row.claimed_by_id]['taken'] += 1
+        activity[row.claimed_by_id] = max(row.claimed_at, activity.get(row.claimed_by_id, row.claimed_at))
+    _adjust(deltas, activity)
+
+
+def record_status_change(rows, old_status, new_status):
+    """Donations moved from ``old_status`` to ``new_status``; ``rows`` have
+    restaurant_id and claimed_by_id"""
+    if old_status != new_status:
+        _adjust(_status_deltas(rows, old_status, new_status, defaultdict(Counter)))
+
+
+def init_user_stats(app):
+    @app.cli.command('user-stats-check')
+    @click.option('--repair', is_flag=True, help='Rewrite the counters that differ.')
+    def user_stats_check(repair):
+        """Compare per-user counters with the donation table."""
+        checked, mismatches = check_user_stats(repair)
+        for user_id, diff in mismatches:
+            if diff is None:
+                click.echo(f'User {user_id}: no counters row')
+                continue
+            details = ', '.join(f'{name} {stored} != {expected}' for name, (stored, expected) in diff.items())
+            click.echo(f'User {user_id}: {details}')
+        verb = 'repaired' if repair else 'out of date'
+        click.echo(f'Checked {checked} users, {len(mismatches)} {verb}')
+        if mismatches and not repair:
+            raise SystemExit(1)